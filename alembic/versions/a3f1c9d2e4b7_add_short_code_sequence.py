@@ -0,0 +1,28 @@
+"""add short code sequence
+
+Revision ID: a3f1c9d2e4b7
+Revises: 65b6acbd60dc
+Create Date: 2026-10-18 10:12:41.512034
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3f1c9d2e4b7'
+down_revision: Union[str, None] = '65b6acbd60dc'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute(sa.schema.CreateSequence(sa.Sequence('short_code_seq')))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute(sa.schema.DropSequence(sa.Sequence('short_code_seq')))
@@ -0,0 +1,61 @@
+"""add visit rollups
+
+Revision ID: c5d02e6f9b13
+Revises: b81e4d7c2a90
+Create Date: 2026-10-18 12:20:05.118274
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5d02e6f9b13'
+down_revision: Union[str, None] = 'b81e4d7c2a90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Значения измерений так же, как в app/rollups.py: для referer - только хост
+DIMENSIONS = {
+    'country': "coalesce(country, '')",
+    'device_type': "coalesce(device_type, '')",
+    'domain_2nd': "coalesce(domain_2nd, '')",
+    'referer': r"coalesce(lower(substring(referer from '^[A-Za-z][A-Za-z0-9+.-]*://(?:[^@/]*@)?([^/:?#]+)')), '')",
+    'total': "''",
+}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('visit_rollups',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('short_code', sa.String(), nullable=False),
+    sa.Column('granularity', sa.String(), nullable=False),
+    sa.Column('bucket_start', sa.DateTime(), nullable=False),
+    sa.Column('dimension', sa.String(), nullable=False),
+    sa.Column('value', sa.String(), nullable=False),
+    sa.Column('count', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('short_code', 'granularity', 'bucket_start', 'dimension', 'value', name='uq_visit_rollups_bucket')
+    )
+    op.create_index(op.f('ix_visit_rollups_short_code'), 'visit_rollups', ['short_code'], unique=False)
+
+    # Заполняем счётчики по уже накопленным визитам
+    for granularity in ('hour', 'day'):
+        for dimension, value in DIMENSIONS.items():
+            op.execute(f"""
+                INSERT INTO visit_rollups (short_code, granularity, bucket_start, dimension, value, count)
+                SELECT short_code, '{granularity}', date_trunc('{granularity}', timestamp),
+                       '{dimension}', {value}, count(*)
+                FROM visits
+                WHERE timestamp IS NOT NULL
+                GROUP BY 1, 3, 5
+            """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_visit_rollups_short_code'), table_name='visit_rollups')
+    op.drop_table('visit_rollups')
@@ -0,0 +1,185 @@
+"""partition visits by month, dictionary-encode domains and device types
+
+Revision ID: f4b2d8e07a19
+Revises: e3c9f0a51d47
+Create Date: 2026-10-18 16:07:38.215604
+
+"""
+from datetime import date, datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f4b2d8e07a19'
+down_revision: Union[str, None] = 'e3c9f0a51d47'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+DEVICE_TYPES = ('bot', 'tablet', 'mobile', 'desktop', 'unknown')
+MONTHS_AHEAD = 3
+
+# Имена индексов глобальны в схеме: индексы старой таблицы переименовываются
+LEGACY_INDEXES = (
+    ('visits_pkey', 'visits_legacy_pkey'),
+    ('ix_visits_timestamp', 'ix_visits_legacy_timestamp'),
+    ('ix_visits_short_code', 'ix_visits_legacy_short_code'),
+    ('ix_visits_owner_id', 'ix_visits_legacy_owner_id'),
+)
+
+
+def _add_months(month: date, count: int) -> date:
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    conn = op.get_bind()
+
+    # Старая таблица переименовывается, её визиты копируются в новую в конце миграции
+    op.rename_table('visits', 'visits_legacy')
+    op.execute('ALTER TABLE visits_legacy DROP CONSTRAINT IF EXISTS visits_short_code_fkey')
+    for old, new in LEGACY_INDEXES:
+        op.execute(f'ALTER INDEX IF EXISTS {old} RENAME TO {new}')
+
+    postgresql.ENUM(*DEVICE_TYPES, name='device_type').create(conn)
+    op.create_table('domains',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('zone', sa.String(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+
+    # Номера новых визитов продолжают старые: курсоры выдачи статистики остаются возрастающими
+    max_id = conn.execute(sa.text('SELECT coalesce(max(id), 0) FROM visits_legacy')).scalar()
+    op.execute(f'CREATE SEQUENCE visit_id_seq START WITH {max_id + 1}')
+
+    op.create_table('visits',
+    sa.Column('id', sa.BigInteger(), server_default=sa.text("nextval('visit_id_seq')"), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=False),
+    sa.Column('owner', sa.Integer(), nullable=True),
+    sa.Column('short_code', sa.String(), nullable=False),
+    sa.Column('domain_id', sa.Integer(), nullable=True),
+    sa.Column('ip_address', postgresql.INET(), nullable=True),
+    sa.Column('device_type', postgresql.ENUM(*DEVICE_TYPES, name='device_type', create_type=False), nullable=False),
+    sa.Column('country', sa.String(length=2), nullable=True),
+    sa.Column('referer', sa.String(), nullable=True),
+    sa.ForeignKeyConstraint(['domain_id'], ['domains.id'], ),
+    sa.ForeignKeyConstraint(['short_code'], ['short_links.short_code'], ),
+    sa.PrimaryKeyConstraint('id', 'timestamp'),
+    postgresql_partition_by='RANGE (timestamp)'
+    )
+    op.create_index(op.f('ix_visits_timestamp'), 'visits', ['timestamp'], unique=False)
+    op.create_index(op.f('ix_visits_short_code'), 'visits', ['short_code'], unique=False)
+    op.create_index('ix_visits_owner_id', 'visits', ['owner', 'id'], unique=False)
+
+    # Месячные секции от первого старого визита до MONTHS_AHEAD месяцев вперёд (как в app/partitions.py)
+    first = conn.execute(sa.text('SELECT min(timestamp) FROM visits_legacy')).scalar() or datetime.now()
+    month = date(first.year, first.month, 1)
+    now = datetime.now()
+    last = _add_months(date(now.year, now.month, 1), MONTHS_AHEAD)
+    while month <= last:
+        op.execute(
+            f"CREATE TABLE visits_{month.year:04d}_{month.month:02d} PARTITION OF visits "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_add_months(month, 1).isoformat()}')"
+        )
+        month = _add_months(month, 1)
+    op.execute('CREATE TABLE visits_default PARTITION OF visits DEFAULT')
+
+    # Перенос старых визитов здесь же, а не отдельной командой после выкладки: пока визиты
+    # лежат в visits_legacy, их не видят статистика и архивация, а визиты удалённых
+    # за это время ссылок остались бы без ссылки (как в app/backfill_visits.py)
+    op.execute("""
+        INSERT INTO domains (name, zone)
+        SELECT DISTINCT domain_2nd, coalesce(domain_1st, domain_2nd)
+        FROM visits_legacy
+        WHERE domain_2nd IS NOT NULL
+        ORDER BY 1
+        ON CONFLICT (name) DO NOTHING
+    """)
+    op.execute("""
+        INSERT INTO visits (id, timestamp, owner, short_code, domain_id, ip_address,
+                            device_type, country, referer)
+        SELECT m.id, coalesce(m.timestamp, 'epoch'), m.owner, m.short_code, d.id,
+               CASE WHEN m.ip_address ~ '^[0-9A-Fa-f:.]+$' THEN m.ip_address::inet END,
+               CASE WHEN m.device_type IN ('bot', 'tablet', 'mobile', 'desktop')
+                    THEN m.device_type ELSE 'unknown' END::device_type,
+               left(m.country, 2), m.referer
+        FROM visits_legacy m
+        JOIN short_links s ON s.short_code = m.short_code
+        LEFT JOIN domains d ON d.name = m.domain_2nd
+    """)
+    # Визиты ссылок, которых уже нет в short_links, - в архив
+    op.execute("""
+        INSERT INTO visit_archives (owner, timestamp, short_code, original_url, domain_1st, domain_2nd,
+                                    ip_address, device_type, country, referer, archived_at, archival_reason)
+        SELECT m.owner, m.timestamp, m.short_code,
+               coalesce(m.original_url, a.original_url, ''), m.domain_1st, m.domain_2nd,
+               m.ip_address, m.device_type, m.country, m.referer,
+               now(), coalesce(a.archival_reason, 'deleted')
+        FROM visits_legacy m
+        LEFT JOIN LATERAL (
+            SELECT original_url, archival_reason FROM short_links_archive
+            WHERE short_code = m.short_code
+            ORDER BY archived_at DESC NULLS LAST
+            LIMIT 1
+        ) a ON true
+        WHERE NOT EXISTS (SELECT 1 FROM short_links s WHERE s.short_code = m.short_code)
+    """)
+    op.drop_table('visits_legacy')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # visits_legacy удаляется при переносе визитов в upgrade
+    op.execute("""
+        CREATE TABLE IF NOT EXISTS visits_legacy (
+            id SERIAL PRIMARY KEY,
+            owner INTEGER,
+            timestamp TIMESTAMP WITHOUT TIME ZONE,
+            short_code VARCHAR NOT NULL,
+            original_url VARCHAR,
+            domain_1st VARCHAR,
+            domain_2nd VARCHAR,
+            ip_address VARCHAR NOT NULL,
+            device_type VARCHAR NOT NULL,
+            country VARCHAR,
+            referer VARCHAR
+        )
+    """)
+    # Визиты из новой таблицы (и перенесённые, и записанные после перехода) возвращаются в старый формат
+    op.execute("""
+        INSERT INTO visits_legacy (id, owner, timestamp, short_code, original_url, domain_1st, domain_2nd,
+                                   ip_address, device_type, country, referer)
+        SELECT v.id, v.owner, v.timestamp, v.short_code, s.original_url, d.zone, d.name,
+               coalesce(host(v.ip_address), 'unknown'), v.device_type::text, v.country, v.referer
+        FROM visits v
+        JOIN short_links s ON s.short_code = v.short_code
+        LEFT JOIN domains d ON d.id = v.domain_id
+    """)
+    op.execute(
+        "SELECT setval(pg_get_serial_sequence('visits_legacy', 'id'), "
+        "(SELECT coalesce(max(id), 0) + 1 FROM visits_legacy), false)"
+    )
+
+    op.drop_table('visits')
+    op.execute('DROP SEQUENCE visit_id_seq')
+    op.drop_table('domains')
+    postgresql.ENUM(name='device_type').drop(op.get_bind())
+
+    op.rename_table('visits_legacy', 'visits')
+    for old, new in LEGACY_INDEXES:
+        op.execute(f'ALTER INDEX IF EXISTS {new} RENAME TO {old}')
+    op.execute('CREATE INDEX IF NOT EXISTS ix_visits_timestamp ON visits (timestamp)')
+    op.execute('CREATE INDEX IF NOT EXISTS ix_visits_short_code ON visits (short_code)')
+    op.execute('CREATE INDEX IF NOT EXISTS ix_visits_owner_id ON visits (owner, id)')
+    # Старые визиты удалённых ссылок могли остаться без ссылки - ограничение не перепроверяем
+    op.execute(
+        'ALTER TABLE visits ADD CONSTRAINT visits_short_code_fkey FOREIGN KEY (short_code) '
+        'REFERENCES short_links (short_code) NOT VALID'
+    )
@@ -0,0 +1,198 @@
+import time
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple, Union
+
+from redis.asyncio import Redis
+from sqlalchemy import String, case, cast, delete, func, insert, literal, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import ARCHIVE_BATCH_SIZE
+from app.database import AsyncSessionLocal
+from app.link_cache import queue_link_invalidation
+from app.click_counters import queue_clicks_delete
+from app.link_store import queue_link_delete, queue_expiry_remove
+from app.metrics import record_archival
+from app.models import Domain, LinkSketch, ShortLink, ShortLinkArchive, Visit, VisitArchive, VisitRollup
+from app.redis_cache import get_redis
+
+# Архивация выполняется на стороне PostgreSQL: строки переносятся запросами
+# INSERT INTO ..._archive SELECT ... FROM (DELETE ... RETURNING ...) порциями
+# по ARCHIVE_BATCH_SIZE ссылок: порция ссылок блокируется, и её визиты и сами
+# ссылки переносятся в одной транзакции. Python не загружает ни ссылки,
+# ни визиты, поэтому память не зависит от числа визитов.
+
+LINK_COLUMNS = (
+    "user_id", "short_code", "original_url", "created_at",
+    "expires_at", "last_access_at", "auto_expires_at",
+)
+VISIT_COLUMNS = (
+    "owner", "timestamp", "short_code", "domain_id", "ip_address", "device_type", "country", "referer",
+)
+# Архив визитов хранит строки, как до перехода visits на справочники
+ARCHIVE_VISIT_COLUMNS = (
+    "owner", "timestamp", "short_code", "original_url", "domain_1st", "domain_2nd",
+    "ip_address", "device_type", "country", "referer",
+)
+
+# Причина архивации: строка или SQL-выражение над столбцами short_links
+Reason = Union[str, Callable]
+
+
+def expiry_reason(columns):
+    """Причина для истёкших ссылок: auto exp - по автоматическому сроку, exp - по заданному."""
+    return case(
+        (columns.auto_expires_at < datetime.now(), "auto exp"),
+        else_="exp",
+    )
+
+
+def _reason_expr(reason: Reason, columns):
+    return reason(columns) if callable(reason) else literal(reason)
+
+
+async def _move_visits(db: AsyncSession, codes: List[str], reason: Reason, limit: int) -> int:
+    """Переносит до limit визитов указанных ссылок в архив одним запросом."""
+    moved = (
+        delete(Visit)
+        .where(Visit.id.in_(
+            select(Visit.id).where(Visit.short_code.in_(codes)).limit(limit)
+        ))
+        .returning(*(getattr(Visit, name) for name in VISIT_COLUMNS))
+        .cte("moved_visits")
+    )
+    links = ShortLink.__table__
+    domains = Domain.__table__
+    columns = {
+        "owner": moved.c.owner,
+        "timestamp": moved.c.timestamp,
+        "short_code": moved.c.short_code,
+        # URL в визитах не хранится - в архив он попадает из ссылки
+        "original_url": links.c.original_url,
+        "domain_1st": domains.c.zone,
+        "domain_2nd": domains.c.name,
+        "ip_address": func.coalesce(func.host(moved.c.ip_address), "unknown"),
+        "device_type": cast(moved.c.device_type, String),
+        "country": moved.c.country,
+        "referer": moved.c.referer,
+    }
+    stmt = insert(VisitArchive).from_select(
+        [*ARCHIVE_VISIT_COLUMNS, "archived_at", "archival_reason"],
+        select(
+            *(columns[name] for name in ARCHIVE_VISIT_COLUMNS),
+            literal(datetime.now()),
+            _reason_expr(reason, links.c),
+        ).select_from(
+            moved
+            .join(links, links.c.short_code == moved.c.short_code)
+            .outerjoin(domains, domains.c.id == moved.c.domain_id)
+        ),
+    )
+    result = await db.execute(stmt)
+    return result.rowcount
+
+
+async def _move_links(db: AsyncSession, codes: List[str], reason: Reason) -> List[Tuple[str, str]]:
+    moved = (
+        delete(ShortLink)
+        .where(ShortLink.short_code.in_(codes))
+        .returning(*(getattr(ShortLink, name) for name in LINK_COLUMNS))
+        .cte("moved_links")
+    )
+    stmt = (
+        insert(ShortLinkArchive)
+        .from_select(
+            [*LINK_COLUMNS, "archived_at", "archival_reason"],
+            select(
+                *(moved.c[name] for name in LINK_COLUMNS),
+                literal(datetime.now()),
+                _reason_expr(reason, moved.c),
+            ),
+        )
+        .returning(ShortLinkArchive.short_code, ShortLinkArchive.original_url)
+    )
+    result = await db.execute(stmt)
+    return [(row.short_code, row.original_url) for row in result]
+
+
+async def archive_links(
+    db: AsyncSession,
+    condition,
+    reason: Reason,
+    batch_size: int = ARCHIVE_BATCH_SIZE,
+    skip_locked: bool = True,
+) -> List[Tuple[str, str]]:
+    """
+    Архивирует ссылки, подходящие под condition, вместе с визитами.
+    Возвращает список (short_code, original_url) перенесённых ссылок.
+    """
+    archived = []
+    visits = 0
+    started = time.perf_counter()
+    while True:
+        # Сначала блокируем ссылки и перепроверяем condition: ссылку, которую успели
+        # продлить или изменить, не трогаем вместе с её визитами. Блокировка не даёт
+        # появиться новым визитам до удаления ссылки
+        locked = await db.execute(
+            select(ShortLink.short_code)
+            .where(condition)
+            .order_by(ShortLink.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=skip_locked)
+        )
+        codes = list(locked.scalars().all())
+        if not codes:
+            break
+
+        # Визиты популярных ссылок переносим несколькими запросами, но в той же транзакции
+        while (moved := await _move_visits(db, codes, reason, batch_size)) >= batch_size:
+            visits += moved
+        visits += moved
+        archived.extend(await _move_links(db, codes, reason))
+        # Статистика архивных ссылок считается по visit_archives
+        await db.execute(delete(VisitRollup).where(VisitRollup.short_code.in_(codes)))
+        await db.execute(delete(LinkSketch).where(LinkSketch.short_code.in_(codes)))
+        await db.commit()
+
+        # Неполная порция - свободных подходящих ссылок больше нет;
+        # занятые другим воркером доберём при следующем запуске
+        if len(codes) < batch_size:
+            break
+
+    # Удаление пользователем и архивация по сроку - разные ряды метрик
+    job = reason if isinstance(reason, str) else "expiry"
+    record_archival(job, time.perf_counter() - started, len(archived), visits)
+    return archived
+
+
+async def forget_links(redis: Redis, links: List[Tuple[str, str]]):
+    """Удаляет архивированные ссылки из Redis и локальных кэшей воркеров."""
+    if not links:
+        return
+    async with redis.pipeline(transaction=False) as pipe:
+        for short_code, original_url in links:
+            queue_link_delete(pipe, short_code, original_url)
+            queue_expiry_remove(pipe, short_code)
+            queue_clicks_delete(pipe, short_code)
+            queue_link_invalidation(pipe, short_code)
+        await pipe.execute()
+
+
+def expired_condition(now: datetime):
+    # Оба столбца проиндексированы, поэтому условие не приводит к полному просмотру таблицы
+    return (ShortLink.auto_expires_at < now) | (ShortLink.expires_at < now)
+
+
+async def archive_expired_links(short_codes: Optional[List[str]] = None) -> List[Tuple[str, str]]:
+    """
+    Архивирует истёкшие ссылки и очищает Redis.
+    short_codes - проверить только эти коды (из расписания), иначе - все ссылки.
+    """
+    now = datetime.now()
+    condition = expired_condition(now)
+    if short_codes is not None:
+        condition = ShortLink.short_code.in_(short_codes) & condition
+    async with AsyncSessionLocal() as db:
+        archived = await archive_links(db, condition, expiry_reason)
+    async with get_redis() as redis:
+        await forget_links(redis, archived)
+    return archived
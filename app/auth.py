@@ -1,9 +1,34 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from fastapi import HTTPException
 from passlib.context import CryptContext
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from app.models import User
+from app.config import BCRYPT_ROUNDS, PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE
+
+# Хэши со стоимостью, отличной от BCRYPT_ROUNDS, считаются устаревшими
+# и пересчитываются при следующем успешном входе
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+# bcrypt отпускает GIL, поэтому хэширование в потоках не блокирует event loop.
+# Одновременно считается не больше PASSWORD_HASH_WORKERS хэшей, ещё PASSWORD_HASH_QUEUE
+# ждут в очереди; остальные запросы сразу получают 503.
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+# Задания в пуле, включая те, чей запрос уже отменён (клиент отключился): bcrypt в потоке
+# не прервать, поэтому счётчик уменьшается по завершении задания, из потока пула
+_pending = 0
+_pending_lock = threading.Lock()
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 def hash_password(password: str) -> str:
     return pwd_context.hash(password)
@@ -11,6 +36,54 @@ def hash_password(password: str) -> str:
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
+
+def _release(_future):
+    global _pending
+    with _pending_lock:
+        _pending -= 1
+
+
+async def _run(func, *args):
+    global _pending
+    with _pending_lock:
+        if _pending >= PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE:
+            raise HTTPException(
+                status_code=503,
+                detail="Сервер перегружен, повторите попытку позже",
+                headers={"Retry-After": "1"},
+            )
+        _pending += 1
+    try:
+        future = _executor.submit(func, *args)
+    except RuntimeError:
+        # Пул уже остановлен
+        _release(None)
+        raise
+    future.add_done_callback(_release)
+    return await asyncio.wrap_future(future)
+
+
+async def hash_password_async(password: str) -> str:
+    return await _run(hash_password, password)
+
+
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Возвращает (пароль верен, новый хэш или None, если пересчёт не нужен)."""
+    return await _run(pwd_context.verify_and_update, plain_password, hashed_password)
+
+
+def shutdown_password_pool():
+    _executor.shutdown(wait=False, cancel_futures=True)
+
+
+def password_pool_stats() -> dict:
+    return {
+        "workers": PASSWORD_HASH_WORKERS,
+        "queue_limit": PASSWORD_HASH_QUEUE,
+        "pending": _pending,
+    }
+
+
 async def get_user(db: AsyncSession, username: str):
     stmt = select(User).where(User.username == username)
     result = await db.execute(stmt)
@@ -18,6 +91,12 @@ async def get_user(db: AsyncSession, username: str):
 
 async def authenticate_user(db: AsyncSession, username: str, password: str):
     user = await get_user(db, username)
-    if not user or not verify_password(password, user.password):
+    if not user:
+        return None
+    verified, new_hash = await verify_and_update_password(password, user.password)
+    if not verified:
         return None
+    if new_hash:
+        user.password = new_hash
+        await db.commit()
     return user
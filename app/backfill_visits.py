@@ -0,0 +1,153 @@
+"""
+Перенос визитов из visits_legacy (старая несекционированная таблица) в секционированную visits.
+
+Миграция f4b2d8e07a19 переносит визиты сама и удаляет visits_legacy. Команда нужна
+для баз, где таблица осталась после прежней версии миграции, переносившей визиты
+отдельно: до переноса статистика и архивация этих визитов не видят.
+
+Визиты переносятся порциями по --chunk строк, каждая порция - в своей
+транзакции: строки удаляются из visits_legacy и вставляются в visits
+одним запросом, поэтому перенос можно прервать и запустить снова.
+Визиты ссылок, которых больше нет в short_links, попадают в visit_archives.
+Счётчики visit_rollups не меняются: старые визиты в них уже учтены.
+
+    python -m app.backfill_visits --chunk 10000
+    python -m app.backfill_visits --drop-legacy   # удалить пустую visits_legacy
+"""
+import argparse
+import asyncio
+import logging
+import time
+
+from sqlalchemy import text
+
+from app.database import AsyncSessionLocal, engine
+from app.logging_setup import setup_logging, shutdown_logging
+from app.partitions import DEFAULT_PARTITION, month_start, months_between, partition_ddl
+
+logger = logging.getLogger(__name__)
+
+# Строки справочника доменов для следующей порции
+_DOMAINS_SQL = """
+    INSERT INTO domains (name, zone)
+    SELECT DISTINCT domain_2nd, coalesce(domain_1st, domain_2nd)
+    FROM (SELECT domain_2nd, domain_1st FROM visits_legacy ORDER BY id LIMIT :chunk) AS next_chunk
+    WHERE domain_2nd IS NOT NULL
+    ORDER BY 1
+    ON CONFLICT (name) DO NOTHING
+"""
+
+# Порция целиком: удаление из visits_legacy и вставка в visits / visit_archives
+_MOVE_SQL = """
+    WITH moved AS (
+        DELETE FROM visits_legacy
+        WHERE id IN (SELECT id FROM visits_legacy ORDER BY id LIMIT :chunk)
+        RETURNING *
+    ),
+    active AS (
+        INSERT INTO visits (id, timestamp, owner, short_code, domain_id, ip_address,
+                            device_type, country, referer)
+        SELECT m.id, coalesce(m.timestamp, 'epoch'), m.owner, m.short_code, d.id,
+               CASE WHEN m.ip_address ~ '^[0-9A-Fa-f:.]+$' THEN m.ip_address::inet END,
+               CASE WHEN m.device_type IN ('bot', 'tablet', 'mobile', 'desktop')
+                    THEN m.device_type ELSE 'unknown' END::device_type,
+               left(m.country, 2), m.referer
+        FROM moved m
+        JOIN short_links s ON s.short_code = m.short_code
+        LEFT JOIN domains d ON d.name = m.domain_2nd
+        RETURNING 1
+    ),
+    archived AS (
+        INSERT INTO visit_archives (owner, timestamp, short_code, original_url, domain_1st, domain_2nd,
+                                    ip_address, device_type, country, referer, archived_at, archival_reason)
+        SELECT m.owner, m.timestamp, m.short_code,
+               coalesce(m.original_url, a.original_url, ''), m.domain_1st, m.domain_2nd,
+               m.ip_address, m.device_type, m.country, m.referer,
+               now(), coalesce(a.archival_reason, 'deleted')
+        FROM moved m
+        LEFT JOIN LATERAL (
+            SELECT original_url, archival_reason FROM short_links_archive
+            WHERE short_code = m.short_code
+            ORDER BY archived_at DESC NULLS LAST
+            LIMIT 1
+        ) a ON true
+        WHERE NOT EXISTS (SELECT 1 FROM short_links s WHERE s.short_code = m.short_code)
+        RETURNING 1
+    )
+    SELECT (SELECT count(*) FROM moved) AS moved,
+           (SELECT count(*) FROM active) AS active,
+           (SELECT count(*) FROM archived) AS archived
+"""
+
+
+async def _legacy_exists(db) -> bool:
+    result = await db.execute(text("SELECT to_regclass('visits_legacy') IS NOT NULL"))
+    return result.scalar()
+
+
+async def _ensure_partitions(db):
+    """Секции под весь диапазон старых визитов (миграция создала их на момент выкладки)."""
+    result = await db.execute(text("SELECT min(timestamp), max(timestamp) FROM visits_legacy"))
+    first, last = result.one()
+    if first is not None:
+        # timestamp - datetime, секции - по первым числам месяцев
+        for month in months_between(month_start(first), month_start(last)):
+            await db.execute(text(partition_ddl(month)))
+    await db.execute(text(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF visits DEFAULT"))
+    await db.commit()
+
+
+async def backfill(chunk: int) -> dict:
+    totals = {"moved": 0, "active": 0, "archived": 0}
+    started = time.perf_counter()
+    async with AsyncSessionLocal() as db:
+        if not await _legacy_exists(db):
+            logger.info("visits_legacy не найдена, переносить нечего")
+            return totals
+        await _ensure_partitions(db)
+        while True:
+            await db.execute(text(_DOMAINS_SQL), {"chunk": chunk})
+            row = (await db.execute(text(_MOVE_SQL), {"chunk": chunk})).one()
+            await db.commit()
+            for key in totals:
+                totals[key] += getattr(row, key)
+            elapsed = time.perf_counter() - started
+            logger.info(
+                "перенесено %d визитов (в visits %d, в архив %d), %.0f строк/с",
+                totals["moved"], totals["active"], totals["archived"], totals["moved"] / elapsed,
+            )
+            if row.moved < chunk:
+                return totals
+
+
+async def drop_legacy():
+    async with AsyncSessionLocal() as db:
+        if not await _legacy_exists(db):
+            return
+        left = (await db.execute(text("SELECT count(*) FROM visits_legacy"))).scalar()
+        if left:
+            raise SystemExit(f"В visits_legacy осталось {left} визитов, сначала завершите перенос")
+        await db.execute(text("DROP TABLE visits_legacy"))
+        await db.commit()
+        logger.info("visits_legacy удалена")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunk", type=int, default=10000, help="визитов за одну транзакцию")
+    parser.add_argument("--drop-legacy", action="store_true", help="удалить visits_legacy после переноса")
+    args = parser.parse_args()
+
+    setup_logging()
+    try:
+        if args.drop_legacy:
+            await drop_legacy()
+        else:
+            await backfill(args.chunk)
+    finally:
+        await engine.dispose()
+        shutdown_logging()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
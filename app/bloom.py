@@ -0,0 +1,200 @@
+"""
+Фильтр Блума по коротким кодам живых ссылок (short_links), свой у каждого воркера.
+
+Редирект при промахе Redis и проверка занятости alias спрашивают фильтр
+до PostgreSQL: «нет» - кода точно нет, запрос к базе не нужен; «может быть» -
+проверка идёт как раньше. Доля ложных «может быть» - BLOOM_FP_RATE.
+
+Фильтр строится при старте воркера одним проходом по short_links.short_code.
+Новые коды добавляются по событиям link:{код} из cache_bus, которые уже
+рассылаются при создании ссылки; "link:*" (переподключение к каналу) - пересборка.
+Удалить код из фильтра Блума нельзя: архивированные коды остаются ложными
+«может быть» до следующей пересборки - раз в BLOOM_REBUILD_INTERVAL или когда
+кодов стало больше, чем рассчитан фильтр.
+
+Пересобрать фильтры во всех воркерах (например, после ручной правки short_links):
+
+    python -m app.bloom rebuild
+"""
+import argparse
+import asyncio
+import hashlib
+import logging
+import math
+import random
+import time
+from typing import Optional
+
+from sqlalchemy import func, select
+
+from app import cache_bus
+from app.config import BLOOM_FP_RATE, BLOOM_GROWTH, BLOOM_MIN_CAPACITY, BLOOM_REBUILD_INTERVAL
+from app.database import AsyncSessionLocal, engine
+from app.logging_setup import setup_logging, shutdown_logging
+from app.models import ShortLink
+from app.redis_cache import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """m бит и k хэш-функций под capacity элементов и долю ложных срабатываний fp_rate (двойное хэширование)."""
+
+    def __init__(self, capacity: int, fp_rate: float = BLOOM_FP_RATE):
+        if not 0 < fp_rate < 1:
+            raise ValueError("fp_rate: от 0 до 1")
+        self.capacity = max(1, capacity)
+        self.fp_rate = fp_rate
+        self.m = max(8, math.ceil(-self.capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.k = max(1, round(self.m / self.capacity * math.log(2)))
+        self.bits = bytearray((self.m + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        m = self.m
+        return [(h1 + i * h2) % m for i in range(self.k)]
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def expected_fp_rate(self) -> float:
+        """Доля ложных срабатываний при текущем числе элементов."""
+        return (1 - math.exp(-self.k * self.count / self.m)) ** self.k
+
+
+class ShortCodeFilter:
+    """Фильтр кодов воркера. Пока фильтр не построен, might_contain отвечает «может быть»."""
+
+    def __init__(self, fp_rate: float = BLOOM_FP_RATE, rebuild_interval: float = BLOOM_REBUILD_INTERVAL):
+        self.fp_rate = fp_rate
+        self.rebuild_interval = rebuild_interval
+        self._filter: Optional[BloomFilter] = None
+        # Коды, пришедшие во время сборки: попадут в новый фильтр
+        self._building: Optional[list] = None
+        self._rebuild = asyncio.Event()
+
+        # Счётчики
+        self.checks = 0
+        self.negatives = 0
+        self.builds = 0
+        self.last_build_seconds = 0.0
+
+    def might_contain(self, short_code: str) -> bool:
+        bloom = self._filter
+        if bloom is None:
+            return True
+        self.checks += 1
+        if short_code in bloom:
+            return True
+        self.negatives += 1
+        return False
+
+    def add(self, short_code: str):
+        if self._building is not None:
+            self._building.append(short_code)
+        if self._filter is not None:
+            self._filter.add(short_code)
+            if self._filter.count > self._filter.capacity:
+                # Фильтр переполнен - доля ложных срабатываний растёт
+                self._rebuild.set()
+
+    def _on_link_event(self, short_code: str):
+        if short_code == "*":
+            # События могли потеряться - собираем заново
+            self._rebuild.set()
+        else:
+            self.add(short_code)
+
+    async def build(self):
+        """Строит фильтр по short_links одним проходом и подменяет текущий."""
+        started = time.perf_counter()
+        self._building = []
+        try:
+            async with AsyncSessionLocal() as db:
+                total = (await db.execute(select(func.count()).select_from(ShortLink))).scalar()
+                bloom = BloomFilter(max(BLOOM_MIN_CAPACITY, int(total * BLOOM_GROWTH)), self.fp_rate)
+                result = await db.stream(select(ShortLink.short_code).execution_options(yield_per=10000))
+                async for codes in result.scalars().partitions():
+                    for code in codes:
+                        bloom.add(code)
+            for code in self._building:
+                bloom.add(code)
+            self._filter = bloom
+        finally:
+            self._building = None
+        self.builds += 1
+        self.last_build_seconds = time.perf_counter() - started
+        logger.info(
+            "Фильтр коротких кодов построен: %d кодов, %d КБ, %.2f с",
+            bloom.count, len(bloom.bits) // 1024, self.last_build_seconds,
+        )
+
+    async def run(self):
+        """Фоновая задача воркера: первая сборка и пересборки по событию или по интервалу."""
+        while True:
+            try:
+                await self.build()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Ошибка сборки фильтра коротких кодов")
+                # Старый фильтр (или «может быть» без фильтра) остаётся, повторим позже
+                await asyncio.sleep(60)
+                continue
+            self._rebuild.clear()
+            # Разброс, чтобы воркеры не читали short_links одновременно
+            timeout = self.rebuild_interval * random.uniform(0.9, 1.1) if self.rebuild_interval > 0 else None
+            try:
+                await asyncio.wait_for(self._rebuild.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        bloom = self._filter
+        return {
+            "ready": bloom is not None,
+            "codes": bloom.count if bloom else 0,
+            "capacity": bloom.capacity if bloom else 0,
+            "bytes": len(bloom.bits) if bloom else 0,
+            "expected_fp_rate": bloom.expected_fp_rate() if bloom else 0.0,
+            "checks": self.checks,
+            "negatives": self.negatives,
+            "builds": self.builds,
+            "last_build_seconds": self.last_build_seconds,
+        }
+
+
+short_code_filter = ShortCodeFilter()
+
+cache_bus.subscribe("link", short_code_filter._on_link_event)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["rebuild"])
+    parser.parse_args()
+
+    setup_logging()
+    try:
+        # Сборка здесь - проверка, что short_links читается, и оценка размера фильтра воркера
+        await short_code_filter.build()
+        async with get_redis() as redis:
+            # "link:*" сбрасывает локальный кэш ссылок и пересобирает фильтры воркеров
+            await cache_bus.publish(redis, "link", "*")
+        logger.info("Пересборка фильтров запрошена")
+    finally:
+        await engine.dispose()
+        shutdown_logging()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,69 @@
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, List, Union
+
+from redis.asyncio import Redis
+
+from app.config import CACHE_INVALIDATION_CHANNEL
+from app.redis_cache import init_redis, close_redis
+
+logger = logging.getLogger(__name__)
+
+# Рассылка событий инвалидации локальных кэшей между воркерами через Redis pub/sub.
+# Сообщение имеет вид "<тип>:<ключ>", например "link:abc12345".
+# Ключ "*" означает сброс всего кэша данного типа.
+
+Handler = Callable[[str], Union[None, Awaitable[None]]]
+
+_handlers: Dict[str, List[Handler]] = defaultdict(list)
+
+
+def subscribe(kind: str, handler: Handler):
+    """Регистрирует обработчик событий указанного типа (их может быть несколько)."""
+    _handlers[kind].append(handler)
+
+
+async def publish(redis: Redis, kind: str, key: str):
+    try:
+        await redis.publish(CACHE_INVALIDATION_CHANNEL, f"{kind}:{key}")
+    except Exception as e:
+        logger.warning("Не удалось отправить событие инвалидации %s:%s: %s", kind, key, e)
+
+
+def queue_publish(pipe, kind: str, key: str):
+    """Добавляет публикацию события в пайплайн Redis."""
+    pipe.publish(CACHE_INVALIDATION_CHANNEL, f"{kind}:{key}")
+
+
+async def _dispatch(message: str):
+    kind, _, key = message.partition(":")
+    for handler in _handlers.get(kind, ()):
+        result = handler(key)
+        if asyncio.iscoroutine(result):
+            await result
+
+
+async def listen():
+    """Фоновая задача: слушает канал инвалидации и переподключается при обрыве."""
+    reconnect = False
+    while True:
+        redis = await init_redis()
+        try:
+            async with redis.pubsub() as pubsub:
+                await pubsub.subscribe(CACHE_INVALIDATION_CHANNEL)
+                if reconnect:
+                    # Пока не были подписаны, события могли потеряться
+                    for kind in list(_handlers):
+                        await _dispatch(f"{kind}:*")
+                reconnect = True
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        await _dispatch(message["data"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("Потеряно соединение с каналом инвалидации: %s", e)
+            await asyncio.sleep(1)
+        finally:
+            await close_redis(redis)
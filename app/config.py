@@ -8,16 +8,173 @@ POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD")
 POSTGRES_DB = os.getenv("POSTGRES_DB")
 POSTGRES_HOST = os.getenv("POSTGRES_HOST")
 DATABASE_URL = f"postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:5432/{POSTGRES_DB}"
+# Реплика только для чтения (статистика и поиск); не задана - читаем с основной базы
+POSTGRES_REPLICA_HOST = os.getenv("POSTGRES_REPLICA_HOST")
+DATABASE_REPLICA_URL = (
+    f"postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_REPLICA_HOST}:5432/{POSTGRES_DB}"
+    if POSTGRES_REPLICA_HOST else None
+)
+# Пул соединений SQLAlchemy (на каждый воркер и на каждую базу)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))  # сверх DB_POOL_SIZE при пиках
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))  # ожидание свободного соединения, секунд
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))  # пересоздавать соединения старше, секунд
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+# Кэш подготовленных запросов на соединение; 0 - для PgBouncer в режиме transaction
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", 500))
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", 30))  # предел выполнения запроса, секунд
+# JIT PostgreSQL окупается на тяжёлой аналитике, а короткие OLTP-запросы только замедляет
+DB_JIT = os.getenv("DB_JIT", "off")
 
 REDIS_PASSWORD = os.getenv("REDIS_PASSWORD")
 REDIS_HOST = os.getenv("REDIS_HOST")
 REDIS_PORT = os.getenv("REDIS_PORT")
 REDIS_TTL=3*60*60 # 3 hours
+# Общий пул соединений Redis на процесс
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 50))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", 5))  # ожидание свободного соединения, секунд
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", 5))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", 30))  # PING простаивающих соединений
+REDIS_RETRIES = int(os.getenv("REDIS_RETRIES", 3))  # повторы при обрыве соединения
 
 
 
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
+# Кэш проверенных JWT в памяти воркера (app/token_cache.py)
+TOKEN_CACHE_CAPACITY = int(os.getenv("TOKEN_CACHE_CAPACITY", 10000))  # 0 - кэш выключен
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", 300))  # секунд, но не дольше exp токена
+# Сколько воркер может не замечать отзыв токенов, если событие cache_bus потерялось
+TOKEN_GENERATION_TTL = float(os.getenv("TOKEN_GENERATION_TTL", 30))
+# Redis недоступен и поколение токенов не проверить: true - принимать токен по подписи и сроку
+# (отзыв выходом не действует до восстановления Redis), false - отвечать 503
+TOKEN_REVOCATION_FAIL_OPEN = os.getenv("TOKEN_REVOCATION_FAIL_OPEN", "true").lower() in ("1", "true", "yes")
+# Хэширование паролей (app/auth.py)
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))  # стоимость bcrypt; при изменении хэши пересчитываются при входе
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", 4))  # потоков для bcrypt
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", 32))  # ожидающих сверх потоков, дальше - 503
 LINK_EXPIRE_TIME_IN_DAYS_4UNREG =10 # 10 days
-LINK_EXPIRE_TIME_IN_DAYS_REG =30 # 30 days
\ No newline at end of file
+LINK_EXPIRE_TIME_IN_DAYS_REG =30 # 30 days
+
+# Очередь визитов (фоновая пакетная запись кликов)
+VISIT_QUEUE_MAXSIZE = int(os.getenv("VISIT_QUEUE_MAXSIZE", 10000))  # максимум визитов в памяти
+VISIT_BATCH_SIZE = int(os.getenv("VISIT_BATCH_SIZE", 500))  # размер пакета для INSERT
+VISIT_FLUSH_INTERVAL = float(os.getenv("VISIT_FLUSH_INTERVAL", 1.0))  # секунд между сбросами
+# Политика при переполнении: drop_new - отбросить новый визит,
+# drop_oldest - вытеснить самый старый, block - ждать VISIT_ENQUEUE_TIMEOUT секунд
+VISIT_QUEUE_POLICY = os.getenv("VISIT_QUEUE_POLICY", "drop_new")
+VISIT_ENQUEUE_TIMEOUT = float(os.getenv("VISIT_ENQUEUE_TIMEOUT", 0.05))
+VISIT_SHUTDOWN_TIMEOUT = float(os.getenv("VISIT_SHUTDOWN_TIMEOUT", 10.0))  # на дренаж при остановке
+
+# Локальный кэш горячих ссылок (в памяти каждого воркера, перед Redis)
+LINK_CACHE_CAPACITY = int(os.getenv("LINK_CACHE_CAPACITY", 10000))  # 0 - кэш выключен
+LINK_CACHE_TTL = float(os.getenv("LINK_CACHE_TTL", 60))  # секунд
+LINK_CACHE_NEGATIVE_TTL = float(os.getenv("LINK_CACHE_NEGATIVE_TTL", 10))  # 0 - не кэшировать промахи
+CACHE_INVALIDATION_CHANNEL = os.getenv("CACHE_INVALIDATION_CHANNEL", "cache:invalidate")
+
+# Чтение старых ключей shortlink:/short_ui: при промахе по хэшу link: (на время перехода).
+# После REDIS_TTL с момента выкладки старые ключи истекают, и чтение можно выключить.
+REDIS_LEGACY_FALLBACK = os.getenv("REDIS_LEGACY_FALLBACK", "true").lower() in ("1", "true", "yes")
+
+# Генерация коротких кодов
+# sequence - блоки номеров из последовательности PostgreSQL, redis - из счётчика Redis,
+# hex - старый режим: 8 hex-символов SHA-256 с проверкой занятости в Redis и БД
+SHORT_CODE_MODE = os.getenv("SHORT_CODE_MODE", "sequence")
+SHORT_CODE_LENGTH = int(os.getenv("SHORT_CODE_LENGTH", 7))  # минимальная длина base62-кода
+SHORT_CODE_BLOCK_SIZE = int(os.getenv("SHORT_CODE_BLOCK_SIZE", 1000))  # номеров за одно обращение
+SHORT_CODE_SALT = os.getenv("SHORT_CODE_SALT", "shortlinks")  # задаёт перестановку номеров
+SHORT_CODE_INSERT_ATTEMPTS = int(os.getenv("SHORT_CODE_INSERT_ATTEMPTS", 5))  # новых кодов при занятом коде
+
+# Пакетное сокращение ссылок (POST /links/shorten/batch)
+SHORTEN_BATCH_MAX_SIZE = int(os.getenv("SHORTEN_BATCH_MAX_SIZE", 10000))  # ссылок в одном запросе
+# Для запросов без токена; 0 - пакетное сокращение только для авторизованных
+SHORTEN_BATCH_GUEST_MAX_SIZE = int(os.getenv("SHORTEN_BATCH_GUEST_MAX_SIZE", 100))
+SHORTEN_BATCH_INSERT_CHUNK = int(os.getenv("SHORTEN_BATCH_INSERT_CHUNK", 1000))  # строк в одном INSERT
+# true - ошибки отдельных ссылок возвращаются в результатах, остальные сохраняются;
+# false - при любой ошибке не сохраняется ничего (можно переопределить параметром ?atomic=)
+SHORTEN_BATCH_PARTIAL = os.getenv("SHORTEN_BATCH_PARTIAL", "true").lower() in ("1", "true", "yes")
+
+# Архивация ссылок
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", 1000))  # ссылок за транзакцию, визитов за запрос
+# Планировщик истечения: ведущий воркер спит до ближайшего срока из Redis (sorted set)
+EXPIRY_MAX_SLEEP = float(os.getenv("EXPIRY_MAX_SLEEP", 60))  # не спать дольше, секунд
+EXPIRY_RECONCILE_INTERVAL = float(os.getenv("EXPIRY_RECONCILE_INTERVAL", 3600))  # полная сверка с БД
+EXPIRY_LEADER_TTL = float(os.getenv("EXPIRY_LEADER_TTL", 30))  # срок блокировки ведущего, секунд
+
+# Выдача визитов в /active-links/stats и /archive/stats
+STATS_PAGE_SIZE = int(os.getenv("STATS_PAGE_SIZE", 1000))  # визитов на странице по умолчанию
+STATS_MAX_PAGE_SIZE = int(os.getenv("STATS_MAX_PAGE_SIZE", 10000))  # максимум для ?limit=
+STATS_STREAM_CHUNK = int(os.getenv("STATS_STREAM_CHUNK", 1000))  # строк за одну выборку курсора (ndjson/csv)
+
+# Определение страны по IP (app/geoip.py)
+GEOIP_DB_PATH = os.getenv("GEOIP_DB_PATH", "app/GeoLite2-Country.mmdb")
+GEOIP_CACHE_CAPACITY = int(os.getenv("GEOIP_CACHE_CAPACITY", 100000))  # IP в LRU-кэше, 0 - без кэша
+GEOIP_CACHE_TTL = float(os.getenv("GEOIP_CACHE_TTL", 3600))  # секунд
+GEOIP_RELOAD_INTERVAL = float(os.getenv("GEOIP_RELOAD_INTERVAL", 60))  # как часто проверять замену файла
+# true - страна определяется при сбросе визитов в фоне, false - прямо в обработчике редиректа
+GEOIP_DEFERRED = os.getenv("GEOIP_DEFERRED", "true").lower() in ("1", "true", "yes")
+
+# Обогащение визитов при сбросе пакета (app/enrichment.py)
+ENRICH_DOMAIN_CACHE_CAPACITY = int(os.getenv("ENRICH_DOMAIN_CACHE_CAPACITY", 100000))  # доменов ссылок
+ENRICH_UA_CACHE_CAPACITY = int(os.getenv("ENRICH_UA_CACHE_CAPACITY", 10000))  # классифицированных User-Agent
+
+# Секционирование visits по месяцам (app/partitions.py)
+VISIT_PARTITION_MONTHS_AHEAD = int(os.getenv("VISIT_PARTITION_MONTHS_AHEAD", 3))  # секций вперёд
+
+# Метрики Prometheus (app/metrics.py, GET /metrics)
+METRICS_SAMPLE_INTERVAL = float(os.getenv("METRICS_SAMPLE_INTERVAL", 1.0))  # замер задержки event loop и stats(), секунд
+# Допустимая добавка метрик к редиректу, микросекунд (проверяет benchmarks/bench_metrics_overhead.py)
+METRICS_REDIRECT_BUDGET_US = float(os.getenv("METRICS_REDIRECT_BUDGET_US", 50))
+
+# Логирование (app/logging_setup.py)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# Уровни отдельных логгеров: "app.visit_queue=DEBUG,sqlalchemy.engine=INFO"
+LOG_LEVELS = os.getenv("LOG_LEVELS", "uvicorn.access=WARNING")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json или text
+LOG_ACCESS_SAMPLE_RATE = float(os.getenv("LOG_ACCESS_SAMPLE_RATE", 0.01))  # доля запросов в журнале app.access
+LOG_ACCESS_MAX_PER_SECOND = int(os.getenv("LOG_ACCESS_MAX_PER_SECOND", 100))  # 0 - без ограничения
+DB_ECHO = os.getenv("DB_ECHO", "false").lower() in ("1", "true", "yes")  # печать каждого SQL-запроса
+
+# Счётчики кликов в Redis (app/click_counters.py)
+CLICK_RECONCILE_INTERVAL = float(os.getenv("CLICK_RECONCILE_INTERVAL", 10))  # запись кликов в short_links, секунд
+CLICK_RECONCILE_CHUNK = int(os.getenv("CLICK_RECONCILE_CHUNK", 1000))  # ссылок в одном UPDATE
+# Через сколько секунд клики, забранные на сверку упавшим воркером, возвращаются в pending
+CLICK_INFLIGHT_TTL = float(os.getenv("CLICK_INFLIGHT_TTL", 3600))
+CLICK_SEED_LOCK_TTL = float(os.getenv("CLICK_SEED_LOCK_TTL", 30))  # блокировка засева счётчиков, продлевается по ходу, секунд
+
+# Вероятностные сводки визитов для GET /links/{short_code}/insights (app/sketches.py)
+SKETCH_HLL_PRECISION = int(os.getenv("SKETCH_HLL_PRECISION", 12))  # 2^p регистров HyperLogLog, ошибка 1.04/sqrt(2^p)
+SKETCH_TOP_K = int(os.getenv("SKETCH_TOP_K", 50))  # значений в сводке space-saving
+SKETCH_FLUSH_INTERVAL = float(os.getenv("SKETCH_FLUSH_INTERVAL", 60))  # слияние сводок воркера с базой, секунд
+
+# Загрузка ссылки при промахе Redis (редирект)
+# Ключ link: продлевается не на каждом чтении, а с растущей к концу TTL вероятностью
+# (ранее обновление, XFetch): LINK_REFRESH_WINDOW * LINK_REFRESH_BETA - характерное
+# число секунд до истечения, когда горячий ключ будет продлён
+LINK_REFRESH_WINDOW = float(os.getenv("LINK_REFRESH_WINDOW", 60))
+LINK_REFRESH_BETA = float(os.getenv("LINK_REFRESH_BETA", 1.0))
+# Блокировка в Redis на загрузку кода из БД: остальные воркеры ждут запись в Redis
+# не дольше этого срока, секунд; 0 - без блокировки (объединение только внутри воркера)
+LINK_LOAD_LOCK_TTL = float(os.getenv("LINK_LOAD_LOCK_TTL", 0))
+LINK_LOAD_LOCK_POLL = float(os.getenv("LINK_LOAD_LOCK_POLL", 0.02))  # опрос Redis в ожидании, секунд
+
+# Фильтр Блума по коротким кодам (app/bloom.py)
+BLOOM_FP_RATE = float(os.getenv("BLOOM_FP_RATE", 0.01))  # доля ложных «может быть»
+BLOOM_GROWTH = float(os.getenv("BLOOM_GROWTH", 1.5))  # запас ёмкости: кодов при сборке * BLOOM_GROWTH
+BLOOM_MIN_CAPACITY = int(os.getenv("BLOOM_MIN_CAPACITY", 100000))
+BLOOM_REBUILD_INTERVAL = float(os.getenv("BLOOM_REBUILD_INTERVAL", 86400))  # пересборка, секунд; 0 - только по событию
+
+# Ограничение частоты запросов (app/rate_limit.py): "имя=ключ:запросов/секунд:запас,...",
+# например "redirect=ip:100/1:200,shorten=user:20/60:40,shorten_batch=user:5/60:10".
+# Ключ - ip, user (гость - по IP) или token; маршрут без правила не ограничивается.
+# По умолчанию выключено: за балансировщиком IP клиента берётся из X-Forwarded-For,
+# только если адрес балансировщика указан в FORWARDED_ALLOW_IPS (uvicorn)
+RATE_LIMITS = os.getenv("RATE_LIMITS", "")
+RATE_LIMIT_LEASE = int(os.getenv("RATE_LIMIT_LEASE", 5))  # жетонов, которые воркер берёт из Redis за раз
+RATE_LIMIT_LEASE_TTL = float(os.getenv("RATE_LIMIT_LEASE_TTL", 1.0))  # срок жизни взятых жетонов, секунд
+RATE_LIMIT_LOCAL_CAPACITY = int(os.getenv("RATE_LIMIT_LOCAL_CAPACITY", 100000))  # ключей в памяти воркера
+# Сброс нагрузки при исчерпании пула PostgreSQL: сколько запросов может ждать соединение,
+# пока все соединения пула заняты; остальные сразу получают 503. -1 - без ограничения
+DB_SHED_MAX_WAITING = int(os.getenv("DB_SHED_MAX_WAITING", 20))
+DB_SHED_RETRY_AFTER = int(os.getenv("DB_SHED_RETRY_AFTER", 1))  # Retry-After для 503, секунд
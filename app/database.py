@@ -1,16 +1,156 @@
+import contextvars
+from contextlib import asynccontextmanager
+
 from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
     create_async_engine,
     async_sessionmaker
 )
-from app.config import DATABASE_URL
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from app.config import (
+    DATABASE_URL,
+    DATABASE_REPLICA_URL,
+    DB_ECHO,
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT,
+    DB_POOL_RECYCLE,
+    DB_POOL_PRE_PING,
+    DB_STATEMENT_CACHE_SIZE,
+    DB_COMMAND_TIMEOUT,
+    DB_JIT,
+    DB_SHED_MAX_WAITING,
+)
+from app.metrics import instrument_engine
+
+
+class PoolExhausted(Exception):
+    """Все соединения пула заняты и соединение уже ждут DB_SHED_MAX_WAITING запросов."""
+
+
+# Сессии обработчиков запросов (request_session): при исчерпанном пуле им лучше сразу
+# ответить 503. Фоновые задачи (сброс визитов, сверка счётчиков) ждут соединение как обычно.
+shed_on_exhaustion: contextvars.ContextVar[bool] = contextvars.ContextVar("shed_on_exhaustion", default=False)
+
+
+class PoolGuard:
+    """
+    Сброс нагрузки на пуле движка. Считает тех, кто действительно ждёт соединение:
+    пока в пуле есть свободное соединение или место для нового, checkout проходит сразу;
+    когда пул исчерпан, ждать (до pool_timeout) могут не больше max_waiting запросов,
+    остальные запросы получают PoolExhausted (503). Через пул проходят все сессии движка,
+    включая фоновые задачи, поэтому и занятые ими соединения учитываются.
+    """
+
+    def __init__(self, max_waiting: int = DB_SHED_MAX_WAITING, max_overflow: int = DB_MAX_OVERFLOW):
+        self.max_waiting = max_waiting
+        self.max_overflow = max_overflow
+        self.waiting = 0
+
+        # Счётчики
+        self.waits = 0
+        self.shed = 0
+
+    def _exhausted(self, pool: AsyncAdaptedQueuePool) -> bool:
+        """Свободных соединений нет и открыть новое нельзя - checkout будет ждать."""
+        return pool.checkedin() == 0 and 0 <= self.max_overflow <= pool.overflow()
+
+    def checkout(self, pool: AsyncAdaptedQueuePool, get):
+        if not self._exhausted(pool):
+            return get()
+        if 0 <= self.max_waiting <= self.waiting and shed_on_exhaustion.get():
+            self.shed += 1
+            raise PoolExhausted()
+        self.waiting += 1
+        self.waits += 1
+        try:
+            return get()
+        finally:
+            self.waiting -= 1
+
+    def stats(self) -> dict:
+        return {"waiting": self.waiting, "waits": self.waits, "shed": self.shed}
+
 
+def _guarded_pool(guard: PoolGuard):
+    class GuardedPool(AsyncAdaptedQueuePool):
+        # Вызывается при нехватке соединения у пула; пересозданный пул (dispose) - того же класса
+        def _do_get(self):
+            return guard.checkout(self, super()._do_get)
 
-engine = create_async_engine(DATABASE_URL, echo=True)
+    return GuardedPool
+
+
+def _create_engine(url: str, guard: PoolGuard) -> AsyncEngine:
+    return create_async_engine(
+        url,
+        # Печать SQL (DB_ECHO) только для отладки: под нагрузкой это заметная нагрузка на CPU и stdout
+        echo=DB_ECHO,
+        poolclass=_guarded_pool(guard),
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        connect_args={
+            # Подготовленные запросы SQLAlchemy и собственный кэш asyncpg
+            "prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+            "statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+            "command_timeout": DB_COMMAND_TIMEOUT,
+            "server_settings": {"jit": DB_JIT},
+        },
+    )
+
+
+pool_guard = PoolGuard()
+engine = _create_engine(DATABASE_URL, pool_guard)
+# Время каждого запроса - в метрику db_query_duration_seconds
+instrument_engine(engine)
+
+# Реплика для чтения; без неё запросы на чтение идут в основную базу
+read_engine = engine
+read_pool_guard = pool_guard
+if DATABASE_REPLICA_URL:
+    read_pool_guard = PoolGuard()
+    read_engine = _create_engine(DATABASE_REPLICA_URL, read_pool_guard)
+    instrument_engine(read_engine, "replica")
 
 AsyncSessionLocal = async_sessionmaker(engine, expire_on_commit=False)
+ReadSessionLocal = async_sessionmaker(read_engine, expire_on_commit=False)
+
+
+@asynccontextmanager
+async def request_session(factory: async_sessionmaker = AsyncSessionLocal):
+    """Сессия для обработчика запроса: при исчерпанном пуле - PoolExhausted вместо ожидания."""
+    token = shed_on_exhaustion.set(True)
+    try:
+        async with factory() as session:
+            yield session
+    finally:
+        shed_on_exhaustion.reset(token)
+
 
 async def get_db():
-    async with AsyncSessionLocal() as session:
+    async with request_session() as session:
+        yield session
+
+
+async def get_read_db():
+    """Сессия для запросов только на чтение (статистика, поиск): реплика, если она задана."""
+    async with request_session(ReadSessionLocal) as session:
         yield session
-        
 
+
+async def close_engines():
+    if read_engine is not engine:
+        await read_engine.dispose()
+    await engine.dispose()
+
+
+def pool_stats(target: AsyncEngine = engine) -> dict:
+    pool = target.pool
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+    }
@@ -0,0 +1,150 @@
+import ipaddress
+import re
+from typing import List, Optional
+from urllib.parse import urlparse
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import cache_bus
+from app.config import ENRICH_DOMAIN_CACHE_CAPACITY, ENRICH_UA_CACHE_CAPACITY, GEOIP_CACHE_TTL
+from app.geoip import geoip
+from app.lru_cache import LRUCache
+from app.models import Domain, ShortLink
+
+# Обогащение визитов при сбросе пакета (app/visit_queue.py).
+# Редирект кладёт в очередь сырое событие клика:
+#     short_code, timestamp, owner, ip_address, user_agent, referer
+# а домены, тип устройства и страна вычисляются здесь, вне обработчика запроса:
+#   - домены зависят только от ссылки, поэтому кэшируются по short_code,
+#     недостающие ссылки читаются из БД одним запросом на пакет,
+#     а домен заменяется номером из справочника domains;
+#   - тип устройства (bot, tablet, mobile, desktop) кэшируется по строке User-Agent;
+#   - страна - через app/geoip.py, в отдельном потоке.
+#   - IP-адрес проверяется, нераспознанный записывается как NULL (столбец inet).
+# Сам URL в визит не копируется: он есть в short_links.
+
+_BOT_RE = re.compile(
+    r"bot|crawl|spider|slurp|archiver|facebookexternalhit|embedly|preview|monitor|"
+    r"headless|phantomjs|curl|wget|python-requests|python-urllib|aiohttp|httpx|okhttp|"
+    r"go-http-client|java/|libwww|scrapy"
+)
+_TABLET_RE = re.compile(r"ipad|tablet|kindle|silk/|playbook|nexus (7|9|10)|sm-t\d")
+_MOBILE_RE = re.compile(r"mobi|iphone|ipod|android|windows phone|blackberry|bb10|opera mini|iemobile")
+
+_ua_cache = LRUCache(capacity=ENRICH_UA_CACHE_CAPACITY, ttl=GEOIP_CACHE_TTL)
+# short_code -> (domain_1st, domain_2nd, domain_id); URL ссылки меняется редко, сбрасывается через cache_bus
+_domain_cache = LRUCache(capacity=ENRICH_DOMAIN_CACHE_CAPACITY, ttl=GEOIP_CACHE_TTL)
+
+
+def parse_domains(url: str):
+    """Парсит домен 1-го (зона, например, com, ru) и 2-го уровня (example.com) через urlparse."""
+    parsed_url = urlparse(url)
+    hostname = parsed_url.hostname  # Например, "sub.example.com"
+
+    if not hostname:
+        return None, None
+
+    parts = hostname.split(".")
+
+    if len(parts) >= 2:
+        domain_1st = parts[-1]  # Зона (TLD), например, "com", "ru"
+        domain_2nd = ".".join(parts[-2:])  # Домен второго уровня, например, "example.com"
+    else:
+        domain_1st = hostname
+        domain_2nd = hostname
+
+    return domain_1st, domain_2nd
+
+
+def classify_device(user_agent: Optional[str]) -> str:
+    """Тип устройства по User-Agent: bot, tablet, mobile, desktop или unknown (пустой UA)."""
+    if not user_agent:
+        return "unknown"
+    device = _ua_cache.get(user_agent)
+    if device is None:
+        ua = user_agent.lower()
+        if _BOT_RE.search(ua):
+            device = "bot"
+        # Android без "mobile" - планшет
+        elif _TABLET_RE.search(ua) or ("android" in ua and "mobile" not in ua):
+            device = "tablet"
+        elif _MOBILE_RE.search(ua):
+            device = "mobile"
+        else:
+            device = "desktop"
+        _ua_cache.set(user_agent, device)
+    return device
+
+
+async def _domain_ids(db: AsyncSession, domains: dict) -> dict:
+    """Номера доменов {name: zone} из справочника, недостающие добавляются."""
+    # Одинаковый порядок вставки во всех воркерах исключает взаимные блокировки
+    await db.execute(
+        pg_insert(Domain)
+        .values([{"name": name, "zone": zone} for name, zone in sorted(domains.items())])
+        .on_conflict_do_nothing(index_elements=["name"])
+    )
+    result = await db.execute(select(Domain.name, Domain.id).where(Domain.name.in_(list(domains))))
+    ids = {row.name: row.id for row in result}
+    # Номера попадают в кэш, поэтому фиксируем их до записи визитов:
+    # откат пакета визитов не должен откатить справочник
+    await db.commit()
+    return ids
+
+
+async def _link_domains(db: AsyncSession, short_codes: set) -> dict:
+    domains = {}
+    missing = []
+    for code in short_codes:
+        cached = _domain_cache.get(code)
+        if cached is None:
+            missing.append(code)
+        else:
+            domains[code] = cached
+    if missing:
+        result = await db.execute(
+            select(ShortLink.short_code, ShortLink.original_url).where(ShortLink.short_code.in_(missing))
+        )
+        parsed = {row.short_code: parse_domains(row.original_url) for row in result}
+        names = {domain_2nd: domain_1st for domain_1st, domain_2nd in parsed.values() if domain_2nd}
+        ids = await _domain_ids(db, names) if names else {}
+        for code, (domain_1st, domain_2nd) in parsed.items():
+            domains[code] = (domain_1st, domain_2nd, ids.get(domain_2nd))
+            _domain_cache.set(code, domains[code])
+    return domains
+
+
+def _inet(ip: Optional[str]) -> Optional[str]:
+    try:
+        return str(ipaddress.ip_address(ip))
+    except ValueError:
+        return None
+
+
+async def enrich_visits(db: AsyncSession, visits: List[dict]):
+    """Превращает сырые события кликов в строки visits (изменяет словари на месте)."""
+    domains = await _link_domains(db, {visit["short_code"] for visit in visits})
+    for visit in visits:
+        if "user_agent" in visit:
+            visit["device_type"] = classify_device(visit.pop("user_agent"))
+        # Ссылку могли удалить до сброса - такие визиты отбросит flush.
+        # domain_1st/domain_2nd нужны только счётчикам visit_rollups, в visits пишется domain_id
+        visit["domain_1st"], visit["domain_2nd"], visit["domain_id"] = domains.get(
+            visit["short_code"], (None, None, None)
+        )
+    # Поиск по .mmdb - в потоке GeoIP, а не в event loop
+    await geoip.enrich_batch(visits)
+    for visit in visits:
+        visit["ip_address"] = _inet(visit["ip_address"])
+
+
+def _on_link_changed(short_code: str):
+    if short_code == "*":
+        _domain_cache.clear()
+    else:
+        _domain_cache.delete(short_code)
+
+
+cache_bus.subscribe("link", _on_link_changed)
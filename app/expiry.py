@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import time
+import uuid
+from typing import Optional
+
+from redis.asyncio import Redis
+from sqlalchemy import select
+
+from app import cache_bus
+from app.archival import archive_expired_links
+from app.config import (
+    ARCHIVE_BATCH_SIZE,
+    EXPIRY_MAX_SLEEP,
+    EXPIRY_RECONCILE_INTERVAL,
+    EXPIRY_LEADER_TTL,
+)
+from app.database import AsyncSessionLocal
+from app.link_store import EXPIRY_KEY, effective_expiry
+from app.models import ShortLink
+from app.partitions import ensure_visit_partitions
+from app.redis_cache import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Планировщик архивации истёкших ссылок.
+# Сроки лежат в sorted set link_expiry, поэтому ведущий воркер забирает ровно
+# те коды, срок которых наступил, и спит до следующего срока, а не опрашивает
+# таблицу раз в минуту. Новая ссылка с более ранним сроком будит его через cache_bus.
+# Ведущий один на все воркеры uvicorn - через блокировку в Redis.
+
+LEADER_KEY = "expiry:leader"
+
+# Продление и снятие блокировки только своим токеном
+_RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class ExpiryScheduler:
+    def __init__(self):
+        self.token = uuid.uuid4().hex
+        self.is_leader = False
+        self._wake = asyncio.Event()
+        self._sleep_until = 0.0
+        self._last_reconcile: Optional[float] = None
+
+    def wake(self, when: str):
+        """Обработчик cache_bus: срок when (unix-время) раньше текущего сна - просыпаемся."""
+        if when == "*" or float(when) < self._sleep_until:
+            self._wake.set()
+
+    async def _acquire(self, redis: Redis) -> bool:
+        ttl_ms = int(EXPIRY_LEADER_TTL * 1000)
+        if self.is_leader:
+            self.is_leader = bool(await redis.eval(_RENEW_SCRIPT, 1, LEADER_KEY, self.token, ttl_ms))
+        else:
+            self.is_leader = bool(await redis.set(LEADER_KEY, self.token, nx=True, px=ttl_ms))
+            if self.is_leader:
+                # Новый ведущий: расписание могло устареть, сверяемся с БД
+                self._last_reconcile = None
+        return self.is_leader
+
+    async def release(self):
+        if not self.is_leader:
+            return
+        try:
+            async with get_redis() as redis:
+                await redis.eval(_RELEASE_SCRIPT, 1, LEADER_KEY, self.token)
+        except Exception as e:
+            logger.warning("Не удалось снять блокировку планировщика: %s", e)
+        self.is_leader = False
+
+    async def _reconcile(self, redis: Redis):
+        """Полная сверка: архивирует пропущенное и заново заполняет расписание из БД."""
+        # Заодно - секции visits на следующие месяцы (для долго работающего процесса)
+        await ensure_visit_partitions()
+        await archive_expired_links()
+        async with AsyncSessionLocal() as db:
+            result = await db.stream(
+                select(ShortLink.short_code, ShortLink.expires_at, ShortLink.auto_expires_at)
+                .where((ShortLink.expires_at.is_not(None)) | (ShortLink.auto_expires_at.is_not(None)))
+                .execution_options(yield_per=ARCHIVE_BATCH_SIZE)
+            )
+            async for rows in result.partitions():
+                await redis.zadd(EXPIRY_KEY, {
+                    row.short_code: effective_expiry(row.expires_at, row.auto_expires_at).timestamp()
+                    for row in rows
+                })
+        self._last_reconcile = time.monotonic()
+
+    async def _process_due(self, redis: Redis):
+        """Архивирует ссылки, срок которых наступил по расписанию."""
+        while True:
+            due = await redis.zrangebyscore(
+                EXPIRY_KEY, "-inf", time.time(), start=0, num=ARCHIVE_BATCH_SIZE
+            )
+            if not due:
+                return
+            archived = {code for code, _ in await archive_expired_links(due)}
+
+            # Остальные коды либо удалены, либо их срок продлили - берём актуальный срок из БД
+            pending = [code for code in due if code not in archived]
+            if pending:
+                await redis.zrem(EXPIRY_KEY, *pending)
+                async with AsyncSessionLocal() as db:
+                    result = await db.execute(
+                        select(ShortLink.short_code, ShortLink.expires_at, ShortLink.auto_expires_at)
+                        .where(ShortLink.short_code.in_(pending))
+                    )
+                    rescheduled = {
+                        row.short_code: when.timestamp()
+                        for row in result
+                        if (when := effective_expiry(row.expires_at, row.auto_expires_at)) is not None
+                    }
+                if rescheduled:
+                    await redis.zadd(EXPIRY_KEY, rescheduled)
+            if len(due) < ARCHIVE_BATCH_SIZE:
+                return
+
+    async def _next_due(self, redis: Redis) -> Optional[float]:
+        first = await redis.zrange(EXPIRY_KEY, 0, 0, withscores=True)
+        return first[0][1] if first else None
+
+    async def run(self):
+        while True:
+            # Пока идёт обработка, любой новый срок должен разбудить планировщик
+            self._sleep_until = float("inf")
+            self._wake.clear()
+            sleep_for = EXPIRY_LEADER_TTL / 3
+            try:
+                async with get_redis() as redis:
+                    if await self._acquire(redis):
+                        if (self._last_reconcile is None
+                                or time.monotonic() - self._last_reconcile >= EXPIRY_RECONCILE_INTERVAL):
+                            await self._reconcile(redis)
+                        await self._process_due(redis)
+                        next_due = await self._next_due(redis)
+                        # Просыпаемся к ближайшему сроку, но успеваем продлить блокировку
+                        sleep_for = min(sleep_for, EXPIRY_MAX_SLEEP)
+                        if next_due is not None:
+                            sleep_for = max(0.0, min(sleep_for, next_due - time.time()))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Ошибка планировщика архивации")
+
+            self._sleep_until = time.time() + sleep_for
+            try:
+                await asyncio.wait_for(self._wake.wait(), sleep_for)
+            except asyncio.TimeoutError:
+                pass
+
+
+expiry_scheduler = ExpiryScheduler()
+
+cache_bus.subscribe("expiry", expiry_scheduler.wake)
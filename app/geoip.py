@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Optional
+
+import geoip2.database
+from geoip2.errors import AddressNotFoundError
+from maxminddb import MODE_MMAP
+
+from app.config import (
+    GEOIP_DB_PATH,
+    GEOIP_CACHE_CAPACITY,
+    GEOIP_CACHE_TTL,
+    GEOIP_RELOAD_INTERVAL,
+)
+from app.lru_cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Определение страны по IP.
+# База открывается через mmap: страницы читает ОС, процесс не держит копию файла.
+# Результаты кэшируются в LRU (в том числе "страна не определена").
+# Новый .mmdb подхватывается без перезапуска: не чаще раза в GEOIP_RELOAD_INTERVAL
+# сравнивается mtime файла, и при изменении читатель пересоздаётся.
+# В обычном режиме поиск выполняется при сбросе визитов (app/visit_queue.py),
+# а не в обработчике редиректа, и не в event loop: пакет ищется в отдельном потоке
+# (enrich_batch), чтобы редиректы воркера не ждали сброс.
+
+_MISSING = object()
+
+
+class GeoIPService:
+    def __init__(
+        self,
+        path: str = GEOIP_DB_PATH,
+        cache_capacity: int = GEOIP_CACHE_CAPACITY,
+        cache_ttl: float = GEOIP_CACHE_TTL,
+        reload_interval: float = GEOIP_RELOAD_INTERVAL,
+    ):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.cache = LRUCache(capacity=cache_capacity, ttl=cache_ttl)
+        self._reader: Optional[geoip2.database.Reader] = None
+        self._mtime: Optional[float] = None
+        self._checked_at: Optional[float] = None
+        # Один поток: поиск пакета не пересекается с другим пакетом и с перечитыванием базы
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="geoip")
+
+        # Счётчики
+        self.lookups = 0
+        self.errors = 0
+        self.reloads = 0
+
+    def _open(self, mtime: float):
+        reader = geoip2.database.Reader(self.path, mode=MODE_MMAP)
+        old, self._reader, self._mtime = self._reader, reader, mtime
+        # Прежние ответы могли измениться в новой базе
+        self.cache.clear()
+        self.reloads += 1
+        if old is not None:
+            old.close()
+
+    def maybe_reload(self):
+        """Открывает базу при первом обращении и переоткрывает, если файл заменили."""
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(self.path).st_mtime
+            if mtime != self._mtime:
+                self._open(mtime)
+        except Exception as e:
+            # Остаёмся на прежней базе (или без неё), попробуем при следующей проверке
+            self.errors += 1
+            logger.warning("Не удалось открыть базу GeoIP %s: %s", self.path, e)
+
+    def country(self, ip: str) -> Optional[str]:
+        """ISO-код страны, например 'US', 'RU'. None - адрес не найден или база недоступна."""
+        cached = self.cache.get(ip, _MISSING)
+        if cached is not _MISSING:
+            return cached
+        self.maybe_reload()
+        if self._reader is None:
+            return None
+
+        self.lookups += 1
+        try:
+            iso_code = self._reader.country(ip).country.iso_code
+        except (AddressNotFoundError, ValueError):
+            # Адреса нет в базе или это не IP (например, "unknown")
+            iso_code = None
+        except Exception as e:
+            self.errors += 1
+            logger.warning("Ошибка поиска GeoIP для %s: %s", ip, e)
+            return None
+        self.cache.set(ip, iso_code)
+        return iso_code
+
+    def enrich(self, visits: Iterable[dict]):
+        """Проставляет country визитам, у которых страна ещё не определена."""
+        for visit in visits:
+            if "country" not in visit:
+                visit["country"] = self.country(visit["ip_address"])
+
+    async def enrich_batch(self, visits: List[dict]):
+        """enrich() в потоке GeoIP; визиты, у которых страна уже есть (GEOIP_DEFERRED=false), поток не занимают."""
+        if any("country" not in visit for visit in visits):
+            await asyncio.get_running_loop().run_in_executor(self._executor, self.enrich, visits)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+            self._mtime = None
+            self._checked_at = None
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "loaded": self._reader is not None,
+            "lookups": self.lookups,
+            "errors": self.errors,
+            "reloads": self.reloads,
+            "cache": self.cache.stats(),
+        }
+
+
+geoip = GeoIPService()
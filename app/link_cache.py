@@ -0,0 +1,48 @@
+from redis.asyncio import Redis
+
+from app import cache_bus
+from app.config import LINK_CACHE_CAPACITY, LINK_CACHE_TTL, LINK_CACHE_NEGATIVE_TTL
+from app.lru_cache import LRUCache
+
+# Локальный кэш горячих ссылок: short_code -> (original_url, user_id).
+# Неизвестные коды кэшируются маркером NOT_FOUND на LINK_CACHE_NEGATIVE_TTL.
+# Кэш свой у каждого воркера, изменения рассылаются остальным через cache_bus.
+
+NOT_FOUND = object()
+
+link_cache = LRUCache(capacity=LINK_CACHE_CAPACITY, ttl=LINK_CACHE_TTL)
+
+
+def get_cached_link(short_code: str):
+    """Возвращает (original_url, user_id), NOT_FOUND или None, если кода нет в кэше."""
+    return link_cache.get(short_code)
+
+
+def cache_link(short_code: str, original_url: str, user_id):
+    link_cache.set(short_code, (original_url, user_id))
+
+
+def cache_missing_link(short_code: str):
+    link_cache.set(short_code, NOT_FOUND, ttl=LINK_CACHE_NEGATIVE_TTL)
+
+
+def _on_invalidate(short_code: str):
+    if short_code == "*":
+        link_cache.clear()
+    else:
+        link_cache.delete(short_code)
+
+
+async def invalidate_link(redis: Redis, short_code: str):
+    """Удаляет код из локального кэша и из кэшей остальных воркеров."""
+    _on_invalidate(short_code)
+    await cache_bus.publish(redis, "link", short_code)
+
+
+def queue_link_invalidation(pipe, short_code: str):
+    """То же, что invalidate_link, но публикация добавляется в пайплайн Redis."""
+    _on_invalidate(short_code)
+    cache_bus.queue_publish(pipe, "link", short_code)
+
+
+cache_bus.subscribe("link", _on_invalidate)
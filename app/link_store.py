@@ -0,0 +1,237 @@
+import asyncio
+import math
+import random
+import time
+import uuid
+from datetime import datetime
+from typing import Optional
+from urllib.parse import unquote
+
+from redis.asyncio import Redis
+
+from app import cache_bus
+from app.config import (
+    REDIS_TTL,
+    REDIS_LEGACY_FALLBACK,
+    LINK_REFRESH_WINDOW,
+    LINK_REFRESH_BETA,
+    LINK_LOAD_LOCK_TTL,
+    LINK_LOAD_LOCK_POLL,
+)
+from app.metrics import record_cache_lookup
+from app.urls import url_hash
+
+# Запись о ссылке в Redis хранится одним хэшем link:{short_code}
+# с полями url, owner ("" для гостя) и expires_at (ISO или "").
+# Обратное соответствие URL -> код лежит в longlink:{SHA-256 канонического URL}
+# (app/urls.py), всегда с TTL.
+# Все чтения и записи идут одним пайплайном, т.е. за один round-trip.
+# Чтение не продлевает TTL: горячий ключ продлевается заранее, с вероятностью,
+# растущей к концу TTL (XFetch), - одна команда EXPIRE на ключ за период, а не на каждое чтение.
+# Сроки истечения ссылок лежат в sorted set link_expiry (score - unix-время),
+# по нему планировщик (app/expiry.py) находит ссылки к архивации.
+
+EXPIRY_KEY = "link_expiry"
+
+
+def link_key(short_code: str) -> str:
+    return f"link:{short_code}"
+
+
+def load_lock_key(short_code: str) -> str:
+    return f"lock:link:{short_code}"
+
+
+def longlink_key(url: str) -> str:
+    return f"longlink:{url_hash(url).hex()}"
+
+
+def _legacy_keys(short_code: str):
+    return f"shortlink:{short_code}", f"short_ui:{short_code}"
+
+
+def record_ttl(expires_at: Optional[datetime]) -> int:
+    """TTL записи: не больше REDIS_TTL и не дольше срока жизни самой ссылки."""
+    if expires_at is None:
+        return REDIS_TTL
+    return max(1, min(int((expires_at - datetime.now()).total_seconds()), REDIS_TTL))
+
+
+def _parse_record(record: dict) -> dict:
+    owner = record.get("owner")
+    expires_at = record.get("expires_at")
+    return {
+        "url": record["url"],
+        "owner": int(owner) if owner else None,
+        "expires_at": datetime.fromisoformat(expires_at) if expires_at else None,
+    }
+
+
+def should_refresh(ttl_ms: int, window: float = LINK_REFRESH_WINDOW, beta: float = LINK_REFRESH_BETA) -> bool:
+    """
+    Раннее продление (XFetch): продлить, если window * beta * -ln(U) не меньше оставшегося TTL.
+    Чем ближе истечение и чем чаще читают ключ, тем вероятнее продление до истечения.
+    """
+    if ttl_ms < 0:
+        # -1 - ключ без TTL, -2 - ключа нет
+        return False
+    return window * beta * -math.log(1.0 - random.random()) >= ttl_ms / 1000
+
+
+async def get_link_record(redis: Redis, short_code: str) -> Optional[dict]:
+    """
+    Читает запись о ссылке и оставшийся TTL за один round-trip; TTL продлевается
+    отдельной командой, только когда так решит should_refresh.
+    Возвращает {"url", "owner", "expires_at"} или None.
+    """
+    key = link_key(short_code)
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.hgetall(key)
+        pipe.pttl(key)
+        record, ttl_ms = await pipe.execute()
+
+    record_cache_lookup("link", bool(record))
+    if record:
+        parsed = _parse_record(record)
+        if should_refresh(ttl_ms):
+            await redis.expire(key, record_ttl(parsed["expires_at"]))
+        return parsed
+
+    if not REDIS_LEGACY_FALLBACK:
+        return None
+
+    # Переходный период: ссылка могла быть закэширована в старом формате
+    url_key, owner_key = _legacy_keys(short_code)
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.get(url_key)
+        pipe.get(owner_key)
+        encoded_url, owner = await pipe.execute()
+    record_cache_lookup("shortlink", bool(encoded_url) and owner is not None)
+    if not encoded_url or owner is None:
+        return None
+
+    url = unquote(encoded_url)
+    owner = None if owner in ("guest", "None") else int(owner)
+    await set_link_record(redis, short_code, url, owner, None)
+    return {"url": url, "owner": owner, "expires_at": None}
+
+
+async def acquire_load_lock(redis: Redis, short_code: str) -> Optional[str]:
+    """Блокировка загрузки кода из БД для всех воркеров. Возвращает токен или None, если занята."""
+    token = uuid.uuid4().hex
+    acquired = await redis.set(load_lock_key(short_code), token, nx=True, px=int(LINK_LOAD_LOCK_TTL * 1000))
+    return token if acquired else None
+
+
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+async def release_load_lock(redis: Redis, short_code: str, token: str):
+    await redis.eval(_RELEASE_LOCK_SCRIPT, 1, load_lock_key(short_code), token)
+
+
+async def wait_for_link_record(redis: Redis, short_code: str, timeout: float = LINK_LOAD_LOCK_TTL) -> Optional[dict]:
+    """Ждёт, пока воркер с блокировкой запишет ссылку в Redis; None - не дождались или блокировку сняли без записи."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        await asyncio.sleep(LINK_LOAD_LOCK_POLL)
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.hgetall(link_key(short_code))
+            pipe.exists(load_lock_key(short_code))
+            record, locked = await pipe.execute()
+        if record:
+            return _parse_record(record)
+        if not locked:
+            return None
+    return None
+
+
+async def get_longlink(redis: Redis, url: str) -> Optional[str]:
+    """Короткий код по исходному URL из обратного соответствия или None."""
+    short_code = await redis.get(longlink_key(url))
+    record_cache_lookup("longlink", short_code is not None)
+    return short_code
+
+
+def queue_link_record(
+    pipe,
+    short_code: str,
+    url: str,
+    owner: Optional[int],
+    expires_at: Optional[datetime],
+    ttl: Optional[int] = None,
+):
+    """Добавляет в пайплайн команды записи ссылки и обратного соответствия."""
+    ttl = record_ttl(expires_at) if ttl is None else ttl
+    key = link_key(short_code)
+    pipe.hset(key, mapping={
+        "url": url,
+        "owner": str(owner) if owner is not None else "",
+        "expires_at": expires_at.isoformat() if expires_at else "",
+    })
+    pipe.expire(key, ttl)
+    pipe.set(longlink_key(url), short_code, ex=ttl)
+
+
+async def set_link_record(
+    redis: Redis,
+    short_code: str,
+    url: str,
+    owner: Optional[int],
+    expires_at: Optional[datetime],
+    ttl: Optional[int] = None,
+):
+    async with redis.pipeline(transaction=True) as pipe:
+        queue_link_record(pipe, short_code, url, owner, expires_at, ttl)
+        await pipe.execute()
+
+
+def queue_link_delete(pipe, short_code: str, url: Optional[str] = None):
+    """Добавляет в пайплайн удаление записи ссылки, включая старые ключи."""
+    keys = [link_key(short_code), *_legacy_keys(short_code)]
+    if url:
+        keys.append(longlink_key(url))
+    pipe.delete(*keys)
+
+
+async def delete_link_record(redis: Redis, short_code: str, url: Optional[str] = None):
+    async with redis.pipeline(transaction=True) as pipe:
+        queue_link_delete(pipe, short_code, url)
+        await pipe.execute()
+
+
+async def short_code_cached(redis: Redis, short_code: str) -> bool:
+    """Проверяет, занят ли код, по новому и старому ключам одной командой EXISTS."""
+    return await redis.exists(link_key(short_code), _legacy_keys(short_code)[0]) > 0
+
+
+def effective_expiry(expires_at: Optional[datetime], auto_expires_at: Optional[datetime]) -> Optional[datetime]:
+    """Ближайший из двух сроков истечения ссылки."""
+    dates = [d for d in (expires_at, auto_expires_at) if d is not None]
+    return min(dates) if dates else None
+
+
+def queue_expiry(pipe, short_code: str, when: Optional[datetime], wake: bool = True):
+    """
+    Добавляет в пайплайн постановку ссылки в расписание архивации.
+    wake - разбудить планировщик, если срок раньше того, до которого он спит.
+    """
+    if when is None:
+        pipe.zrem(EXPIRY_KEY, short_code)
+        return
+    pipe.zadd(EXPIRY_KEY, {short_code: when.timestamp()})
+    if wake:
+        queue_expiry_wake(pipe, when)
+
+
+def queue_expiry_wake(pipe, when: datetime):
+    cache_bus.queue_publish(pipe, "expiry", str(when.timestamp()))
+
+
+def queue_expiry_remove(pipe, short_code: str):
+    pipe.zrem(EXPIRY_KEY, short_code)
@@ -0,0 +1,202 @@
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+import traceback
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
+
+from app.config import (
+    LOG_LEVEL,
+    LOG_LEVELS,
+    LOG_FORMAT,
+    LOG_ACCESS_SAMPLE_RATE,
+    LOG_ACCESS_MAX_PER_SECOND,
+)
+
+# Логирование приложения.
+# Записи кладутся в очередь в памяти (QueueHandler), а в stdout их пишет
+# отдельный поток QueueListener - обработчик запроса не ждёт вывод.
+# Формат - JSON по строке на запись, уровни задаются по модулям (LOG_LEVELS).
+# Каждой записи внутри HTTP-запроса проставляется request_id (заголовок X-Request-ID).
+# Журнал запросов app.access пишется выборочно: LOG_ACCESS_SAMPLE_RATE доля
+# запросов и не больше LOG_ACCESS_MAX_PER_SECOND строк в секунду; ошибки - всегда.
+
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+
+access_logger = logging.getLogger("app.access")
+
+# Атрибуты LogRecord, которые не считаются дополнительными полями записи
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Строка JSON: время, уровень, логгер, сообщение, request_id и поля из extra=."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRS and value is not None:
+                entry[name] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        if not hasattr(record, "request_id"):
+            record.request_id = "-"
+        return super().format(record)
+
+
+class _ContextQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler без self.format() в потоке приложения. Здесь остаётся только то,
+    что нельзя отложить: request_id из контекста, подстановка аргументов в сообщение
+    (аргументы могут измениться после вызова) и текст трассировки. Сборку строки
+    (JSON или текст) и запись в stdout выполняет поток QueueListener.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = logging.makeLogRecord(vars(record))
+        record.request_id = request_id_var.get()
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # Трассировку нельзя передать между потоками как есть
+            record.exc_text = "".join(traceback.format_exception(*record.exc_info)).rstrip()
+            record.exc_info = None
+        return record
+
+
+class Sampler:
+    """
+    Выборка записей: доля rate и не больше max_per_second в секунду; WARNING и выше - всегда.
+    Решение принимается до создания LogRecord, поэтому отброшенная запись ничего не стоит.
+    """
+
+    def __init__(self, rate: float, max_per_second: int):
+        self.rate = rate
+        self.max_per_second = max_per_second
+        self._second = 0
+        self._count = 0
+
+    def allow(self, level: int = logging.INFO) -> bool:
+        if level >= logging.WARNING:
+            return True
+        if self.rate < 1.0 and random.random() >= self.rate:
+            return False
+        if self.max_per_second <= 0:
+            return True
+        # Вызывается из event loop, блокировка не нужна
+        second = int(time.monotonic())
+        if second != self._second:
+            self._second, self._count = second, 0
+        self._count += 1
+        return self._count <= self.max_per_second
+
+
+access_sampler = Sampler(LOG_ACCESS_SAMPLE_RATE, LOG_ACCESS_MAX_PER_SECOND)
+
+
+def _parse_levels(spec: str) -> dict:
+    """"app.visit_queue=DEBUG,sqlalchemy.engine=INFO" -> {логгер: уровень}."""
+    levels = {}
+    for item in spec.split(","):
+        name, _, level = item.partition("=")
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging():
+    """Настраивает корневой логгер один раз на процесс (повторные вызовы ничего не делают)."""
+    global _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+    log_queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+
+    root = logging.getLogger()
+    root.handlers[:] = [_ContextQueueHandler(log_queue)]
+    root.setLevel(LOG_LEVEL.upper())
+    for name, level in _parse_levels(LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level)
+
+
+def shutdown_logging():
+    """Дописывает записи из очереди; вызывается при остановке приложения."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class RequestContextMiddleware:
+    """
+    ASGI-middleware: request_id запроса (из X-Request-ID клиента или новый),
+    заголовок X-Request-ID в ответе и строка журнала app.access.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")[:128]
+                break
+        request_id = request_id or uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_request_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = [*message.get("headers", ()), (b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            level = logging.ERROR if status >= 500 else logging.INFO
+            if access_logger.isEnabledFor(level) and access_sampler.allow(level):
+                access_logger.log(
+                    level, "%s %s %s", scope["method"], scope["path"], status,
+                    extra={
+                        "status": status,
+                        "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+                        "client": scope["client"][0] if scope.get("client") else None,
+                    },
+                )
+            request_id_var.reset(token)
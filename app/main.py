@@ -1,14 +1,14 @@
 # Стандартная библиотека и встроенные модули
 
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timedelta
 from contextlib import asynccontextmanager
 from typing import Optional
-from urllib.parse import urlparse, parse_qs, urlencode, unquote, quote
+from urllib.parse import urlparse, parse_qs, urlencode
 import asyncio
+import math
 import re
-import string
-import hashlib
-import random
+import json
+import logging
 
 # FastAPI и связанные компоненты
 from fastapi import (
@@ -17,42 +17,89 @@ from fastapi import (
 )
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 
 # Базы данных и ORM
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from sqlalchemy import func, delete, update
-from sqlalchemy.orm import joinedload
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 
 # Модели и схемы
-from app.models import User, ShortLink, ShortLinkArchive, Visit, VisitArchive
+from app.models import User, ShortLink, Visit, VisitArchive
 from app.schemas import LinkRequest, ShortLinkUpdateModel, ArchiveFilter
 
 # Аутентификация и безопасность
-from app.auth import hash_password, verify_password
+from app.auth import (
+    hash_password_async, verify_and_update_password, shutdown_password_pool, password_pool_stats,
+)
 from jose import jwt, JWTError
 from app.config import (
     SECRET_KEY, 
     ALGORITHM, 
-    ACCESS_TOKEN_EXPIRE_MINUTES, 
     LINK_EXPIRE_TIME_IN_DAYS_4UNREG, 
     LINK_EXPIRE_TIME_IN_DAYS_REG,
-    REDIS_TTL
+    REDIS_TTL,
+    SHORTEN_BATCH_MAX_SIZE,
+    SHORTEN_BATCH_GUEST_MAX_SIZE,
+    SHORTEN_BATCH_INSERT_CHUNK,
+    SHORTEN_BATCH_PARTIAL,
+    SHORT_CODE_INSERT_ATTEMPTS,
+    TOKEN_REVOCATION_FAIL_OPEN,
+    GEOIP_DEFERRED,
+    SKETCH_TOP_K,
+    LINK_LOAD_LOCK_TTL,
+    DB_SHED_RETRY_AFTER,
 )
 
 # Внешние сервисы и утилиты
-from app.database import get_db, engine
-from app.redis_cache import get_redis, redis_dependency
+from app.database import (
+    get_db, get_read_db, engine, read_engine, close_engines, pool_stats as db_pool_stats, request_session,
+    PoolExhausted, pool_guard, read_pool_guard,
+)
+from app.rate_limit import rate_limiter, identity
+from app.redis_cache import redis_dependency, init_redis_pool, close_redis_pool, pool_stats
+from app.visit_queue import visit_queue
+from app.click_counters import click_counter, click_reconciler, read_clicks, click_stats
+from app.bloom import short_code_filter
+from app.link_cache import (
+    link_cache, NOT_FOUND, get_cached_link, cache_link, cache_missing_link, invalidate_link,
+    queue_link_invalidation,
+)
+from app import cache_bus
+from app.short_codes import code_allocator, generate_short_code
+from app.archival import archive_links, forget_links
+from app.expiry import expiry_scheduler
+from app.rollups import read_stats, GRANULARITIES
+from app.sketches import link_sketches, read_insights
+from app.token_cache import (
+    token_cache, generation_cache, create_access_token, decode_token, get_cached_token, cache_token,
+    current_generation, revoke_user_tokens,
+)
+from app.stats_export import check_params, check_limit, read_page, stream_visits, VISIT_FIELDS, ARCHIVE_FIELDS
+from app.urls import url_hash, url_columns, reverse_domain
+from app.link_store import (
+    link_key, longlink_key, get_longlink, get_link_record, set_link_record,
+    short_code_cached, queue_link_record, queue_link_delete,
+    queue_expiry, queue_expiry_wake, effective_expiry,
+    acquire_load_lock, release_load_lock, wait_for_link_record,
+)
+from app.single_flight import SingleFlight
 from redis.asyncio import Redis
-import geoip2.database
+from app.geoip import geoip
+from app.partitions import ensure_visit_partitions
+from app import metrics
+from app.logging_setup import setup_logging, shutdown_logging, RequestContextMiddleware
 
 # Pydantic для валидации
-from pydantic import HttpUrl
+from pydantic import ValidationError
 
 
 
+# JSON-логи через очередь: настраиваются при импорте, до старта воркера
+setup_logging()
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
 templates = Jinja2Templates(directory="app/templates")
@@ -60,28 +107,87 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="app/token")
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-      # Подключение к Redis (с await!)
-    get_redis()
+      # Общий пул соединений Redis на всё время работы приложения
+    await init_redis_pool()
       # Инициализация БД
     async with engine.begin() as conn:
         await conn.run_sync(User.metadata.create_all)
+      # Месячные секции таблицы visits
+    await ensure_visit_partitions()
+      # Фоновая запись визитов пакетами
+    visit_queue.start()
+    link_sketches.start()
+      # Инвалидация локальных кэшей между воркерами
+    cache_bus_task = asyncio.create_task(cache_bus.listen())
+      # Архивация истёкших ссылок (ведущий воркер по расписанию)
+    archive_task = asyncio.create_task(expiry_scheduler.run())
+      # Задержка event loop и счётчики компонентов для /metrics
+    metrics_task = asyncio.create_task(metrics.run_sampler())
+      # Перенос счётчиков кликов из Redis в short_links
+    clicks_task = asyncio.create_task(click_reconciler.run())
+      # Фильтр Блума по коротким кодам: сборка и пересборки
+    bloom_task = asyncio.create_task(short_code_filter.run())
     
     yield  # Здесь приложение работает
 
+    archive_task.cancel()
+    cache_bus_task.cancel()
+    metrics_task.cancel()
+    clicks_task.cancel()
+    bloom_task.cancel()
+    await asyncio.gather(
+        archive_task, cache_bus_task, metrics_task, clicks_task, bloom_task, return_exceptions=True,
+    )
+    await expiry_scheduler.release()
+    await click_reconciler.stop()
+      # Дописываем визиты, оставшиеся в очереди
+    await visit_queue.stop()
+    await link_sketches.stop()
+    await close_redis_pool()
+    await close_engines()
+    shutdown_password_pool()
+    geoip.close()
+    metrics.mark_worker_dead()
+    shutdown_logging()
+
 
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(metrics.MetricsMiddleware)
+# Последним добавлен - выполняется первым: request_id виден во всех логах запроса
+app.add_middleware(RequestContextMiddleware)
+
+# Счётчики stats() компонентов выгружаются в /metrics как app_component_stat
+metrics.register_stats("visit_queue", visit_queue.stats)
+metrics.register_stats("link_sketches", link_sketches.stats)
+metrics.register_stats("click_counter", click_counter.stats)
+metrics.register_stats("click_reconciler", click_reconciler.stats)
+metrics.register_stats("link_cache", link_cache.stats)
+metrics.register_stats("short_code_filter", short_code_filter.stats)
+metrics.register_stats("token_cache", token_cache.stats)
+metrics.register_stats("generation_cache", generation_cache.stats)
+metrics.register_stats("geoip", geoip.stats)
+metrics.register_stats("redis_pool", pool_stats)
+metrics.register_stats("db_pool", db_pool_stats)
+if read_engine is not engine:
+    metrics.register_stats("db_read_pool", lambda: db_pool_stats(read_engine))
+metrics.register_stats("password_pool", password_pool_stats)
+metrics.register_stats("db_guard", pool_guard.stats)
+if read_pool_guard is not pool_guard:
+    metrics.register_stats("db_read_guard", read_pool_guard.stats)
+metrics.register_stats("rate_limiter", rate_limiter.stats)
+
+
+@app.exception_handler(PoolExhausted)
+async def pool_exhausted_handler(request: Request, exc: PoolExhausted):
+    # Пул PostgreSQL исчерпан и очередь к нему полна - отвечаем сразу, а не ждём pool_timeout
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Сервис перегружен, повторите запрос позже"},
+        headers={"Retry-After": str(DB_SHED_RETRY_AFTER)},
+    )
 
 app.mount("/static", StaticFiles(directory="app/templates/static"), name="static")
 
-def random_salt():
-    return ''.join(random.choices(string.ascii_letters + string.digits, k=8))
-
-
-def generate_short_code(original_url: HttpUrl) -> str:
-    original_url_str = str(original_url)  # Преобразуем HttpUrl в строку
-    hash_value = hashlib.sha256((original_url_str + random_salt()).encode()).hexdigest()
-    return hash_value[:8]  # Обрезаем до 8 символов
-
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request, token: str = Cookie(None)):
     username = None
@@ -93,6 +199,10 @@ async def home(request: Request, token: str = Cookie(None)):
             pass
     return templates.TemplateResponse("index.html", {"request": request, "username": username})
 
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return Response(metrics.render_metrics(), media_type=metrics.CONTENT_TYPE_LATEST)
+
 @app.get("/users/me")
 async def read_users_me(token: str = Depends(oauth2_scheme)):
     try:
@@ -114,32 +224,102 @@ async def get_user_from_token(
     db: AsyncSession = Depends(get_db)
 ) -> Optional[int]:
     if not token:
-        print("Токен отсутствует!")
         return None  
 
     # Убираем "Bearer " из токена, чтобы оставить только сам токен
     token = token.replace("Bearer ", "").strip()
-    
+
+    # Повторные запросы с тем же токеном не декодируют JWT и не обращаются к БД
+    cached = get_cached_token(token)
+    if cached is not None:
+        user_id, generation = cached
+    else:
+        payload = decode_token(token)
+        if payload is None:
+            return None
+        user_id = payload.get("uid")
+        generation = payload.get("gen", 0)
+        if user_id is None:
+            # Токены, выданные до появления клэйма uid: user_id ищем по username один раз
+            username: Optional[str] = payload.get("sub")
+            if not username:
+                return None
+            result = await db.execute(select(User.id).where(User.username == username))
+            user_id = result.scalar_one_or_none()
+            if user_id is None:
+                return None
+        cache_token(token, user_id, generation, payload.get("exp"))
+
+    # Токены старшего поколения отозваны выходом из системы
     try:
-        print(f"Полученный токен: {token}")
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: Optional[str] = payload.get("sub")
-        if not username:
-            print("Токен не содержит username!")
-            return None  
-    except JWTError as e:
-        print(f"Ошибка декодирования JWT: {e}")
-        return None  
+        if generation < await current_generation(user_id):
+            return None
+    except Exception as e:
+        logger.warning("Не удалось проверить поколение токенов пользователя %s: %s", user_id, e)
+        if TOKEN_REVOCATION_FAIL_OPEN:
+            # Подпись и срок токена проверены: без Redis не действует только отзыв
+            return user_id
+        # Не считаем пользователя гостем: иначе ссылка создастся без владельца и с гостевым сроком
+        raise HTTPException(
+            status_code=503,
+            detail="Не удалось проверить токен, повторите запрос позже",
+            headers={"Retry-After": "1"},
+        )
 
-    result = await db.execute(select(User).where(User.username == username))
-    user = result.scalar_one_or_none()
+    return user_id
 
-    if not user:
-        print(f"Пользователь {username} не найден!")
-        return None  
 
-    print(f"Авторизованный user_id: {user.id}")
-    return user.id
+async def _enforce_rate_limit(name: str, request: Request, redis: Redis, user_id: Optional[int] = None):
+    limit = rate_limiter.limits[name]
+    key = identity(limit, request.scope, request.headers.get("Authorization"), user_id)
+    retry_after = await rate_limiter.acquire(redis, name, key)
+    if retry_after is not None:
+        raise HTTPException(
+            status_code=429,
+            detail="Слишком много запросов",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+
+def rate_limited(name: str):
+    """Зависимость маршрута: правило name из RATE_LIMITS; без правила маршрут не ограничивается."""
+    limit = rate_limiter.limits.get(name)
+    if limit is None:
+        async def unlimited():
+            return None
+        return Depends(unlimited)
+
+    if limit.key == "user":
+        # get_user_from_token кэшируется FastAPI на запрос: обработчик не декодирует токен повторно
+        async def by_user(
+            request: Request,
+            redis: Redis = Depends(redis_dependency),
+            user_id: Optional[int] = Depends(get_user_from_token),
+        ):
+            await _enforce_rate_limit(name, request, redis, user_id)
+        return Depends(by_user)
+
+    # По IP и токену - без обращения к БД
+    async def by_request(request: Request, redis: Redis = Depends(redis_dependency)):
+        await _enforce_rate_limit(name, request, redis)
+    return Depends(by_request)
+
+
+def short_code_taken(e: IntegrityError) -> bool:
+    """Нарушен уникальный индекс short_links.short_code, а не внешний ключ или другое ограничение."""
+    # e.orig - обёртка SQLAlchemy, исходная ошибка asyncpg - в __cause__.
+    # Имя индекса зависит от того, как создавалась таблица (ix_short_links_short_code, short_links_short_code_key)
+    cause = getattr(e.orig, "__cause__", None)
+    return (getattr(cause, "sqlstate", None) == "23505"
+            and "short_code" in (getattr(cause, "constraint_name", None) or ""))
+
+
+def link_expiry(user_id: Optional[int], expires_at_query: Optional[datetime]):
+    """Возвращает (expires_at, auto_expires_at) для новой ссылки."""
+    if expires_at_query:
+        return expires_at_query, None
+    days = LINK_EXPIRE_TIME_IN_DAYS_REG if user_id else LINK_EXPIRE_TIME_IN_DAYS_4UNREG
+    return None, datetime.now() + timedelta(days=days)
 
 def extract_expires_at(original_url: str):
     """
@@ -166,17 +346,10 @@ def extract_expires_at(original_url: str):
 
     return cleaned_url, expires_at
 
-def encode_url(url: str) -> str:
-    """Кодирует URL для безопасного хранения в Redis"""
-    return quote(url, safe='')
 
-def decode_url(encoded_url: str) -> str:
-    """Декодирует URL из Redis"""
-    return unquote(encoded_url)
 
 
-
-@app.post("/links/shorten")
+@app.post("/links/shorten", dependencies=[rate_limited("shorten")])
 async def shorten_link(
     request: Request,
     link_request: LinkRequest,
@@ -189,8 +362,8 @@ async def shorten_link(
     short_code = link_request.customAlias
 
     if not user_id and not expires_at_query:
-        redis_key = f"longlink:{quote(cleaned_url)}"  
-        existing_short_code = await redis.get(redis_key)
+        redis_key = longlink_key(cleaned_url)
+        existing_short_code = await get_longlink(redis, cleaned_url)
 
         if existing_short_code:
             # Добавлена проверка в базу данных для незарегистрированных пользователей
@@ -201,8 +374,10 @@ async def shorten_link(
             db_result = await db.execute(db_query)
             if db_result.scalars().first():
                 short_code = existing_short_code
-                await redis.expire(redis_key, REDIS_TTL)
-                await redis.expire(f"shortlink:{short_code}", REDIS_TTL)
+                async with redis.pipeline(transaction=False) as pipe:
+                    pipe.expire(redis_key, REDIS_TTL)
+                    pipe.expire(link_key(short_code), REDIS_TTL)
+                    await pipe.execute()
                 
                 host = str(request.base_url).rstrip("/")
                 return {
@@ -213,22 +388,29 @@ async def shorten_link(
                 }
 
     if short_code:
-        redis_key = f"shortlink:{quote(short_code)}" 
+        # Фильтр Блума: «нет» - alias точно свободен, Redis и БД не нужны
+        # (одновременное создание того же alias всё равно поймает уникальный индекс)
+        if short_code_filter.might_contain(short_code):
+            if await short_code_cached(redis, short_code):
+                raise HTTPException(status_code=400, detail="This alias is already taken. Please choose another.")
 
-        if await redis.exists(redis_key):
-            raise HTTPException(status_code=400, detail="This alias is already taken. Please choose another.")
+            query = select(ShortLink).where(ShortLink.short_code == short_code)
+            result = await db.execute(query)
+            if result.scalars().first():
+                raise HTTPException(status_code=400, detail="This alias is already taken. Please choose another.")
 
-        query = select(ShortLink).where(ShortLink.short_code == short_code)
-        result = await db.execute(query)
-        if result.scalars().first():
-            raise HTTPException(status_code=400, detail="This alias is already taken. Please choose another.")
+    elif code_allocator.collision_free:
+        # Код из заранее зарезервированного блока: уникален без проверок
+        short_code = await code_allocator.next_code()
 
     else:
         while True:
             short_code = generate_short_code(cleaned_url)
-            redis_key = f"shortlink:{quote(short_code)}"  
 
-            if await redis.exists(redis_key):
+            if not short_code_filter.might_contain(short_code):
+                break
+
+            if await short_code_cached(redis, short_code):
                 continue
 
             query = select(ShortLink).where(ShortLink.short_code == short_code)
@@ -238,33 +420,44 @@ async def shorten_link(
 
             break 
 
-    encoded_url = quote(cleaned_url)  
-
-    if expires_at_query:
-        ttl = min((expires_at_query - datetime.now()).total_seconds(), REDIS_TTL)
-    else:
-        ttl = REDIS_TTL
-
-    await redis.set(f"shortlink:{quote(short_code)}", encoded_url, ex=int(ttl)) 
-    await redis.set(f"longlink:{encoded_url}", quote(short_code), ex=int(ttl)) 
-
-    if expires_at_query:
-        auto_expires = None  
-        expires_at = expires_at_query
-    else:
-        auto_expires = datetime.now() + timedelta(days=LINK_EXPIRE_TIME_IN_DAYS_REG) if user_id else datetime.now() + timedelta(days=LINK_EXPIRE_TIME_IN_DAYS_4UNREG)
-        expires_at = None
-
-    new_link = ShortLink(
-        short_code=short_code,
-        original_url=cleaned_url,  
-        created_at=datetime.now(),
-        expires_at=expires_at,
-        user_id=user_id,
-        auto_expires_at=auto_expires
-    )
-    db.add(new_link)
-    await db.commit()
+    expires_at, auto_expires = link_expiry(user_id, expires_at_query)
+
+    for attempt in range(1, SHORT_CODE_INSERT_ATTEMPTS + 1):
+        new_link = ShortLink(
+            short_code=short_code,
+            original_url=cleaned_url,  
+            created_at=datetime.now(),
+            expires_at=expires_at,
+            user_id=user_id,
+            auto_expires_at=auto_expires,
+            **url_columns(cleaned_url),
+        )
+        db.add(new_link)
+        try:
+            await db.commit()
+            break
+        except IntegrityError as e:
+            await db.rollback()
+            if not short_code_taken(e):
+                # Другое ограничение (например, пользователя удалили): новый код не поможет
+                raise
+            # Код успели занять (пользовательский alias или параллельный запрос)
+            if link_request.customAlias:
+                raise HTTPException(status_code=400, detail="This alias is already taken. Please choose another.")
+            if attempt == SHORT_CODE_INSERT_ATTEMPTS:
+                raise HTTPException(status_code=503, detail="Не удалось подобрать свободный короткий код")
+            if code_allocator.collision_free:
+                short_code = await code_allocator.next_code()
+            else:
+                short_code = generate_short_code(cleaned_url)
+
+    # Запись о ссылке, обратное соответствие и срок архивации - одной транзакцией Redis
+    async with redis.pipeline(transaction=True) as pipe:
+        queue_link_record(pipe, short_code, cleaned_url, user_id, expires_at)
+        queue_expiry(pipe, short_code, effective_expiry(expires_at, auto_expires))
+        # Код мог быть закэширован как несуществующий
+        queue_link_invalidation(pipe, short_code)
+        await pipe.execute()
 
     host = str(request.base_url).rstrip("/")
     short_url = f"{host}/links/{short_code}"
@@ -276,6 +469,212 @@ async def shorten_link(
     }
 
 
+async def _read_batch_items(request: Request, max_size: int) -> list:
+    """Читает элементы пакета: JSON-массив или NDJSON (по строке на ссылку)."""
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" in content_type:
+        items = []
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    items.append(line)
+            if len(items) > max_size:
+                break
+        if buffer.strip():
+            items.append(buffer)
+        parsed = []
+        for line in items:
+            try:
+                parsed.append(json.loads(line))
+            except ValueError:
+                parsed.append(None)  # Ошибка будет в результатах этого элемента
+        return parsed
+
+    try:
+        body = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Ожидается JSON-массив ссылок или NDJSON")
+    if isinstance(body, dict):
+        body = body.get("links")
+    if not isinstance(body, list):
+        raise HTTPException(status_code=400, detail="Ожидается JSON-массив ссылок или NDJSON")
+    return body
+
+
+@app.post("/links/shorten/batch", dependencies=[rate_limited("shorten_batch")])
+async def shorten_links_batch(
+    request: Request,
+    atomic: Optional[bool] = None,
+    db: AsyncSession = Depends(get_db),
+    redis: Redis = Depends(redis_dependency),
+    user_id: Optional[int] = Depends(get_user_from_token),
+):
+    """
+    Пакетное сокращение: тело - JSON-массив объектов LinkRequest или NDJSON.
+    Коды выделяются разом, занятость alias проверяется одним запросом,
+    ссылки пишутся многострочными INSERT, Redis заполняется пайплайном.
+    """
+    # Гостю - пакеты поменьше: ограничения частоты по умолчанию выключены
+    max_size = SHORTEN_BATCH_MAX_SIZE if user_id else SHORTEN_BATCH_GUEST_MAX_SIZE
+    if max_size <= 0:
+        raise HTTPException(status_code=401, detail="Пакетное сокращение доступно только авторизованным пользователям")
+    items = await _read_batch_items(request, max_size)
+    if len(items) > max_size:
+        raise HTTPException(status_code=413, detail=f"Не больше {max_size} ссылок в одном запросе")
+    partial = SHORTEN_BATCH_PARTIAL if atomic is None else not atomic
+
+    results = [None] * len(items)
+    pending = []  # (index, cleaned_url, alias, expires_at_query)
+    for index, item in enumerate(items):
+        try:
+            link_request = LinkRequest.model_validate(item)
+        except ValidationError as e:
+            results[index] = {"index": index, "error": e.errors(include_url=False, include_context=False)}
+            continue
+        cleaned_url, expires_at_query = extract_expires_at(link_request.original_url)
+        pending.append((index, cleaned_url, link_request.customAlias, expires_at_query))
+
+    # Занятость alias: повторы внутри пакета и одна проверка в БД
+    aliases = [alias for _, _, alias, _ in pending if alias]
+    taken = set()
+    if aliases:
+        result = await db.execute(select(ShortLink.short_code).where(ShortLink.short_code.in_(aliases)))
+        taken = set(result.scalars().all())
+    seen = set()
+    accepted = []
+    for entry in pending:
+        index, _, alias, _ = entry
+        if alias and (alias in taken or alias in seen):
+            results[index] = {"index": index, "error": "This alias is already taken. Please choose another."}
+            continue
+        if alias:
+            seen.add(alias)
+        accepted.append(entry)
+
+    if not partial and any(results):
+        failed = [r for r in results if r]
+        raise HTTPException(status_code=400, detail={"message": "Пакет отклонён целиком", "errors": failed})
+
+    # Коды для ссылок без alias - одним выделением
+    need_codes = sum(1 for _, _, alias, _ in accepted if not alias)
+    codes = await _allocate_batch_codes(db, need_codes, seen)
+
+    now = datetime.now()
+    rows = []
+    for index, cleaned_url, alias, expires_at_query in accepted:
+        expires_at, auto_expires = link_expiry(user_id, expires_at_query)
+        rows.append({
+            "short_code": alias or codes.pop(),
+            "original_url": cleaned_url,
+            "created_at": now,
+            "expires_at": expires_at,
+            "user_id": user_id,
+            "auto_expires_at": auto_expires,
+            **url_columns(cleaned_url),
+            "index": index,
+            "alias": bool(alias),
+        })
+
+    # Строки с уже занятым кодом пропускаются. Сгенерированный код мог занять параллельный
+    # запрос: такие строки получают новые коды (как shorten_link), занятый alias - ошибка
+    inserted = await _insert_batch_rows(db, rows)
+    retry = [row for row in rows if row["short_code"] not in inserted and not row["alias"]]
+    for _ in range(SHORT_CODE_INSERT_ATTEMPTS - 1):
+        if not retry:
+            break
+        fresh = await _allocate_batch_codes(db, len(retry), seen | inserted)
+        for row in retry:
+            row["short_code"] = fresh.pop()
+        inserted |= await _insert_batch_rows(db, retry)
+        retry = [row for row in retry if row["short_code"] not in inserted]
+
+    conflicts = [row for row in rows if row["short_code"] not in inserted]
+    if conflicts and not partial:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail={
+            "message": "Пакет отклонён целиком",
+            "errors": [{"index": row["index"], "error": _batch_conflict_error(row)} for row in conflicts],
+        })
+    await db.commit()
+
+    host = str(request.base_url).rstrip("/")
+    earliest = None
+    async with redis.pipeline(transaction=False) as pipe:
+        for row in rows:
+            if row["short_code"] not in inserted:
+                results[row["index"]] = {"index": row["index"], "error": _batch_conflict_error(row)}
+                continue
+            queue_link_record(pipe, row["short_code"], row["original_url"], user_id, row["expires_at"])
+            expires = effective_expiry(row["expires_at"], row["auto_expires_at"])
+            queue_expiry(pipe, row["short_code"], expires, wake=False)
+            earliest = expires if earliest is None or expires < earliest else earliest
+            # Код мог быть закэширован как несуществующий
+            queue_link_invalidation(pipe, row["short_code"])
+            results[row["index"]] = {
+                "index": row["index"],
+                "short_url": f"{host}/links/{row['short_code']}",
+                "original_url": row["original_url"],
+                "custom_alias": row["short_code"],
+            }
+        if earliest is not None:
+            queue_expiry_wake(pipe, earliest)
+        await pipe.execute()
+
+    return {
+        "created": len(inserted),
+        "failed": len(results) - len(inserted),
+        "results": results,
+    }
+
+
+async def _insert_batch_rows(db: AsyncSession, rows: list) -> set:
+    """Многострочные INSERT ... ON CONFLICT DO NOTHING; возвращает вставленные коды."""
+    table = ShortLink.__table__
+    inserted = set()
+    for start in range(0, len(rows), SHORTEN_BATCH_INSERT_CHUNK):
+        chunk = rows[start:start + SHORTEN_BATCH_INSERT_CHUNK]
+        stmt = (
+            pg_insert(table)
+            .values([{k: v for k, v in row.items() if k not in ("index", "alias")} for row in chunk])
+            .on_conflict_do_nothing(index_elements=["short_code"])
+            .returning(table.c.short_code)
+        )
+        result = await db.execute(stmt)
+        inserted.update(result.scalars().all())
+    return inserted
+
+
+def _batch_conflict_error(row: dict) -> str:
+    if row["alias"]:
+        return "This alias is already taken. Please choose another."
+    return "Не удалось подобрать свободный короткий код"
+
+
+async def _allocate_batch_codes(db: AsyncSession, count: int, reserved: set) -> list:
+    if count == 0:
+        return []
+    if code_allocator.collision_free:
+        return await code_allocator.allocate(count)
+
+    # Режим hex: случайные коды, повторы отсеиваются одним запросом на раунд
+    codes = set()
+    while len(codes) < count:
+        candidates = {generate_short_code("batch") for _ in range(count - len(codes))}
+        candidates -= codes | reserved
+        # В БД проверяются только коды, которые фильтр Блума не отсеял
+        maybe_taken = {code for code in candidates if short_code_filter.might_contain(code)}
+        taken = set()
+        if maybe_taken:
+            result = await db.execute(select(ShortLink.short_code).where(ShortLink.short_code.in_(maybe_taken)))
+            taken = set(result.scalars().all())
+        codes |= candidates - taken
+    return list(codes)
+
+
+
 @app.post("/register")
 async def register_user(
     username: str = Form(...),
@@ -294,7 +693,7 @@ async def register_user(
                 raise HTTPException(status_code=400, detail="Email уже зарегистрирован")
 
         # Создаём нового пользователя
-        new_user = User(username=username, email=email, password=hash_password(password))
+        new_user = User(username=username, email=email, password=await hash_password_async(password))
         db.add(new_user)
         await db.commit()
 
@@ -303,8 +702,8 @@ async def register_user(
 
     except HTTPException as e:
         raise e
-    except Exception as e:
-        print(f"Ошибка при регистрации: {e}")
+    except Exception:
+        logger.exception("Ошибка при регистрации")
         raise HTTPException(status_code=500, detail="Внутренняя ошибка сервера")
 
 
@@ -318,23 +717,24 @@ async def login_for_access_token(
     result = await db.execute(select(User).where(User.username == form_data.username))
     user = result.scalars().first()
 
-    # Проверка учетных данных
-    if not user or not verify_password(form_data.password, user.password):
+    # Проверка учетных данных (bcrypt - в отдельном пуле потоков)
+    verified, new_hash = (
+        await verify_and_update_password(form_data.password, user.password) if user else (False, None)
+    )
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    # Генерация токена
-    access_token = jwt.encode(
-        {
-            "sub": user.username,
-            "exp": datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-        },
-        SECRET_KEY,
-        algorithm=ALGORITHM
-    )
+    # Хэш с прежней стоимостью bcrypt пересчитан при проверке - сохраняем
+    if new_hash:
+        user.password = new_hash
+        await db.commit()
+
+    # Генерация токена: user_id и поколение - в клэймах, чтобы не искать пользователя на каждом запросе
+    access_token = create_access_token(user.username, user.id, await current_generation(user.id))
 
     # Определяем тип клиента
     return {
@@ -346,42 +746,25 @@ async def login_for_access_token(
 
 @app.get("/logout")
 async def logout():
-    # Удаляем токен из куки
+    # Только куки этого браузера: GET может прийти по ссылке или картинке с чужого сайта
     response = RedirectResponse(url="/")
     response.delete_cookie("token")  # Удаляем куки
     return response
 
 
+@app.post("/logout")
+async def logout_everywhere(
+    user_id: Optional[int] = Depends(get_user_from_token),
+    redis: Redis = Depends(redis_dependency),
+):
+    """Отзывает все токены пользователя. Токен - только из заголовка Authorization, не из куки."""
+    if user_id is None:
+        raise HTTPException(status_code=401, detail="Неавторизованный доступ")
+    await revoke_user_tokens(redis, user_id)
 
-# Инициализация GeoIP2
-reader = geoip2.database.Reader('app/GeoLite2-Country.mmdb')
-
-def get_country_by_ip(ip: str) -> str:
-    try:
-        response = reader.country(ip)
-        return response.country.iso_code  # Например, 'US', 'RU'
-    except:
-        return None  # Если IP не определён
-
-
-def parse_domains(url: str):
-    """Парсит домен 1-го (зона, например, com, ru) и 2-го уровня (example.com) через urlparse."""
-    parsed_url = urlparse(url)
-    hostname = parsed_url.hostname  # Например, "sub.example.com"
-
-    if not hostname:
-        return None, None
-
-    parts = hostname.split(".")
-
-    if len(parts) >= 2:
-        domain_1st = parts[-1]  # Зона (TLD), например, "com", "ru"
-        domain_2nd = ".".join(parts[-2:])  # Домен второго уровня, например, "example.com"
-    else:
-        domain_1st = hostname
-        domain_2nd = hostname
-
-    return domain_1st, domain_2nd
+    response = JSONResponse({"message": "Successfully logged out"})
+    response.delete_cookie("token")
+    return response
 
 
 
@@ -392,65 +775,23 @@ async def delete_short_link(
     db: AsyncSession = Depends(get_db),
     redis: Redis = Depends(redis_dependency),
 ):
-    print(f"Получен запрос на удаление ссылки с кодом: {short_code} от пользователя с ID: {user_id}")
-    
+    logger.debug("Удаление ссылки %s пользователем %s", short_code, user_id)
+
     if user_id is None:
         return {"Ошибка": "Попытка удалить ссылку неавторизованным пользователем."}
 
     try:
-        query = select(ShortLink).where(ShortLink.short_code == short_code, ShortLink.user_id == user_id)
-        result = await db.execute(query)
-        short_link = result.scalars().first()
+        archived = await archive_links(
+            db,
+            (ShortLink.short_code == short_code) & (ShortLink.user_id == user_id),
+            "deleted",
+            skip_locked=False,
+        )
 
-        if not short_link:
+        if not archived:
             return {"Ошибка": "Ссылка не найдена или у вас нет прав на ее удаление."}
 
-        archived_link = ShortLinkArchive(
-            user_id=short_link.user_id,
-            short_code=short_link.short_code,
-            original_url=short_link.original_url,
-            created_at=short_link.created_at,
-            expires_at=short_link.expires_at,
-            last_access_at=short_link.last_access_at,
-            auto_expires_at=short_link.auto_expires_at,
-            archived_at=datetime.now(),
-            archival_reason="deleted"
-        )
-        db.add(archived_link)
-
-        query_visits = select(Visit).where(Visit.short_code == short_code)
-        result_visits = await db.execute(query_visits)
-        visits = result_visits.scalars().all()
-
-        if visits:
-            
-            for visit in visits:
-                visit_archive = VisitArchive(
-                    owner=visit.owner,
-                    timestamp=visit.timestamp,
-                    short_code=visit.short_code,
-                    original_url=visit.original_url,
-                    domain_1st=visit.domain_1st,
-                    domain_2nd=visit.domain_2nd,
-                    ip_address=visit.ip_address,
-                    device_type=visit.device_type,
-                    country=visit.country,
-                    referer=visit.referer,
-                    archived_at=datetime.now(),
-                    archival_reason="deleted"
-                )
-                db.add(visit_archive)
-                await db.delete(visit) 
-
-        else:
-            print(f"Визитов для ссылки {short_code} не найдено.")
-
-        await db.delete(short_link)
-
-        await redis.delete(f"shortlink:{short_code}")
-        await redis.delete(f"short_ui:{short_code}")
-
-        await db.commit()
+        await forget_links(redis, archived)
         
     except Exception as e:
         await db.rollback()
@@ -504,8 +845,10 @@ async def update_short_link(
             detail="Ссылка не найдена или у вас нет прав на её изменение"
         )
 
-    old_encoded_url = encode_url(short_link.original_url)
+    old_url = short_link.original_url
     short_link.original_url = new_url
+    for name, value in url_columns(new_url).items():
+        setattr(short_link, name, value)
     short_link.created_at = datetime.utcnow()
     short_link.auto_expires_at = datetime.utcnow() + timedelta(days=LINK_EXPIRE_TIME_IN_DAYS_REG)
 
@@ -516,14 +859,16 @@ async def update_short_link(
         short_link.expires_at = None
 
 
-    new_encoded_url = encode_url(new_url)
-    await redis.delete(f"longlink:{old_encoded_url}")
-    await redis.delete(f"shortlink:{short_code}")
-    await redis.set(f"shortlink:{short_code}", new_encoded_url, ex=int(REDIS_TTL))
-    await redis.set(f"longlink:{new_encoded_url}", short_code, ex=int(REDIS_TTL))
-
     await db.commit()
 
+    # Старое обратное соответствие и новая запись - одной транзакцией Redis
+    async with redis.pipeline(transaction=True) as pipe:
+        queue_link_delete(pipe, short_code, old_url)
+        queue_link_record(pipe, short_code, new_url, user_id, None)
+        queue_expiry(pipe, short_code, short_link.auto_expires_at)
+        await pipe.execute()
+    await invalidate_link(redis, short_code)
+
     return {
         "short_code": short_code,
         "new_url": new_url,
@@ -537,35 +882,43 @@ async def update_short_link(
 @app.get("/links/{short_code}/stats")
 async def get_link_stats(
     short_code: str,
-    db: AsyncSession = Depends(get_db),
+    granularity: str = "day",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_read_db),
+    redis: Redis = Depends(redis_dependency),
 ):
-    print(f"[DEBUG] Запрос статистики для короткой ссылки: {short_code}")
-
+    """
+    Статистика ссылки: число кликов, уникальные посетители и последний доступ -
+    из счётчиков Redis, ряды и разрезы - из visit_rollups за период.
+    """
+    if granularity not in GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity: одно из {', '.join(GRANULARITIES)}")
+    logger.debug("Запрос статистики для короткой ссылки %s", short_code)
 
     query = select(ShortLink).where(ShortLink.short_code == short_code)
     result = await db.execute(query)
     short_link = result.scalars().first()
 
     if not short_link:
-        print(f"[ERROR] Короткая ссылка {short_code} не найдена в базе данных")
         raise HTTPException(status_code=404, detail="Short link not found")
 
-    print(f"[INFO] Найдена ссылка в БД: {short_link.short_code}")
 
-  
-    visit_query = select(func.count()).where(Visit.short_code == short_code)
-    visit_result = await db.execute(visit_query)
-    visit_count = visit_result.scalar()  
+    rollup = (await read_stats(db, [short_code], granularity, start, end))[short_code]
+    clicks = click_stats(short_link, await read_clicks(redis, short_code))
 
     stats = {
         "original_url": short_link.original_url,
         "created_at": short_link.created_at,
-        "visit_count": visit_count,  
-        "last_access_at": short_link.last_access_at,  
+        # За период - из visit_rollups, за всё время - живой счётчик
+        "visit_count": rollup["total"] if start or end else clicks["visit_count"],
+        "unique_visitors": clicks["unique_visitors"],
+        "last_access_at": clicks["last_access_at"],
+        "granularity": granularity,
+        "series": rollup["series"],
+        "breakdown": rollup["breakdown"],
     }
 
-    print(f"[INFO] Статистика для короткой ссылки {short_code}: {stats}")
-
     return stats
 
 
@@ -574,131 +927,202 @@ async def get_link_stats(
 
 
 
+@app.get("/links/{short_code}/insights")
+async def get_link_insights(
+    short_code: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    top: int = 10,
+    db: AsyncSession = Depends(get_read_db),
+):
+    """Уникальные посетители и самые частые referer, страны и домены за период по дневным сводкам link_sketches."""
+    if not 1 <= top <= SKETCH_TOP_K:
+        raise HTTPException(status_code=400, detail=f"top: от 1 до {SKETCH_TOP_K}")
+
+    exists = await db.execute(select(ShortLink.id).where(ShortLink.short_code == short_code))
+    if exists.scalar() is None:
+        raise HTTPException(status_code=404, detail="Short link not found")
+
+    return {"short_code": short_code, **await read_insights(db, short_code, start, end, top)}
+
+
+
 # ***************************************************************************************************************
 
 @app.get("/links/search")
 async def search_short_link(
-    original_url: str,  # Параметр снова 'original_url'
+    original_url: Optional[str] = None,
+    domain: Optional[str] = None,
+    cursor: Optional[int] = None,
+    limit: Optional[int] = None,
+    user_id: Optional[int] = Depends(get_user_from_token),
     redis: Redis = Depends(redis_dependency),
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
+    """
+    original_url - самая свежая короткая ссылка на этот адрес (с точностью до канонического вида).
+    domain - ссылки пользователя на домен и его поддомены, постранично.
+    """
+    if domain is not None:
+        return await _search_domain(domain, cursor, limit, user_id, db)
+    if original_url is None:
+        raise HTTPException(status_code=400, detail="Укажите original_url или domain")
 
-    print(f"[DEBUG] Переданный original_url: {original_url}")
+    logger.debug("Поиск короткой ссылки для %s", original_url)
 
     # Валидация URL
     if not re.match(r"^https?://", original_url):
-        print(f"[ERROR] Некорректный URL: {original_url}")
         raise HTTPException(status_code=400, detail="Некорректный URL")
 
 
-    encoded_url = encode_url(original_url)
-    cached_short_code = await redis.get(f"longlink:{encoded_url}")
+    cached_short_code = await get_longlink(redis, original_url)
 
     if cached_short_code:
-        short_code = decode_url(cached_short_code)  # Декодируем из Redis
-        return {"short_code": short_code, "original_url": original_url}
+        return {"short_code": cached_short_code, "original_url": original_url}
 
+    # Индекс (url_hash, created_at): одна строка индекса вместо просмотра original_url
     query = (
-        select(ShortLink)
-        .where(ShortLink.original_url == original_url)
+        select(ShortLink.short_code, ShortLink.original_url)
+        .where(ShortLink.url_hash == url_hash(original_url))
         .order_by(ShortLink.created_at.desc())  # Берем самую свежую
+        .limit(1)
     )
-    result = await db.execute(query)
-    short_link = result.scalars().first()
+    short_link = (await db.execute(query)).first()
 
     if not short_link:
         raise HTTPException(status_code=404, detail="Short link not found for the provided URL")
 
-    await redis.set(f"longlink:{encoded_url}", encode_url(short_link.short_code))
+    await redis.set(longlink_key(original_url), short_link.short_code, ex=REDIS_TTL)
 
 
     return {"short_code": short_link.short_code, "original_url": short_link.original_url}
 
 
+async def _search_domain(
+    domain: str,
+    cursor: Optional[int],
+    limit: Optional[int],
+    user_id: Optional[int],
+    db: AsyncSession,
+) -> dict:
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Неавторизованный доступ")
+    limit = check_limit(limit)
+    host = reverse_domain(domain)
+    if not host:
+        raise HTTPException(status_code=400, detail="Некорректный домен")
 
-# ***************************************************************************************************************
-
-@app.get("/links/{short_code}")
-async def redirect_to_original_link(
-    short_code: str,
-    request: Request,
-    db: AsyncSession = Depends(get_db),
-    redis: Redis = Depends(redis_dependency),
-):
-    redis_key = f"shortlink:{short_code}"
-    user_cache_key = f"short_ui:{short_code}"  
-
-
-    user_id = await redis.get(user_cache_key)
-    if user_id is None:
+    # Домен и поддомены - один диапазон индекса (user_id, reversed_host text_pattern_ops)
+    pattern = host.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + ".%"
+    query = (
+        select(ShortLink.id, ShortLink.short_code, ShortLink.original_url, ShortLink.created_at)
+        .where(
+            ShortLink.user_id == user_id,
+            (ShortLink.reversed_host == host) | ShortLink.reversed_host.like(pattern, escape="\\"),
+        )
+        .order_by(ShortLink.id)
+        .limit(limit + 1)
+    )
+    if cursor is not None:
+        query = query.where(ShortLink.id > cursor)
+    rows = (await db.execute(query)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "items": [
+            {"short_code": row.short_code, "original_url": row.original_url, "created_at": row.created_at}
+            for row in rows
+        ],
+        "next_cursor": rows[-1].id if has_more else None,
+    }
 
-        query = select(ShortLink.user_id).where(ShortLink.short_code == short_code)
-        result = await db.execute(query)
-        user_id = result.scalar()
 
 
-        if user_id is None:
-            user_id = None  
+# ***************************************************************************************************************
 
+# Одновременные промахи по одному коду в воркере ждут одну загрузку из БД
+link_loads = SingleFlight()
+metrics.register_stats("link_loads", link_loads.stats)
+
+
+async def _load_link_from_db(short_code: str, redis: Redis):
+    """Загрузка ссылки из базы в Redis; с LINK_LOAD_LOCK_TTL - одна на все воркеры."""
+    token = None
+    if LINK_LOAD_LOCK_TTL > 0:
+        token = await acquire_load_lock(redis, short_code)
+        if token is None:
+            # Код уже загружает другой воркер
+            record = await wait_for_link_record(redis, short_code)
+            if record:
+                return record["url"], record["owner"]
+    try:
+        # Своя сессия: загрузка переживает запрос, который её начал
+        async with request_session() as db:
+            query = select(ShortLink.original_url, ShortLink.user_id, ShortLink.expires_at).where(
+                ShortLink.short_code == short_code
+            )
+            short_link = (await db.execute(query)).first()
 
-        await redis.set(user_cache_key, str(user_id) if user_id is not None else "guest", ex=REDIS_TTL)
-    else:
-        user_id = None if user_id == "guest" else int(user_id)
+        if not short_link:
+            return None, None
 
+        await set_link_record(
+            redis, short_code, short_link.original_url, short_link.user_id, short_link.expires_at
+        )
+        return short_link.original_url, short_link.user_id
+    finally:
+        if token is not None:
+            await release_load_lock(redis, short_code, token)
+
+
+async def _load_link(short_code: str, redis: Redis):
+    """Достаёт (original_url, user_id) из Redis, при промахе - из базы. Если ссылки нет - (None, None)."""
+    record = await get_link_record(redis, short_code)
+    if record:
+        return record["url"], record["owner"]
+    if not short_code_filter.might_contain(short_code):
+        # Кода точно нет (сканеры, опечатки) - без запроса к БД
+        return None, None
+    return await link_loads.do(short_code, lambda: _load_link_from_db(short_code, redis))
 
-    encoded_url = await redis.get(redis_key)
 
-    if encoded_url:
-        original_url = decode_url(encoded_url)
-        await redis.expire(redis_key, REDIS_TTL)
-        await redis.expire(f"longlink:{encoded_url}", REDIS_TTL)
+@app.get("/links/{short_code}", dependencies=[rate_limited("redirect")])
+async def redirect_to_original_link(
+    short_code: str,
+    request: Request,
+    redis: Redis = Depends(redis_dependency),
+):
+    cached = get_cached_link(short_code)
+    if cached is NOT_FOUND:
+        return RedirectResponse("https://www.google.com/")  # Редирект на Google
+    if cached is not None:
+        original_url, user_id = cached
     else:
-
-        query = select(ShortLink).where(ShortLink.short_code == short_code)
-        result = await db.execute(query)
-        short_link = result.scalars().first()
-
-        if not short_link:
+        original_url, user_id = await _load_link(short_code, redis)
+        if original_url is None:
+            cache_missing_link(short_code)
             return RedirectResponse("https://www.google.com/")  # Редирект на Google
-
-        original_url = short_link.original_url
-        await redis.set(redis_key, encode_url(original_url), ex=REDIS_TTL)
+        cache_link(short_code, original_url, user_id)
 
 
     ip_address = request.client.host if request.client else "unknown"
 
+    # Сырое событие клика: домены, тип устройства и страну вычислит фоновая запись визитов
+    visit = {
+        "owner": user_id,
+        "timestamp": datetime.now(),
+        "short_code": short_code,
+        "ip_address": ip_address,
+        "user_agent": request.headers.get("User-Agent", ""),
+        "referer": request.headers.get("Referer"),
+    }
+    if not GEOIP_DEFERRED:
+        visit["country"] = geoip.country(ip_address)
 
-    country = get_country_by_ip(ip_address)
-
-
-    user_agent = request.headers.get("User-Agent", "").lower()
-    device_type = "mobile" if "mobile" in user_agent else "desktop"
-
-    domain_1st, domain_2nd = parse_domains(original_url)
-
-
-    visit = Visit(
-        owner=user_id,
-        timestamp=datetime.now(),
-        short_code=short_code,
-        original_url=original_url,
-        domain_1st=domain_1st,
-        domain_2nd=domain_2nd,
-        ip_address=ip_address,
-        device_type=device_type,
-        country=country,
-        referer=request.headers.get("Referer"),
-    )
-    db.add(visit)
-
-    # ОБНОВЛЯЕМ last_access_at ДЛЯ ВСЕХ ССЫЛОК
-    await db.execute(
-        update(ShortLink)
-        .where(ShortLink.short_code == short_code)
-        .values(last_access_at=datetime.now())
-    )
-
-    await db.commit()  # Один коммит для всех изменений
+    # Визит пишется в фоне пакетами, редирект не ждёт базу
+    await visit_queue.put(visit)
+    # Живые счётчики для статистики - один пайплайн Redis
+    await click_counter.record(redis, short_code, ip_address, visit["timestamp"])
 
     return RedirectResponse(original_url)
 
@@ -707,162 +1131,75 @@ async def redirect_to_original_link(
 @app.get("/archive/stats")
 async def get_archived_stats(
     filter: ArchiveFilter,
+    cursor: Optional[int] = None,
+    limit: Optional[int] = None,
+    format: str = "json",
     user_id: int = Depends(get_user_from_token),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
-    query = select(VisitArchive).where(VisitArchive.owner == user_id)
+    # Без проверки owner == None превратился бы в IS NULL - архив визитов всех гостевых ссылок
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Неавторизованный доступ")
 
+    limit = check_params(format, limit)
+    conditions = [VisitArchive.owner == user_id]
 
     if filter.short_code:
-        query = query.where(VisitArchive.short_code == filter.short_code)
+        conditions.append(VisitArchive.short_code == filter.short_code)
 
-    result = await db.execute(query)
-    visits = result.scalars().all()
-
-
-    grouped_stats = {}
-    for visit in visits:
-        key = (visit.short_code, visit.original_url)
-        if key not in grouped_stats:
-            grouped_stats[key] = []
-        grouped_stats[key].append({
-            "timestamp": visit.timestamp,
-            "domain_1st": visit.domain_1st,
-            "domain_2nd": visit.domain_2nd,
-            "ip_address": visit.ip_address,
-            "device_type": visit.device_type,
-            "country": visit.country,
-            "referer": visit.referer,
-            "archived_at": visit.archived_at,
-            "archival_reason": visit.archival_reason
-        })
+    if format != "json":
+        return stream_visits(VisitArchive, ARCHIVE_FIELDS, conditions, cursor, format, "archive_stats")
 
-    return grouped_stats
+    return await read_page(db, VisitArchive, ARCHIVE_FIELDS, conditions, cursor, limit)
 
 
 
 @app.get("/active-links/stats")
 async def get_active_link_stats(
     filter: ArchiveFilter,  
+    summary: bool = False,
+    cursor: Optional[int] = None,
+    limit: Optional[int] = None,
+    format: str = "json",
+    granularity: str = "day",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
     user_id: int = Depends(get_user_from_token),  
-    db: AsyncSession = Depends(get_db),
+    db: AsyncSession = Depends(get_read_db),
 ):
 
     if not user_id:
         raise HTTPException(status_code=401, detail="Неавторизованный доступ")
 
-
-    query = select(Visit).where(Visit.owner == user_id)
-
+    if summary:
+        # Сводка по ссылкам пользователя из visit_rollups, без чтения самих визитов
+        if granularity not in GRANULARITIES:
+            raise HTTPException(status_code=400, detail=f"granularity: одно из {', '.join(GRANULARITIES)}")
+        links_query = select(ShortLink.short_code, ShortLink.original_url).where(ShortLink.user_id == user_id)
+        if filter.short_code:
+            links_query = links_query.where(ShortLink.short_code == filter.short_code)
+        links = (await db.execute(links_query)).all()
+        if not links:
+            raise HTTPException(status_code=404, detail="Не найдено активных ссылок для данного пользователя")
+        rollups = await read_stats(db, [link.short_code for link in links], granularity, start, end)
+        return {
+            link.short_code: {"original_url": link.original_url, **rollups[link.short_code]}
+            for link in links
+        }
+
+
+    limit = check_params(format, limit)
+    conditions = [Visit.owner == user_id]
 
     if filter.short_code:
-        query = query.where(Visit.short_code == filter.short_code)
-
-    result = await db.execute(query)
-    visits = result.scalars().all()
-
-    if not visits:
-        raise HTTPException(status_code=404, detail="Не найдено активных визитов для данного пользователя")
-
-
-    grouped_stats = {}
-    for visit in visits:
-        key = (visit.short_code, visit.original_url)
-        if key not in grouped_stats:
-            grouped_stats[key] = []
-        grouped_stats[key].append({
-            "timestamp": visit.timestamp.isoformat(),
-            "domain_1st": visit.domain_1st,
-            "domain_2nd": visit.domain_2nd,
-            "ip_address": visit.ip_address,
-            "device_type": visit.device_type,
-            "country": visit.country,
-            "referer": visit.referer
-        })
-
-    return grouped_stats
+        conditions.append(Visit.short_code == filter.short_code)
 
+    if format != "json":
+        return stream_visits(Visit, VISIT_FIELDS, conditions, cursor, format, "active_stats")
 
+    page = await read_page(db, Visit, VISIT_FIELDS, conditions, cursor, limit)
 
+    if not page["items"] and cursor is None:
+        raise HTTPException(status_code=404, detail="Не найдено активных визитов для данного пользователя")
 
-async def archive_expired_links():
-    period=60 #время между проверками удаляем каждую минуту т.к. есть задача  удаления ссылки с точностьбю до минуты
-    """Фоновая задача для архивации устаревших ссылок и визитов и очистки Redis."""
-    while True:
-        async with get_db() as db, get_redis() as redis:
-            now = datetime.now()
-
-            try:
-                # 1. Выбираем ссылки с истекшим сроком
-                query = (
-                    select(ShortLink)
-                    .where((ShortLink.auto_expires_at < now) | (ShortLink.expires_at < now))
-                    .options(joinedload(ShortLink.visits))  # Загружаем визиты сразу
-                )
-                result = await db.execute(query)
-                expired_links = result.scalars().all()
-
-                if not expired_links:
-                    await asyncio.sleep(period)  # Если нет устаревших, ждем 
-                    continue
-
-                archived_links = []
-                archived_visits = []
-                short_codes_to_delete = set()
-
-                for link in expired_links:
-                    reason = "auto exp" if link.auto_expires_at < now else "exp"
-
-                    archived_links.append(
-                        ShortLinkArchive(
-                            user_id=link.user_id,
-                            short_code=link.short_code,
-                            original_url=link.original_url,
-                            created_at=link.created_at,
-                            expires_at=link.expires_at,
-                            last_access_at=link.last_access_at,
-                            auto_expires_at=link.auto_expires_at,
-                            archived_at=datetime.now(),
-                            archival_reason=reason
-                        )
-                    )
-
-                    for visit in link.visits:
-                        archived_visits.append(
-                            VisitArchive(
-                                owner=visit.owner,
-                                timestamp=visit.timestamp,
-                                short_code=visit.short_code,
-                                original_url=visit.original_url,
-                                domain_1st=visit.domain_1st,
-                                domain_2nd=visit.domain_2nd,
-                                ip_address=visit.ip_address,
-                                device_type=visit.device_type,
-                                country=visit.country,
-                                referer=visit.referer,
-                                archived_at=datetime.now(),
-                                archival_reason=reason
-                            )
-                        )
-
-                    short_codes_to_delete.add(link.short_code)
-
-                db.add_all(archived_links)
-                db.add_all(archived_visits)
-
-                await db.execute(delete(Visit).where(Visit.short_code.in_(short_codes_to_delete)))
-                await db.execute(delete(ShortLink).where(ShortLink.short_code.in_(short_codes_to_delete)))
-
-                for short_code in short_codes_to_delete:
-                    original_url = await redis.get(f"shortlink:{short_code}")
-                    if original_url:
-                        await redis.delete(f"shortlink:{short_code}")
-                        await redis.delete(f"longlink:{original_url.decode()}")
-
-                await db.commit()
-
-            except Exception as e:
-
-                await db.rollback()  # ОТКАТ всех изменений в случае ошибки
-
-        await asyncio.sleep(period)  
\ No newline at end of file
+    return page
@@ -0,0 +1,236 @@
+import asyncio
+import os
+import time
+from typing import Callable, Dict, List, Optional
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+    generate_latest, multiprocess,
+)
+from redis.asyncio import Redis
+from redis.asyncio.client import Pipeline
+from sqlalchemy import event
+
+from app.config import METRICS_SAMPLE_INTERVAL
+
+# Метрики Prometheus, отдаются эндпоинтом GET /metrics.
+# При нескольких воркерах uvicorn значения пишутся в файлы каталога
+# PROMETHEUS_MULTIPROC_DIR и суммируются при выдаче (multiprocess-режим
+# prometheus_client); каталог нужно очищать перед запуском.
+# На горячем пути только perf_counter и observe/inc уже созданных дочерних
+# метрик: стоимость на редирект проверяет benchmarks/bench_metrics_overhead.py.
+
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+# Редирект из кэша занимает доли миллисекунды, поэтому корзины начинаются со 100 мкс
+_FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+_HTTP_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_JOB_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "Время обработки HTTP-запроса",
+    ["method", "route", "status"], buckets=_HTTP_BUCKETS,
+)
+REDIS_LATENCY = Histogram(
+    "redis_command_duration_seconds", "Время команды или пайплайна Redis",
+    ["operation"], buckets=_FAST_BUCKETS,
+)
+DB_LATENCY = Histogram(
+    "db_query_duration_seconds", "Время запроса к PostgreSQL",
+    ["database", "operation"], buckets=_FAST_BUCKETS,
+)
+CACHE_LOOKUPS = Counter(
+    "cache_lookups_total", "Обращения к кэшу ссылок в Redis",
+    ["cache", "result"],
+)
+ARCHIVAL_DURATION = Histogram(
+    "archival_duration_seconds", "Длительность архивации ссылок",
+    ["job"], buckets=_JOB_BUCKETS,
+)
+ARCHIVED_ROWS = Counter(
+    "archived_rows_total", "Строк перенесено в архив",
+    ["job", "table"],
+)
+LOOP_LAG = Histogram(
+    "event_loop_lag_seconds", "Опоздание event loop относительно заданного сна",
+    buckets=_FAST_BUCKETS,
+)
+COMPONENT_STATS = Gauge(
+    "app_component_stat", "Счётчики stats() компонентов воркера (очередь визитов, кэши, пулы)",
+    ["component", "stat"], multiprocess_mode="liveall",
+)
+
+# Дочерние метрики по меткам: labels() берёт блокировку, повторно её не берём
+_children: Dict[tuple, object] = {}
+
+
+def _child(metric, *labels):
+    key = (metric, labels)
+    child = _children.get(key)
+    if child is None:
+        child = _children[key] = metric.labels(*labels)
+    return child
+
+
+def observe_redis(operation: str, seconds: float):
+    _child(REDIS_LATENCY, operation).observe(seconds)
+
+
+def observe_db(database: str, operation: str, seconds: float):
+    _child(DB_LATENCY, database, operation).observe(seconds)
+
+
+def record_cache_lookup(cache: str, hit: bool):
+    _child(CACHE_LOOKUPS, cache, "hit" if hit else "miss").inc()
+
+
+def record_archival(job: str, seconds: float, links: int, visits: int):
+    _child(ARCHIVAL_DURATION, job).observe(seconds)
+    _child(ARCHIVED_ROWS, job, "short_links").inc(links)
+    _child(ARCHIVED_ROWS, job, "visits").inc(visits)
+
+
+# --- HTTP ---
+
+class MetricsMiddleware:
+    """
+    ASGI-middleware: время каждого запроса по шаблону маршрута (/links/{short_code}),
+    а не по фактическому пути - число рядов метрики не растёт с числом кодов.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # Маршрут FastAPI записывает в scope при сопоставлении пути
+            route = getattr(scope.get("route"), "path", "unmatched")
+            _child(HTTP_LATENCY, scope["method"], route, str(status)).observe(time.perf_counter() - started)
+
+
+# --- Redis ---
+
+class InstrumentedPipeline(Pipeline):
+    async def execute(self, raise_on_error: bool = True):
+        started = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        finally:
+            observe_redis("multi" if self.is_transaction else "pipeline", time.perf_counter() - started)
+
+
+class InstrumentedRedis(Redis):
+    """Клиент Redis, замеряющий время каждой команды; пайплайн замеряется целиком."""
+
+    async def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            observe_redis(str(args[0]).lower(), time.perf_counter() - started)
+
+    def pipeline(self, transaction: bool = True, shard_hint: Optional[str] = None) -> InstrumentedPipeline:
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+# --- PostgreSQL ---
+
+_SQL_OPERATIONS = {"select", "insert", "update", "delete", "with"}
+
+
+def _sql_operation(statement: str) -> str:
+    operation = statement.lstrip()[:8].split(None, 1)
+    operation = operation[0].lower() if operation else ""
+    return operation if operation in _SQL_OPERATIONS else "other"
+
+
+def instrument_engine(engine, database: str = "primary"):
+    """
+    Замер запросов через события движка: покрывает и get_db, и фоновые задачи.
+    database - метка движка (primary или replica).
+    """
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["metrics_started"].pop()
+        observe_db(database, _sql_operation(statement), time.perf_counter() - started)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(context):
+        # Ошибочный запрос не доходит до after_cursor_execute
+        stack = context.connection.info.get("metrics_started") if context.connection is not None else None
+        if stack:
+            started = stack.pop()
+            observe_db(database, "error", time.perf_counter() - started)
+
+
+# --- Фоновые показатели ---
+
+_stats_sources: List[tuple] = []
+
+
+def register_stats(component: str, source: Callable[[], dict]):
+    """Источник stats(): его числовые поля выгружаются как app_component_stat."""
+    _stats_sources.append((component, source))
+
+
+def _flatten(prefix: str, stats: dict, out: dict):
+    for name, value in stats.items():
+        key = f"{prefix}{name}"
+        if isinstance(value, dict):
+            _flatten(f"{key}_", value, out)
+        elif isinstance(value, (int, float)):
+            out[key] = float(value)
+
+
+def refresh_stats():
+    for component, source in _stats_sources:
+        values = {}
+        _flatten("", source(), values)
+        for stat, value in values.items():
+            _child(COMPONENT_STATS, component, stat).set(value)
+
+
+async def run_sampler(interval: float = METRICS_SAMPLE_INTERVAL):
+    """Фоновая задача воркера: задержка event loop и снимок stats() раз в interval секунд."""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe(max(0.0, loop.time() - started - interval))
+        refresh_stats()
+
+
+def render_metrics() -> bytes:
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+def mark_worker_dead():
+    """При остановке воркера: его значения app_component_stat больше не выдаются."""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
+
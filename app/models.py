@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Boolean, Sequence, UniqueConstraint, Index, Enum, LargeBinary
+from sqlalchemy.dialects.postgresql import INET
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy import ForeignKey
@@ -6,6 +7,14 @@ from datetime import datetime
 
 Base = declarative_base()
 
+# Последовательность номеров для генерации коротких кодов (см. app/short_codes.py)
+short_code_seq = Sequence("short_code_seq", metadata=Base.metadata)
+# Номера визитов; начинаются после номеров старой таблицы visits_legacy
+visit_id_seq = Sequence("visit_id_seq", metadata=Base.metadata)
+
+# Типы устройств визитов (см. app/enrichment.py)
+DEVICE_TYPES = ("bot", "tablet", "mobile", "desktop", "unknown")
+
 class User(Base):
     __tablename__ = "users"
     
@@ -27,9 +36,15 @@ class ShortLink(Base):
     short_code = Column(String, unique=True, nullable=False, index=True)
     original_url = Column(String, nullable=False)
     created_at = Column(DateTime, default=datetime)
-    expires_at = Column(DateTime, nullable=True)
+    expires_at = Column(DateTime, nullable=True, index=True)
     last_access_at = Column(DateTime, nullable=True)
-    auto_expires_at = Column(DateTime, nullable=True)
+    auto_expires_at = Column(DateTime, nullable=True, index=True)
+    # Сверенное число кликов; текущее значение - в Redis (app/click_counters.py)
+    click_count = Column(BigInteger, nullable=False, default=0, server_default="0")
+    # SHA-256 канонического URL (app/urls.py): поиск ссылки по адресу без просмотра original_url
+    url_hash = Column(LargeBinary(32), nullable=True)
+    # Хост с метками в обратном порядке (com.example.blog): ссылки домена вместе с поддоменами
+    reversed_host = Column(String, nullable=True)
      
     # Связь с визитами (основная таблица)
     visits = relationship("Visit", back_populates="short_link", 
@@ -37,6 +52,14 @@ class ShortLink(Base):
                          primaryjoin="ShortLink.short_code == Visit.short_code")
     user = relationship("User", back_populates="links")  # Связь с таблицей пользователей
 
+    __table_args__ = (
+        # WHERE url_hash = ? ORDER BY created_at DESC LIMIT 1
+        Index("ix_short_links_url_hash_created_at", "url_hash", "created_at"),
+        # WHERE user_id = ? AND (reversed_host = ? OR reversed_host LIKE '...%')
+        Index("ix_short_links_user_id_reversed_host", "user_id", "reversed_host",
+              postgresql_ops={"reversed_host": "text_pattern_ops"}),
+    )
+
 # Таблица архивных коротких ссылок
 class ShortLinkArchive(Base):
     __tablename__ = "short_links_archive"
@@ -59,22 +82,39 @@ class ShortLinkArchive(Base):
 
 
    
-# Таблица визитов
+# Справочник доменов ссылок: визит хранит номер домена, а не строки
+class Domain(Base):
+    __tablename__ = "domains"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, unique=True, nullable=False)  # Домен 2-го уровня, например example.com
+    zone = Column(String, nullable=False)  # Домен 1-го уровня, например com
+
+
+# Таблица визитов, секционирована по месяцам timestamp (секции создаёт app/partitions.py),
+# поэтому timestamp входит в первичный ключ.
+# URL не хранится (он есть в short_links), домен - номер в domains,
+# тип устройства - enum, IP - inet.
 class Visit(Base):
     __tablename__ = "visits"
-    
-    id = Column(Integer, primary_key=True)
+
+    id = Column(BigInteger, visit_id_seq, server_default=visit_id_seq.next_value(), primary_key=True)
+    timestamp = Column(DateTime, default=datetime.now, primary_key=True, index=True) #time
     owner=Column(Integer, nullable=True) # userid
-    timestamp = Column(DateTime, default=datetime,  index=True) #time
     short_code = Column(String, ForeignKey("short_links.short_code"), nullable=False, index=True)
-    original_url = Column(String, nullable=False) 
-    domain_1st = Column(String, nullable=True)  # Домен 1-го уровня
-    domain_2nd = Column(String, nullable=True)  # Домен 2-го уровня
-    ip_address = Column(String, nullable=False)
-    device_type = Column(String, nullable=False)  # Тип устройства (mobile, desktop)
-    country = Column(String, nullable=True) #
+    domain_id = Column(Integer, ForeignKey("domains.id"), nullable=True)
+    ip_address = Column(INET, nullable=True)  # NULL, если адрес клиента неизвестен
+    device_type = Column(Enum(*DEVICE_TYPES, name="device_type"), nullable=False)
+    country = Column(String(2), nullable=True)  # ISO-код страны
     referer = Column(String, nullable=True) #
     short_link = relationship("ShortLink", back_populates="visits", primaryjoin="ShortLink.short_code == Visit.short_code")
+    domain = relationship("Domain")
+
+    __table_args__ = (
+        # Постраничная выдача статистики владельца: WHERE owner = ? AND id > ? ORDER BY id
+        Index("ix_visits_owner_id", "owner", "id"),
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
 
 class VisitArchive(Base):
     __tablename__ = "visit_archives"
@@ -98,3 +138,37 @@ class VisitArchive(Base):
                                 foreign_keys=[short_code],
                                 primaryjoin="ShortLinkArchive.short_code == VisitArchive.short_code")
 
+    __table_args__ = (Index("ix_visit_archives_owner_id", "owner", "id"),)
+
+
+# Предагрегированная статистика визитов: счётчики по ссылке за час/день
+# в разрезе страны, типа устройства, домена 2-го уровня и хоста referer
+class VisitRollup(Base):
+    __tablename__ = "visit_rollups"
+    __table_args__ = (
+        UniqueConstraint("short_code", "granularity", "bucket_start", "dimension", "value",
+                         name="uq_visit_rollups_bucket"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    short_code = Column(String, nullable=False, index=True)
+    granularity = Column(String, nullable=False)  # hour, day
+    bucket_start = Column(DateTime, nullable=False)  # начало часа/дня
+    dimension = Column(String, nullable=False)  # total, country, device_type, domain_2nd, referer
+    value = Column(String, nullable=False, default="")  # значение измерения ("" для total и пустых)
+    count = Column(BigInteger, nullable=False, default=0)
+
+
+# Вероятностные сводки визитов ссылки за день (см. app/sketches.py):
+# HyperLogLog IP-адресов и space-saving для referer, страны и домена 2-го уровня
+class LinkSketch(Base):
+    __tablename__ = "link_sketches"
+    __table_args__ = (
+        UniqueConstraint("short_code", "day", "dimension", name="uq_link_sketches_day"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    short_code = Column(String, nullable=False)
+    day = Column(DateTime, nullable=False)  # начало дня
+    dimension = Column(String, nullable=False)  # visitors, referer, country, domain_2nd
+    sketch = Column(LargeBinary, nullable=False)
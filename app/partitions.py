@@ -0,0 +1,65 @@
+from datetime import date, datetime
+from typing import List, Optional
+
+from sqlalchemy import text
+
+from app.config import VISIT_PARTITION_MONTHS_AHEAD
+from app.database import engine
+
+# Таблица visits секционирована по месяцам: visits_2026_10 хранит визиты
+# с 2026-10-01 по 2026-11-01 (не включая). Секции создаются заранее на
+# VISIT_PARTITION_MONTHS_AHEAD месяцев вперёд при старте приложения и при
+# каждой сверке ведущего планировщика (app/expiry.py). Секция visits_default
+# ловит визиты вне созданных диапазонов, чтобы запись никогда не падала.
+
+PARENT_TABLE = "visits"
+DEFAULT_PARTITION = "visits_default"
+
+# Воркеры стартуют одновременно - DDL выполняет один из них
+_LOCK_ID = 0x76697369  # "visi"
+
+
+def month_start(day) -> date:
+    return date(day.year, day.month, 1)
+
+
+def add_months(month: date, count: int) -> date:
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{PARENT_TABLE}_{month.year:04d}_{month.month:02d}"
+
+
+def partition_ddl(month: date) -> str:
+    return (
+        f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF {PARENT_TABLE} "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    )
+
+
+def months_between(first: date, last: date) -> List[date]:
+    """Первые числа месяцев от first до last включительно; принимает date и datetime."""
+    months = []
+    month = month_start(first)
+    last = month_start(last)
+    while month <= last:
+        months.append(month)
+        month = add_months(month, 1)
+    return months
+
+
+async def ensure_visit_partitions(
+    months_ahead: int = VISIT_PARTITION_MONTHS_AHEAD,
+    now: Optional[datetime] = None,
+):
+    """Создаёт недостающие месячные секции visits от текущего месяца на months_ahead вперёд."""
+    current = month_start(now or datetime.now())
+    async with engine.begin() as conn:
+        await conn.execute(text("SELECT pg_advisory_xact_lock(:lock_id)"), {"lock_id": _LOCK_ID})
+        for month in months_between(current, add_months(current, months_ahead)):
+            await conn.execute(text(partition_ddl(month)))
+        await conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {PARENT_TABLE} DEFAULT"
+        ))
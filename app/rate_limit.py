@@ -0,0 +1,164 @@
+import hashlib
+import logging
+import math
+import time
+from typing import Dict, NamedTuple, Optional
+
+from redis.asyncio import Redis
+
+from app.config import RATE_LIMITS, RATE_LIMIT_LEASE, RATE_LIMIT_LEASE_TTL, RATE_LIMIT_LOCAL_CAPACITY
+from app.lru_cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Ограничение частоты запросов по маршрутам: token bucket в Redis.
+# Правила задаются RATE_LIMITS: "имя=ключ:запросов/секунд:запас,...", например
+# "redirect=ip:100/1:200" - 100 запросов в секунду с IP, всплеск до 200.
+# Ключ: ip - адрес клиента; user - id пользователя (гость - по IP);
+# token - заголовок Authorization (без него - по IP).
+#
+# Корзина живёт в Redis и меняется Lua-скриптом за один round-trip, общая для всех
+# воркеров. Быстрый путь в памяти воркера:
+#   - скрипт выдаёт сразу до RATE_LIMIT_LEASE жетонов, следующие запросы того же
+#     ключа тратят их без Redis (не дольше RATE_LIMIT_LEASE_TTL секунд);
+#   - после отказа ключ отклоняется локально до Retry-After.
+# Выданные воркеру жетоны уже списаны в Redis, поэтому общий лимит не превышается;
+# неистраченные пропадают. Ошибка Redis запрос не блокирует.
+
+KEYS = ("ip", "user", "token")
+
+# KEYS[1] - корзина; ARGV: жетонов в секунду, запас, сколько жетонов взять.
+# Возвращает {выдано жетонов, через сколько секунд появится следующий}.
+_TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local want = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local granted = math.min(want, math.floor(tokens))
+tokens = tokens - granted
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((burst - tokens) / rate * 1000) + 1000)
+local retry = 0
+if granted == 0 then
+    retry = (1 - tokens) / rate
+end
+return {granted, tostring(retry)}
+"""
+
+
+class Limit(NamedTuple):
+    key: str
+    rate: float  # жетонов в секунду
+    burst: int
+
+
+def parse_limits(spec: str) -> Dict[str, Limit]:
+    """"redirect=ip:100/1:200,shorten=user:20/60" -> {имя: Limit}; запас по умолчанию - число запросов."""
+    limits = {}
+    for item in spec.split(","):
+        name, _, rule = item.strip().partition("=")
+        if not name or not rule:
+            continue
+        key, _, rest = rule.partition(":")
+        rate_part, _, burst = rest.partition(":")
+        requests, _, seconds = rate_part.partition("/")
+        if key not in KEYS:
+            raise ValueError(f"RATE_LIMITS: неизвестный ключ {key} в правиле {name}")
+        requests = float(requests)
+        limits[name.strip()] = Limit(key, requests / float(seconds or 1), int(burst or math.ceil(requests)))
+    return limits
+
+
+def client_ip(scope: dict) -> str:
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def identity(limit: Limit, scope: dict, authorization: Optional[str] = None, user_id: Optional[int] = None) -> str:
+    """Ключ корзины по правилу: IP, пользователь или токен."""
+    if limit.key == "user" and user_id is not None:
+        return f"u{user_id}"
+    if limit.key == "token" and authorization:
+        return "t" + hashlib.sha256(authorization.encode()).hexdigest()[:32]
+    return f"ip{client_ip(scope)}"
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        limits: Dict[str, Limit],
+        lease: int = RATE_LIMIT_LEASE,
+        lease_ttl: float = RATE_LIMIT_LEASE_TTL,
+        local_capacity: int = RATE_LIMIT_LOCAL_CAPACITY,
+    ):
+        self.limits = limits
+        self.lease = lease
+        self.lease_ttl = lease_ttl
+        # Ключ корзины -> [жетоны воркера] или время (monotonic), до которого ключ отклоняется
+        self._local = LRUCache(capacity=local_capacity, ttl=lease_ttl)
+        self._script = None
+
+        # Счётчики
+        self.allowed_local = 0
+        self.allowed_redis = 0
+        self.denied_local = 0
+        self.denied_redis = 0
+        self.errors = 0
+
+    async def acquire(self, redis: Redis, name: str, key: str) -> Optional[float]:
+        """Жетон для запроса. None - запрос разрешён, иначе - через сколько секунд повторить."""
+        limit = self.limits.get(name)
+        if limit is None:
+            return None
+        bucket = f"ratelimit:{name}:{key}"
+
+        state = self._local.get(bucket)
+        if isinstance(state, list) and state[0] > 0:
+            state[0] -= 1
+            self.allowed_local += 1
+            return None
+        if isinstance(state, float):
+            self.denied_local += 1
+            return max(0.0, state - time.monotonic())
+
+        if self._script is None:
+            self._script = redis.register_script(_TOKEN_BUCKET_SCRIPT)
+        try:
+            granted, retry_after = await self._script(
+                keys=[bucket], args=[limit.rate, limit.burst, min(self.lease, limit.burst)], client=redis,
+            )
+        except Exception as e:
+            self.errors += 1
+            logger.debug("Ограничение частоты %s не проверено: %s", bucket, e)
+            return None
+
+        granted = int(granted)
+        if granted > 0:
+            if granted > 1:
+                self._local.set(bucket, [granted - 1], ttl=self.lease_ttl)
+            else:
+                self._local.delete(bucket)
+            self.allowed_redis += 1
+            return None
+        retry_after = float(retry_after)
+        self._local.set(bucket, time.monotonic() + retry_after, ttl=retry_after)
+        self.denied_redis += 1
+        return retry_after
+
+    def stats(self) -> dict:
+        return {
+            "allowed_local": self.allowed_local,
+            "allowed_redis": self.allowed_redis,
+            "denied_local": self.denied_local,
+            "denied_redis": self.denied_redis,
+            "errors": self.errors,
+            "local_keys": len(self._local),
+        }
+
+
+rate_limiter = RateLimiter(parse_limits(RATE_LIMITS))
@@ -1,23 +1,94 @@
-from redis.asyncio import Redis
-from typing import AsyncGenerator
+from redis.asyncio import Redis, BlockingConnectionPool
+from redis.asyncio.retry import Retry
+from redis.backoff import ExponentialBackoff
+from redis.exceptions import ConnectionError, TimeoutError
+from typing import AsyncGenerator, Optional
 from contextlib import asynccontextmanager
+import logging
 
-from app.config import REDIS_HOST, REDIS_PORT, REDIS_PASSWORD
+from app.config import (
+    REDIS_HOST,
+    REDIS_PORT,
+    REDIS_PASSWORD,
+    REDIS_MAX_CONNECTIONS,
+    REDIS_POOL_TIMEOUT,
+    REDIS_SOCKET_TIMEOUT,
+    REDIS_HEALTH_CHECK_INTERVAL,
+    REDIS_RETRIES,
+)
+from app.metrics import InstrumentedRedis
 
-async def init_redis() -> Redis:
-    redis_client=Redis(host=REDIS_HOST, port=REDIS_PORT, password=REDIS_PASSWORD, decode_responses=True)
-    try :await redis_client.ping()
+logger = logging.getLogger(__name__)
+
+# Один пул соединений на процесс: создаётся в lifespan и живёт всё время работы приложения
+_pool: Optional[BlockingConnectionPool] = None
+
+
+def _create_pool() -> BlockingConnectionPool:
+    return BlockingConnectionPool(
+        host=REDIS_HOST,
+        port=REDIS_PORT,
+        password=REDIS_PASSWORD,
+        decode_responses=True,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        timeout=REDIS_POOL_TIMEOUT,
+        socket_timeout=REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+        health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+        retry=Retry(ExponentialBackoff(cap=1.0, base=0.05), REDIS_RETRIES),
+        retry_on_error=[ConnectionError, TimeoutError],
+    )
+
+
+def get_pool() -> BlockingConnectionPool:
+    """Возвращает пул процесса, создавая его при первом обращении (например, вне lifespan)."""
+    global _pool
+    if _pool is None:
+        _pool = _create_pool()
+    return _pool
+
+
+async def init_redis_pool():
+    pool = get_pool()
+    try:
+        await Redis(connection_pool=pool).ping()
     except Exception as e:
-        print(f"Redis is not connected {e}")
-    return redis_client
+        logger.error("Redis is not connected: %s", e)
+
+
+async def close_redis_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.disconnect()
+        _pool = None
+
+
+def pool_stats() -> dict:
+    pool = get_pool()
+    in_use = len(getattr(pool, "_in_use_connections", ()))
+    available = len(getattr(pool, "_available_connections", ()))
+    return {
+        "max_connections": pool.max_connections,
+        "in_use": in_use,
+        "available": available,
+        "utilization": in_use / pool.max_connections if pool.max_connections else 0.0,
+    }
+
+
+async def init_redis() -> Redis:
+    # Клиент поверх общего пула: создание дешёвое, соединения переиспользуются.
+    # Время команд и пайплайнов пишется в метрику redis_command_duration_seconds
+    return InstrumentedRedis(connection_pool=get_pool())
+
 
 async def close_redis(redis: Redis):
-    await redis.close()
-    
+    # Пул при этом не закрывается - соединения возвращаются в него
+    await redis.aclose()
+
 @asynccontextmanager
 async def get_redis() -> AsyncGenerator[Redis, None]:
     """
-    Dependency для FastAPI
+    Клиент Redis для фоновых задач
     Возвращает AsyncGenerator[Redis, None] вместо Redis
     """
     redis = await init_redis()
@@ -27,5 +98,5 @@ async def get_redis() -> AsyncGenerator[Redis, None]:
         await close_redis(redis)
 
 async def redis_dependency() -> Redis:
-    async with get_redis() as redis:
-        return redis  
\ No newline at end of file
+    """Dependency для FastAPI: клиент поверх общего пула соединений"""
+    return await init_redis()
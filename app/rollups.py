@@ -0,0 +1,129 @@
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Iterable, List, Optional
+from urllib.parse import urlparse
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import VisitRollup
+
+# Счётчики visit_rollups обновляются инкрементально из пакетов визитов
+# (app/visit_queue.py) в той же транзакции, что и вставка визитов,
+# поэтому статистика не требует COUNT(*) по таблице visits.
+
+GRANULARITIES = ("hour", "day")
+DIMENSIONS = ("country", "device_type", "domain_2nd", "referer")
+
+
+def bucket_start(timestamp: datetime, granularity: str) -> datetime:
+    if granularity == "hour":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def referer_host(referer: Optional[str]) -> str:
+    """Для referer храним только хост, иначе число значений не ограничено."""
+    if not referer:
+        return ""
+    return urlparse(referer).hostname or ""
+
+
+def _dimension_value(visit: dict, dimension: str) -> str:
+    if dimension == "referer":
+        return referer_host(visit.get("referer"))
+    return visit.get(dimension) or ""
+
+
+def aggregate(visits: Iterable[dict]) -> Counter:
+    """Сворачивает визиты в счётчики по ключу (short_code, granularity, bucket_start, dimension, value)."""
+    counts = Counter()
+    for visit in visits:
+        for granularity in GRANULARITIES:
+            bucket = bucket_start(visit["timestamp"], granularity)
+            counts[(visit["short_code"], granularity, bucket, "total", "")] += 1
+            for dimension in DIMENSIONS:
+                value = _dimension_value(visit, dimension)
+                counts[(visit["short_code"], granularity, bucket, dimension, value)] += 1
+    return counts
+
+
+async def apply_visits(db: AsyncSession, visits: List[dict], chunk_size: int = 5000):
+    """Прибавляет пакет визитов к счётчикам запросами INSERT ... ON CONFLICT DO UPDATE."""
+    # Одинаковый порядок строк во всех воркерах исключает взаимные блокировки
+    rows = [
+        {
+            "short_code": short_code,
+            "granularity": granularity,
+            "bucket_start": bucket,
+            "dimension": dimension,
+            "value": value,
+            "count": count,
+        }
+        for (short_code, granularity, bucket, dimension, value), count in sorted(aggregate(visits).items())
+    ]
+    for start in range(0, len(rows), chunk_size):
+        stmt = pg_insert(VisitRollup).values(rows[start:start + chunk_size])
+        stmt = stmt.on_conflict_do_update(
+            constraint="uq_visit_rollups_bucket",
+            set_={"count": VisitRollup.count + stmt.excluded["count"]},
+        )
+        await db.execute(stmt)
+
+
+def _range_filter(query, short_codes: List[str], granularity: str,
+                  start: Optional[datetime], end: Optional[datetime]):
+    query = query.where(
+        VisitRollup.short_code.in_(short_codes),
+        VisitRollup.granularity == granularity,
+    )
+    if start is not None:
+        query = query.where(VisitRollup.bucket_start >= bucket_start(start, granularity))
+    if end is not None:
+        query = query.where(VisitRollup.bucket_start <= end)
+    return query
+
+
+async def read_stats(
+    db: AsyncSession,
+    short_codes: List[str],
+    granularity: str = "day",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+) -> dict:
+    """
+    Возвращает по каждому коду: total, series (счётчик по корзинам)
+    и breakdown (счётчики по значениям измерений) за период.
+    """
+    query = _range_filter(
+        select(
+            VisitRollup.short_code,
+            VisitRollup.bucket_start,
+            VisitRollup.dimension,
+            VisitRollup.value,
+            VisitRollup.count,
+        ),
+        short_codes, granularity, start, end,
+    ).order_by(VisitRollup.bucket_start)
+    result = await db.execute(query)
+
+    stats = {
+        code: {"total": 0, "series": [], "breakdown": {d: defaultdict(int) for d in DIMENSIONS}}
+        for code in short_codes
+    }
+    for row in result:
+        entry = stats[row.short_code]
+        if row.dimension == "total":
+            entry["total"] += row.count
+            entry["series"].append({"bucket": row.bucket_start.isoformat(), "count": row.count})
+        else:
+            entry["breakdown"][row.dimension][row.value] += row.count
+
+    for entry in stats.values():
+        entry["breakdown"] = {
+            dimension: dict(sorted(values.items(), key=lambda item: -item[1]))
+            for dimension, values in entry["breakdown"].items()
+        }
+    return stats
+
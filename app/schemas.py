@@ -1,6 +1,10 @@
 from pydantic import BaseModel, EmailStr, field_validator,Field
 from typing import Optional
+import logging
 import re
+
+logger = logging.getLogger(__name__)
+
 class Config:
     orm_mode = True  # Это позволяет Pydantic работать с SQLAlchemy моделями
     
@@ -26,7 +30,7 @@ class LinkRequest(BaseModel):
     @field_validator("customAlias", mode="before")
     @classmethod
     def validate_alias(cls, v) -> Optional[str]:
-        print(f"Проверка alias (до обработки): {v}")  
+        logger.debug("Проверка alias (до обработки): %s", v)
 
         if v in (None, "", "null"):  # Если пустой — приводим к None
             return None
@@ -35,7 +39,7 @@ class LinkRequest(BaseModel):
             raise ValueError("Alias должен быть строкой.")
 
         v = v.strip()
-        print(f"Проверка alias (после обработки): {v}")  
+        logger.debug("Проверка alias (после обработки): %s", v)
 
         if not re.match(r"^[a-zA-Z0-9]{5,15}$", v):
             raise ValueError("Alias должен содержать только буквы и цифры (от 5 до 15 символов).")
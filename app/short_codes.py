@@ -0,0 +1,140 @@
+import asyncio
+import hashlib
+import random
+import string
+from typing import Awaitable, Callable, List, Optional
+
+from sqlalchemy import text
+
+from app.database import AsyncSessionLocal
+from app.redis_cache import get_redis
+from app.config import (
+    SHORT_CODE_MODE,
+    SHORT_CODE_LENGTH,
+    SHORT_CODE_BLOCK_SIZE,
+    SHORT_CODE_SALT,
+)
+
+# Выдача коротких кодов без обращений к Redis/БД на каждый код.
+# Воркер резервирует блок номеров (последовательность PostgreSQL или счётчик Redis)
+# и локально превращает номер в код взаимно однозначным отображением:
+# номер перемешивается умножением по модулю 62^длина и кодируется в base62.
+# Разные номера всегда дают разные коды, поэтому проверка занятости не нужна.
+
+BASE62 = string.digits + string.ascii_letters
+
+SEQUENCE_NAME = "short_code_seq"
+REDIS_COUNTER_KEY = "short_code_counter"
+
+MODES = ("sequence", "redis", "hex")
+
+
+def random_salt():
+    return ''.join(random.choices(string.ascii_letters + string.digits, k=8))
+
+
+def generate_short_code(original_url: str) -> str:
+    """Старый режим hex: 8 символов SHA-256 от URL с солью, уникальность не гарантируется."""
+    hash_value = hashlib.sha256((str(original_url) + random_salt()).encode()).hexdigest()
+    return hash_value[:8]  # Обрезаем до 8 символов
+
+
+def _permutation_params(length: int, salt: str):
+    """Множитель и сдвиг перестановки для кодов заданной длины."""
+    modulus = 62 ** length
+    digest = hashlib.sha256(f"{salt}:{length}".encode()).digest()
+    multiplier = int.from_bytes(digest[:16], "big") % modulus
+    # Множитель должен быть взаимно прост с 62 = 2 * 31
+    multiplier |= 1
+    while multiplier % 31 == 0:
+        multiplier += 2
+    offset = int.from_bytes(digest[16:], "big") % modulus
+    return modulus, multiplier, offset
+
+
+class CodeEncoder:
+    """Взаимно однозначное отображение номер -> base62-код длиной не меньше min_length."""
+
+    def __init__(self, min_length: int = SHORT_CODE_LENGTH, salt: str = SHORT_CODE_SALT):
+        self.min_length = min_length
+        self.salt = salt
+        self._params = {}
+
+    def encode(self, number: int) -> str:
+        length = self.min_length
+        while number >= 62 ** length:
+            length += 1
+        if length not in self._params:
+            self._params[length] = _permutation_params(length, self.salt)
+        modulus, multiplier, offset = self._params[length]
+        # Каждая длина кодирует свой непересекающийся диапазон номеров, поэтому коды не повторяются
+        value = (number * multiplier + offset) % modulus
+        chars = []
+        for _ in range(length):
+            value, rest = divmod(value, 62)
+            chars.append(BASE62[rest])
+        return "".join(reversed(chars))
+
+
+async def reserve_from_sequence(count: int) -> List[int]:
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            text(f"SELECT nextval('{SEQUENCE_NAME}') FROM generate_series(1, :count)"),
+            {"count": count},
+        )
+        return [row[0] for row in result]
+
+
+async def reserve_from_redis(count: int) -> List[int]:
+    async with get_redis() as redis:
+        end = await redis.incrby(REDIS_COUNTER_KEY, count)
+    return list(range(end - count + 1, end + 1))
+
+
+class CodeAllocator:
+    """
+    Выдаёт коды из заранее зарезервированного блока номеров.
+    Обращение к хранилищу происходит один раз на block_size кодов.
+    """
+
+    def __init__(
+        self,
+        mode: str = SHORT_CODE_MODE,
+        block_size: int = SHORT_CODE_BLOCK_SIZE,
+        encoder: Optional[CodeEncoder] = None,
+        reserve: Optional[Callable[[int], Awaitable[List[int]]]] = None,
+    ):
+        if mode not in MODES:
+            raise ValueError(f"Неизвестный режим генерации кодов: {mode}")
+        self.mode = mode
+        self.block_size = block_size
+        self.encoder = encoder or CodeEncoder()
+        if reserve is None:
+            reserve = reserve_from_redis if mode == "redis" else reserve_from_sequence
+        self._reserve = reserve
+        self._numbers: List[int] = []
+        self._lock = asyncio.Lock()
+        self.blocks_reserved = 0
+
+    @property
+    def collision_free(self) -> bool:
+        """В режиме hex коды случайные и требуют проверки занятости."""
+        return self.mode != "hex"
+
+    async def allocate(self, count: int = 1) -> List[str]:
+        numbers = []
+        async with self._lock:
+            while len(numbers) < count:
+                if not self._numbers:
+                    # Берём недостающее одним запросом, но не меньше блока
+                    block = await self._reserve(max(self.block_size, count - len(numbers)))
+                    self._numbers = list(reversed(block))
+                    self.blocks_reserved += 1
+                numbers.append(self._numbers.pop())
+        return [self.encoder.encode(number) for number in numbers]
+
+    async def next_code(self) -> str:
+        return (await self.allocate(1))[0]
+
+
+code_allocator = CodeAllocator()
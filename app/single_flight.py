@@ -0,0 +1,37 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Hashable
+
+# Объединение одновременных загрузок одного ключа внутри воркера (single-flight):
+# первый запрос запускает загрузку отдельной задачей, остальные ждут её результат.
+# Задача не принадлежит ни одному запросу, поэтому отключение клиента,
+# начавшего загрузку, не отменяет её для остальных.
+
+
+class SingleFlight:
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+
+        # Счётчики
+        self.loads = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, load: Callable[[], Awaitable]):
+        """Результат load() для key; одновременные вызовы с тем же key выполняют load один раз."""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(load())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._done(key, done))
+            self.loads += 1
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            # Ошибку получат ожидающие; если их не осталось, asyncio не должен о ней предупреждать
+            task.exception()
+
+    def stats(self) -> dict:
+        return {"inflight": len(self._inflight), "loads": self.loads, "shared": self.shared}
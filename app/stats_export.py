@@ -0,0 +1,138 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Optional, Sequence
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy import String, cast, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import STATS_PAGE_SIZE, STATS_MAX_PAGE_SIZE, STATS_STREAM_CHUNK
+from app.database import ReadSessionLocal
+from app.models import Domain, ShortLink, Visit
+
+# Выдача визитов для /active-links/stats и /archive/stats.
+# Постранично - keyset по id (WHERE id > cursor ORDER BY id LIMIT n), без OFFSET,
+# поэтому любая страница читается по индексу (owner, id) за одинаковое время.
+# Потоково (ndjson/csv) - серверным курсором порциями по STATS_STREAM_CHUNK строк,
+# память не зависит от числа визитов.
+
+FORMATS = ("json", "ndjson", "csv")
+
+VISIT_FIELDS = (
+    "short_code", "original_url", "timestamp", "domain_1st", "domain_2nd",
+    "ip_address", "device_type", "country", "referer",
+)
+ARCHIVE_FIELDS = VISIT_FIELDS + ("archived_at", "archival_reason")
+
+_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+
+def _value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _row(row, fields: Sequence[str]) -> dict:
+    return {name: _value(getattr(row, name)) for name in fields}
+
+
+def check_params(fmt: str, limit: Optional[int]) -> int:
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"format: одно из {', '.join(FORMATS)}")
+    return check_limit(limit)
+
+
+def check_limit(limit: Optional[int]) -> int:
+    if limit is None:
+        return STATS_PAGE_SIZE
+    if not 1 <= limit <= STATS_MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"limit: от 1 до {STATS_MAX_PAGE_SIZE}")
+    return limit
+
+
+# visits хранит номера и коды, поля ответа собираются соединением со ссылкой и справочником доменов
+_VISIT_COLUMNS = {
+    "original_url": ShortLink.original_url,
+    "domain_1st": Domain.zone,
+    "domain_2nd": Domain.name,
+    "ip_address": func.host(Visit.ip_address),
+    "device_type": cast(Visit.device_type, String),
+}
+
+
+def _column(model, name: str):
+    if model is Visit and name in _VISIT_COLUMNS:
+        return _VISIT_COLUMNS[name].label(name)
+    return getattr(model, name)
+
+
+def _select(model, fields: Sequence[str], conditions: list, cursor: Optional[int]):
+    query = select(model.id, *(_column(model, name) for name in fields)).where(*conditions)
+    if model is Visit:
+        query = (
+            query.join(ShortLink, ShortLink.short_code == Visit.short_code)
+            .outerjoin(Domain, Domain.id == Visit.domain_id)
+        )
+    if cursor is not None:
+        query = query.where(model.id > cursor)
+    return query.order_by(model.id)
+
+
+async def read_page(
+    db: AsyncSession,
+    model,
+    fields: Sequence[str],
+    conditions: list,
+    cursor: Optional[int],
+    limit: int,
+) -> dict:
+    """Одна страница визитов. next_cursor передаётся в следующий запрос, None - страниц больше нет."""
+    # Лишняя строка показывает, есть ли следующая страница, без COUNT(*)
+    result = await db.execute(_select(model, fields, conditions, cursor).limit(limit + 1))
+    rows = result.all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "items": [_row(row, fields) for row in rows],
+        "next_cursor": rows[-1].id if has_more else None,
+    }
+
+
+def stream_visits(
+    model,
+    fields: Sequence[str],
+    conditions: list,
+    cursor: Optional[int],
+    fmt: str,
+    filename: str,
+) -> StreamingResponse:
+    """Отдаёт все визиты после cursor в формате ndjson или csv."""
+    query = _select(model, fields, conditions, cursor).execution_options(yield_per=STATS_STREAM_CHUNK)
+
+    async def generate():
+        # Сессия зависимости get_read_db закрывается до отправки тела ответа,
+        # поэтому курсор живёт в собственной сессии генератора (тоже на реплике)
+        async with ReadSessionLocal() as db:
+            result = await db.stream(query)
+            if fmt == "csv":
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerow(("id", *fields))
+                yield buffer.getvalue()
+            async for rows in result.partitions():
+                buffer = io.StringIO()
+                if fmt == "csv":
+                    writer = csv.writer(buffer)
+                    writer.writerows((row.id, *(_value(getattr(row, name)) for name in fields)) for row in rows)
+                else:
+                    for row in rows:
+                        buffer.write(json.dumps({"id": row.id, **_row(row, fields)}, ensure_ascii=False))
+                        buffer.write("\n")
+                yield buffer.getvalue()
+
+    headers = {}
+    if fmt == "csv":
+        headers["Content-Disposition"] = f'attachment; filename="{filename}.csv"'
+    return StreamingResponse(generate(), media_type=_MEDIA_TYPES[fmt], headers=headers)
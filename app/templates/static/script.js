@@ -52,7 +52,12 @@ document.addEventListener("DOMContentLoaded", function () {
 
     loginButton.addEventListener("click", () => loginModal.style.display = "block");
     registerButton.addEventListener("click", () => registerModal.style.display = "block");
-    logoutButton.addEventListener("click", () => {
+    logoutButton.addEventListener("click", async () => {
+        const token = localStorage.getItem("token");
+        if (token) {
+            // Отзыв всех токенов пользователя; локальный выход - даже если сервер недоступен
+            await fetch("/logout", { method: "POST", headers: { "Authorization": `Bearer ${token}` } }).catch(() => {});
+        }
         localStorage.removeItem("token");
         updateUI();
     });
@@ -0,0 +1,108 @@
+import hashlib
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+
+from jose import jwt, JWTError
+from redis.asyncio import Redis
+
+from app import cache_bus
+from app.config import (
+    SECRET_KEY,
+    ALGORITHM,
+    ACCESS_TOKEN_EXPIRE_MINUTES,
+    TOKEN_CACHE_CAPACITY,
+    TOKEN_CACHE_TTL,
+    TOKEN_GENERATION_TTL,
+)
+from app.lru_cache import LRUCache
+from app.redis_cache import get_redis
+
+# Проверенные JWT кэшируются в памяти воркера по SHA-256 токена:
+# повторный запрос с тем же токеном не декодирует JWT и не ходит в БД за user_id.
+# user_id лежит в клэйме uid, поколение токенов пользователя - в клэйме gen.
+# Выход из системы увеличивает поколение в Redis (user:gen:{uid}), и все ранее
+# выданные токены пользователя перестают приниматься; остальные воркеры узнают
+# об этом через cache_bus, а локальная копия поколения живёт не дольше TOKEN_GENERATION_TTL.
+
+GENERATION_PREFIX = "user:gen:"
+
+# sha256(token) -> (user_id, gen)
+token_cache = LRUCache(capacity=TOKEN_CACHE_CAPACITY, ttl=TOKEN_CACHE_TTL)
+# user_id -> текущее поколение
+generation_cache = LRUCache(capacity=TOKEN_CACHE_CAPACITY, ttl=TOKEN_GENERATION_TTL)
+
+
+def generation_key(user_id: int) -> str:
+    return f"{GENERATION_PREFIX}{user_id}"
+
+
+def token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def create_access_token(username: str, user_id: int, generation: int) -> str:
+    return jwt.encode(
+        {
+            "sub": username,
+            "uid": user_id,
+            "gen": generation,
+            "exp": datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES),
+        },
+        SECRET_KEY,
+        algorithm=ALGORITHM,
+    )
+
+
+def decode_token(token: str) -> Optional[dict]:
+    """Проверяет подпись и срок токена. None - токен недействителен."""
+    try:
+        return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+
+
+def cache_token(token: str, user_id: int, generation: int, exp: Optional[float]):
+    # Запись не должна пережить сам токен
+    ttl = TOKEN_CACHE_TTL
+    if exp is not None:
+        ttl = min(ttl, exp - time.time())
+    token_cache.set(token_hash(token), (user_id, generation), ttl=ttl)
+
+
+def get_cached_token(token: str) -> Optional[Tuple[int, int]]:
+    """Возвращает (user_id, gen) проверенного токена или None."""
+    return token_cache.get(token_hash(token))
+
+
+async def current_generation(user_id: int, redis: Optional[Redis] = None) -> int:
+    generation = generation_cache.get(user_id)
+    if generation is None:
+        if redis is None:
+            async with get_redis() as redis:
+                value = await redis.get(generation_key(user_id))
+        else:
+            value = await redis.get(generation_key(user_id))
+        generation = int(value or 0)
+        generation_cache.set(user_id, generation)
+    return generation
+
+
+async def revoke_user_tokens(redis: Redis, user_id: int) -> int:
+    """Отзывает все выданные пользователю токены (выход, удаление пользователя)."""
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.incr(generation_key(user_id))
+        cache_bus.queue_publish(pipe, "user_gen", str(user_id))
+        generation, _ = await pipe.execute()
+    generation_cache.set(user_id, generation)
+    return generation
+
+
+def _on_generation_change(user_id: str):
+    if user_id == "*":
+        generation_cache.clear()
+    else:
+        generation_cache.delete(int(user_id))
+
+
+cache_bus.subscribe("user_gen", _on_generation_change)
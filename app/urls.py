@@ -0,0 +1,73 @@
+import hashlib
+from typing import Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Канонический вид URL для поиска ссылки по адресу (GET /links/search,
+# обратное соответствие longlink: в Redis, столбец short_links.url_hash).
+# Адреса, которые браузер откроет одинаково, дают один и тот же канонический URL:
+#   - схема и хост в нижнем регистре, хост в IDNA, без завершающей точки;
+#   - порт по умолчанию (80 для http, 443 для https) убирается;
+#   - пустой путь заменяется на "/";
+#   - параметры запроса сортируются, их кодирование приводится к одному виду;
+#   - якорь (#...) отбрасывается - на сервер он не передаётся.
+# Сама ссылка хранит и открывает URL в том виде, в каком его прислали.
+# Та же функция продублирована в миграции 0b6e2c8d4f17 (заполнение url_hash) -
+# при её изменении url_hash существующих ссылок нужно пересчитать.
+
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def _host(hostname: str) -> str:
+    host = hostname.rstrip(".")
+    try:
+        host = host.encode("idna").decode("ascii")
+    except UnicodeError:
+        pass
+    return host.lower()
+
+
+def canonical_url(url: str) -> str:
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = _host(parts.hostname or "")
+    if ":" in host:
+        host = f"[{host}]"  # IPv6
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    netloc = host
+    if port is not None and port != _DEFAULT_PORTS.get(scheme):
+        netloc = f"{netloc}:{port}"
+    if parts.username is not None:
+        userinfo = parts.username if parts.password is None else f"{parts.username}:{parts.password}"
+        netloc = f"{userinfo}@{netloc}"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, netloc, parts.path or "/", query, ""))
+
+
+def url_hash(url: str) -> bytes:
+    """SHA-256 канонического URL (32 байта)."""
+    return hashlib.sha256(canonical_url(url).encode("utf-8")).digest()
+
+
+def reverse_domain(domain: str) -> str:
+    """blog.example.com -> com.example.blog; "www." в начале не учитывается."""
+    host = _host(domain.strip())
+    if host.startswith("www."):
+        host = host[4:]
+    return ".".join(reversed(host.split(".")))
+
+
+def reversed_host(url: str) -> Optional[str]:
+    """
+    Хост ссылки с метками в обратном порядке. Ссылки домена вместе с поддоменами
+    находятся одним диапазоном индекса: reversed_host = 'com.example' OR LIKE 'com.example.%'.
+    """
+    hostname = urlsplit(url.strip()).hostname
+    return reverse_domain(hostname) if hostname else None
+
+
+def url_columns(url: str) -> dict:
+    """Значения url_hash и reversed_host для записи ссылки."""
+    return {"url_hash": url_hash(url), "reversed_host": reversed_host(url)}
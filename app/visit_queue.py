@@ -0,0 +1,216 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+
+from app.models import ShortLink, Visit
+from app.rollups import apply_visits
+from app.sketches import link_sketches
+from app.enrichment import enrich_visits
+from app.database import AsyncSessionLocal
+from app.config import (
+    VISIT_QUEUE_MAXSIZE,
+    VISIT_BATCH_SIZE,
+    VISIT_FLUSH_INTERVAL,
+    VISIT_QUEUE_POLICY,
+    VISIT_ENQUEUE_TIMEOUT,
+    VISIT_SHUTDOWN_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+
+# Столбцы visits; прочие ключи визита (домены для счётчиков) в таблицу не пишутся
+VISIT_COLUMNS = (
+    "owner", "timestamp", "short_code", "domain_id", "ip_address", "device_type", "country", "referer",
+)
+
+
+class VisitQueue:
+    """
+    Ограниченная очередь визитов в памяти процесса.
+    Редирект кладёт сырое событие клика в очередь и сразу отвечает, а фоновая задача
+    обогащает события (app/enrichment.py) и сбрасывает визиты пакетами: один многострочный INSERT в visits
+    и счётчики visit_rollups. Число кликов и last_access_at ведут счётчики Redis (app/click_counters.py).
+    """
+
+    POLICIES = ("drop_new", "drop_oldest", "block")
+
+    def __init__(
+        self,
+        maxsize: int = VISIT_QUEUE_MAXSIZE,
+        batch_size: int = VISIT_BATCH_SIZE,
+        flush_interval: float = VISIT_FLUSH_INTERVAL,
+        policy: str = VISIT_QUEUE_POLICY,
+        enqueue_timeout: float = VISIT_ENQUEUE_TIMEOUT,
+    ):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Неизвестная политика очереди визитов: {policy}")
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.policy = policy
+        self.enqueue_timeout = enqueue_timeout
+        self._task: Optional[asyncio.Task] = None
+        # Визиты, уже взятые из очереди фоновой задачей, и идущий сброс пакета:
+        # при остановке они дописываются, а не теряются вместе с задачей
+        self._batch: list = []
+        self._flushing: Optional[asyncio.Task] = None
+
+        # Счётчики
+        self.enqueued = 0
+        self.dropped = 0
+        self.flushed = 0
+        self.failed = 0
+        self.batches = 0
+        self.last_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+
+    async def put(self, visit: dict) -> bool:
+        """Кладёт визит в очередь. Возвращает False, если визит отброшен."""
+        try:
+            self.queue.put_nowait(visit)
+        except asyncio.QueueFull:
+            if self.policy == "drop_new":
+                self.dropped += 1
+                return False
+            if self.policy == "drop_oldest":
+                try:
+                    self.queue.get_nowait()
+                    self.queue.task_done()
+                    self.dropped += 1
+                except asyncio.QueueEmpty:
+                    pass
+                self.queue.put_nowait(visit)
+            else:  # block
+                try:
+                    await asyncio.wait_for(self.queue.put(visit), self.enqueue_timeout)
+                except asyncio.TimeoutError:
+                    self.dropped += 1
+                    return False
+        self.enqueued += 1
+        return True
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = VISIT_SHUTDOWN_TIMEOUT):
+        """Останавливает фоновую задачу и дописывает всё, что осталось в очереди."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            await asyncio.wait_for(self._drain(), timeout)
+        except asyncio.TimeoutError:
+            logger.error(
+                "Не успели дописать %d визитов при остановке", self.queue.qsize() + len(self._batch)
+            )
+
+    async def _drain(self):
+        # Сброс, начатый фоновой задачей, отмена задачи не прерывает (shield) - дожидаемся его
+        if self._flushing is not None:
+            await self._flushing
+            self._flushing = None
+        # Пакет, который задача собирала в момент отмены
+        batch, self._batch = self._batch, []
+        await self.flush(batch)
+        while not self.queue.empty():
+            await self.flush(self._take_batch())
+
+    def _take_batch(self) -> list:
+        batch = []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+            self.queue.task_done()
+        return batch
+
+    async def _run(self):
+        while True:
+            # Ждём первый визит, затем добираем пакет до размера или до таймаута
+            self._batch.append(await self.queue.get())
+            self.queue.task_done()
+            deadline = time.monotonic() + self.flush_interval
+            while len(self._batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    self._batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                    self.queue.task_done()
+                except asyncio.TimeoutError:
+                    break
+            batch, self._batch = self._batch, []
+            # Отдельная задача: отмена _run при остановке не прерывает запись пакета
+            self._flushing = asyncio.ensure_future(self.flush(batch))
+            await asyncio.shield(self._flushing)
+            self._flushing = None
+
+    async def flush(self, batch: list):
+        if not batch:
+            return
+        started = time.perf_counter()
+        try:
+            async with AsyncSessionLocal() as db:
+                # Домены, тип устройства и страна вычисляются здесь, а не в обработчике редиректа
+                await enrich_visits(db, batch)
+                try:
+                    await self._write(db, batch)
+                except IntegrityError:
+                    # Ссылку могли удалить до сброса: отбрасываем визиты на несуществующие коды
+                    await db.rollback()
+                    codes = {visit["short_code"] for visit in batch}
+                    result = await db.execute(
+                        select(ShortLink.short_code).where(ShortLink.short_code.in_(codes))
+                    )
+                    alive = set(result.scalars().all())
+                    kept = [visit for visit in batch if visit["short_code"] in alive]
+                    self.failed += len(batch) - len(kept)
+                    batch = kept
+                    if batch:
+                        await self._write(db, batch)
+            self.flushed += len(batch)
+            # Сводки для /insights копятся в памяти и пишутся реже, отдельной задачей
+            link_sketches.add_visits(batch)
+        except Exception:
+            self.failed += len(batch)
+            logger.exception("Ошибка записи пакета визитов (%d визитов)", len(batch))
+        finally:
+            self.last_flush_seconds = time.perf_counter() - started
+            self.total_flush_seconds += self.last_flush_seconds
+            self.batches += 1
+
+    @staticmethod
+    async def _write(db, batch: list):
+        await db.execute(insert(Visit), [
+            {name: visit.get(name) for name in VISIT_COLUMNS} for visit in batch
+        ])
+        # Счётчики статистики - в той же транзакции
+        await apply_visits(db, batch)
+        await db.commit()
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue.qsize(),
+            "queue_maxsize": self.queue.maxsize,
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "flushed": self.flushed,
+            "failed": self.failed,
+            "batches": self.batches,
+            "last_flush_seconds": self.last_flush_seconds,
+            "avg_flush_seconds": self.total_flush_seconds / self.batches if self.batches else 0.0,
+        }
+
+
+visit_queue = VisitQueue()
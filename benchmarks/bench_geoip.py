@@ -0,0 +1,106 @@
+"""
+Стоимость определения страны по IP на один редирект:
+
+  per-request - поиск в базе на каждый запрос, без кэша (как было раньше);
+  cached      - GeoIPService с LRU-кэшем;
+  deferred    - редирект только кладёт визит в очередь, страна определяется
+                при сбросе пакета (время обработчика и время фоновой обработки
+                считаются отдельно).
+
+IP выбираются по закону Ципфа из --unique адресов: немногие клиенты дают
+большую часть кликов, как в реальном трафике.
+
+Запуск из корня проекта:
+
+    python -m benchmarks.bench_geoip --db app/GeoLite2-Country.mmdb --requests 200000
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+
+from app.geoip import GeoIPService
+from app.visit_queue import VisitQueue
+
+
+def zipf_ips(unique: int, count: int, s: float, seed: int) -> list:
+    rng = random.Random(seed)
+    pool = [
+        f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+        for _ in range(unique)
+    ]
+    weights = [1 / rank ** s for rank in range(1, unique + 1)]
+    return rng.choices(pool, weights=weights, k=count)
+
+
+def bench_lookup(service: GeoIPService, ips: list) -> float:
+    started = time.perf_counter()
+    for ip in ips:
+        service.country(ip)
+    return time.perf_counter() - started
+
+
+async def bench_deferred(path: str, ips: list, batch_size: int) -> tuple:
+    service = GeoIPService(path=path)
+    queue = VisitQueue(maxsize=len(ips), batch_size=batch_size)
+
+    # Обработчик редиректа: только собрать визит и положить в очередь
+    started = time.perf_counter()
+    for ip in ips:
+        await queue.put({"short_code": "bench", "ip_address": ip})
+    request_seconds = time.perf_counter() - started
+
+    # Фоновая часть: пакеты по batch_size, как при сбросе визитов
+    started = time.perf_counter()
+    while not queue.queue.empty():
+        service.enrich(queue._take_batch())
+    background_seconds = time.perf_counter() - started
+    service.close()
+    return request_seconds, background_seconds
+
+
+def per_request_us(seconds: float, count: int) -> float:
+    return round(seconds / count * 1e6, 3)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default="app/GeoLite2-Country.mmdb")
+    parser.add_argument("--requests", type=int, default=200000)
+    parser.add_argument("--unique", type=int, default=20000, help="различных IP")
+    parser.add_argument("--zipf", type=float, default=1.1, help="показатель распределения Ципфа")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    ips = zipf_ips(args.unique, args.requests, args.zipf, args.seed)
+
+    uncached = GeoIPService(path=args.db, cache_capacity=0)
+    uncached.maybe_reload()
+    if uncached.stats()["loaded"] is False:
+        sys.exit(f"База GeoIP {args.db} недоступна")
+    per_request_seconds = bench_lookup(uncached, ips)
+    uncached.close()
+
+    cached = GeoIPService(path=args.db)
+    cached_seconds = bench_lookup(cached, ips)
+    hit_ratio = cached.cache.stats()["hit_ratio"]
+    cached.close()
+
+    request_seconds, background_seconds = await bench_deferred(args.db, ips, args.batch_size)
+
+    print(json.dumps({
+        "requests": args.requests,
+        "unique_ips": args.unique,
+        "per_request_us": per_request_us(per_request_seconds, args.requests),
+        "cached_us": per_request_us(cached_seconds, args.requests),
+        "cached_hit_ratio": hit_ratio,
+        "deferred_request_path_us": per_request_us(request_seconds, args.requests),
+        "deferred_background_us": per_request_us(background_seconds, args.requests),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,283 @@
+"""
+Нагрузочный прогон приложения: редиректы, сокращение ссылок, статистика и поиск.
+
+Приложение из app.main запускается в этом же процессе вместе с lifespan
+(очередь визитов, cache_bus, планировщик) и вызывается напрямую через ASGI,
+без сети: замеряется обработка запроса, а не HTTP-стек. Нужны локальные
+PostgreSQL и Redis из .env (например, docker-compose up -d db redis);
+лучше отдельная база - прогон создаёт ссылки и визиты.
+
+Нагрузки (--workloads, через запятую):
+
+  redirect      - GET /links/{code}, коды по закону Ципфа (--zipf-s) из --links ссылок;
+  shorten       - POST /links/shorten, каждый раз новый URL;
+  shorten_batch - POST /links/shorten/batch по --batch-size ссылок;
+  stats         - GET /links/{code}/stats, коды по закону Ципфа;
+  search        - GET /links/search по URL засеянных ссылок.
+
+Для каждой нагрузки - p50/p95/p99 задержки, RPS, ошибки и число обращений
+к PostgreSQL и Redis на запрос (по метрикам app/metrics.py, с учётом фоновой
+записи визитов во время прогона). Результат сохраняется в JSON вместе с коммитом,
+--compare выводит изменения относительно прошлого прогона
+(LOG_LEVEL=WARNING убирает логи приложения из вывода):
+
+    LOG_LEVEL=WARNING python -m benchmarks.bench_load --requests 20000 --concurrency 50
+    python -m benchmarks.bench_load --compare benchmarks/results/<коммит>.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import time
+import uuid
+from urllib.parse import urlencode
+
+from app import metrics
+from app.main import app
+
+WORKLOADS = ("redirect", "shorten", "shorten_batch", "stats", "search")
+
+URL_PREFIX = "https://bench.example.com/articles"
+
+
+async def _never():
+    await asyncio.Event().wait()
+
+
+async def call(method: str, path: str, query: dict = None, body=None) -> tuple:
+    """Один запрос к приложению через ASGI. Возвращает (статус, тело)."""
+    payload = json.dumps(body).encode() if body is not None else b""
+    headers = [(b"host", b"bench"), (b"user-agent", b"bench-load/1.0")]
+    if body is not None:
+        headers += [(b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode())]
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": urlencode(query or {}).encode(),
+        "headers": headers,
+        "server": ("bench", 80),
+        "client": (f"10.0.{random.randint(0, 255)}.{random.randint(1, 254)}", 50000),
+    }
+    sent = False
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            # Тело уже передано; ответ с потоковой выдачей ждёт отключения клиента
+            await _never()
+        sent = True
+        return {"type": "http.request", "body": payload, "more_body": False}
+
+    status = None
+    chunks = []
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return status, b"".join(chunks)
+
+
+def _call_counts() -> dict:
+    """Накопленное число запросов к PostgreSQL и команд/пайплайнов Redis в этом процессе."""
+    counts = {}
+    for metric, prefix in ((metrics.DB_LATENCY, "db"), (metrics.REDIS_LATENCY, "redis")):
+        for family in metric.collect():
+            for sample in family.samples:
+                if sample.name.endswith("_count"):
+                    key = f"{prefix}:{sample.labels['operation']}"
+                    counts[key] = counts.get(key, 0) + sample.value
+    return counts
+
+
+def _percentile(values: list, p: float) -> float:
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+def zipf_sequence(items: list, count: int, s: float, rng: random.Random) -> list:
+    weights = [1 / rank ** s for rank in range(1, len(items) + 1)]
+    return rng.choices(items, weights=weights, k=count)
+
+
+async def run_workload(requests: list, concurrency: int, ok_statuses: set) -> dict:
+    """Выполняет запросы (метод, путь, query, тело) в concurrency потоков и собирает показатели."""
+    latencies = []
+    errors = {}
+    position = 0
+
+    async def worker():
+        nonlocal position
+        while position < len(requests):
+            method, path, query, body = requests[position]
+            position += 1
+            started = time.perf_counter()
+            try:
+                status, _ = await call(method, path, query, body)
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            if status not in ok_statuses:
+                errors[str(status)] = errors.get(str(status), 0) + 1
+
+    before = _call_counts()
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    after = _call_counts()
+
+    latencies.sort()
+    total = len(latencies)
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        "rps": round(total / elapsed, 1) if elapsed else None,
+        "p50_ms": round(_percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(_percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3),
+        "errors": errors,
+        "calls_per_request": {
+            key: round((after.get(key, 0) - before.get(key, 0)) / total, 3)
+            for key in sorted(after)
+            if after.get(key, 0) != before.get(key, 0)
+        },
+    }
+
+
+async def seed_links(count: int, batch_size: int, run_id: str) -> list:
+    """Создаёт ссылки для редиректов, статистики и поиска. Возвращает [(код, URL)]."""
+    links = []
+    for start in range(0, count, batch_size):
+        items = [
+            {"original_url": f"{URL_PREFIX}/{run_id}/seed/{n}"}
+            for n in range(start, min(count, start + batch_size))
+        ]
+        status, body = await call("POST", "/links/shorten/batch", body=items)
+        if status != 200:
+            raise SystemExit(f"Не удалось создать ссылки: {status} {body[:200]!r}")
+        for result in json.loads(body)["results"]:
+            links.append((result["custom_alias"], result["original_url"]))
+    return links
+
+
+def build_requests(name: str, args, links: list, rng: random.Random, run_id: str) -> list:
+    count = args.requests
+    if name == "redirect":
+        return [("GET", f"/links/{code}", None, None) for code, _ in zipf_sequence(links, count, args.zipf_s, rng)]
+    if name == "stats":
+        return [("GET", f"/links/{code}/stats", None, None) for code, _ in zipf_sequence(links, count, args.zipf_s, rng)]
+    if name == "search":
+        return [
+            ("GET", "/links/search", {"original_url": url}, None)
+            for _, url in zipf_sequence(links, count, args.zipf_s, rng)
+        ]
+    if name == "shorten":
+        return [
+            ("POST", "/links/shorten", None, {"original_url": f"{URL_PREFIX}/{run_id}/single/{n}"})
+            for n in range(count)
+        ]
+    if name == "shorten_batch":
+        return [
+            ("POST", "/links/shorten/batch", None, [
+                {"original_url": f"{URL_PREFIX}/{run_id}/batch/{n}/{i}"} for i in range(args.batch_size)
+            ])
+            for n in range(max(1, count // args.batch_size))
+        ]
+    raise SystemExit(f"Неизвестная нагрузка {name}: одна из {', '.join(WORKLOADS)}")
+
+
+OK_STATUSES = {
+    "redirect": {307},
+    "shorten": {200},
+    "shorten_batch": {200},
+    "stats": {200},
+    "search": {200},
+}
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def compare(current: dict, previous: dict) -> dict:
+    """Изменение ключевых показателей в процентах: + - медленнее (для задержек) или быстрее (для RPS)."""
+    changes = {}
+    for name, result in current["workloads"].items():
+        old = previous.get("workloads", {}).get(name)
+        if not old:
+            continue
+        changes[name] = {
+            key: round((result[key] - old[key]) / old[key] * 100, 1)
+            for key in ("rps", "p50_ms", "p95_ms", "p99_ms")
+            if old.get(key)
+        }
+    return changes
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workloads", default=",".join(WORKLOADS))
+    parser.add_argument("--requests", type=int, default=10000, help="запросов на нагрузку")
+    parser.add_argument("--warmup", type=int, default=500, help="запросов прогрева перед каждой нагрузкой")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--links", type=int, default=10000, help="засеянных ссылок")
+    parser.add_argument("--zipf-s", type=float, default=1.1)
+    parser.add_argument("--batch-size", type=int, default=100, help="ссылок в запросе shorten_batch")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="файл результата (по умолчанию benchmarks/results/<коммит>.json)")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    random.seed(args.seed)
+    run_id = uuid.uuid4().hex[:8]
+    names = [name.strip() for name in args.workloads.split(",") if name.strip()]
+
+    report = {
+        "commit": _git_commit(),
+        "run_id": run_id,
+        "params": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "workloads": {},
+    }
+    async with app.router.lifespan_context(app):
+        links = await seed_links(args.links, 1000, run_id)
+        for name in names:
+            if args.warmup:
+                warmup = argparse.Namespace(**{**vars(args), "requests": args.warmup})
+                await run_workload(build_requests(name, warmup, links, rng, f"{run_id}w"), args.concurrency, OK_STATUSES[name])
+            requests = build_requests(name, args, links, rng, run_id)
+            report["workloads"][name] = await run_workload(requests, args.concurrency, OK_STATUSES[name])
+            print(json.dumps({name: report["workloads"][name]}, ensure_ascii=False))
+
+    if args.compare:
+        with open(args.compare) as f:
+            report["compare"] = {"baseline": args.compare, "change_percent": compare(report, json.load(f))}
+        print(json.dumps(report["compare"], ensure_ascii=False, indent=2))
+
+    output = args.output or os.path.join("benchmarks", "results", f"{report['commit']}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результат: {output}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
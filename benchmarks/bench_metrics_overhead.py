@@ -0,0 +1,144 @@
+"""
+Добавка метрик (app/metrics.py) ко времени редиректа GET /links/{short_code}
+и проверка бюджета METRICS_REDIRECT_BUDGET_US.
+
+Обработчик редиректа вызывается напрямую через ASGI, без сети и сервера:
+одно и то же приложение FastAPI с MetricsMiddleware и без него, раунды
+чередуются, берётся медиана. К middleware добавляется стоимость замеров
+на каждом варианте редиректа:
+
+  local_hit - ссылка в локальном кэше воркера: только middleware;
+  redis_hit - плюс пайплайн Redis и счётчик попаданий link:;
+  db_miss   - плюс промах link:, запрос к PostgreSQL и пайплайн записи в Redis.
+
+Код выхода 1, если хотя бы один вариант превышает бюджет. Запуск из корня проекта
+(для multiprocess-режима задайте PROMETHEUS_MULTIPROC_DIR, как в контейнере):
+
+    python -m benchmarks.bench_metrics_overhead --requests 20000 --rounds 7
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+
+from fastapi import FastAPI
+from fastapi.responses import RedirectResponse
+
+from app import metrics
+from app.config import METRICS_REDIRECT_BUDGET_US
+
+
+def build_app(instrumented: bool) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/links/{short_code}")
+    async def redirect(short_code: str):
+        return RedirectResponse("https://example.com/")
+
+    if instrumented:
+        app.add_middleware(metrics.MetricsMiddleware)
+    return app
+
+
+def _scope(short_code: str) -> dict:
+    path = f"/links/{short_code}"
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"bench"), (b"user-agent", b"bench")],
+        "server": ("bench", 80),
+        "client": ("127.0.0.1", 50000),
+    }
+
+
+async def _receive():
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+async def _send(message):
+    pass
+
+
+async def bench_requests(app: FastAPI, count: int) -> float:
+    """Микросекунд на запрос."""
+    started = time.perf_counter()
+    for i in range(count):
+        await app(_scope(f"c{i % 1000}"), _receive, _send)
+    return (time.perf_counter() - started) / count * 1e6
+
+
+def bench_calls(call, count: int) -> float:
+    """Микросекунд на вызов."""
+    started = time.perf_counter()
+    for _ in range(count):
+        call()
+    return (time.perf_counter() - started) / count * 1e6
+
+
+def _timed(observe, *labels):
+    # Как в обёртках: два perf_counter и observe
+    def call():
+        started = time.perf_counter()
+        observe(*labels, time.perf_counter() - started)
+    return call
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=7)
+    parser.add_argument("--budget-us", type=float, default=METRICS_REDIRECT_BUDGET_US)
+    args = parser.parse_args()
+
+    plain, instrumented = build_app(False), build_app(True)
+    # Прогрев: маршруты, дочерние метрики, кэши Starlette
+    await bench_requests(plain, 1000)
+    await bench_requests(instrumented, 1000)
+
+    plain_us, instrumented_us = [], []
+    for _ in range(args.rounds):
+        plain_us.append(await bench_requests(plain, args.requests))
+        instrumented_us.append(await bench_requests(instrumented, args.requests))
+    middleware_us = max(0.0, statistics.median(b - a for a, b in zip(plain_us, instrumented_us)))
+
+    redis_us = statistics.median(bench_calls(_timed(metrics.observe_redis, "pipeline"), args.requests) for _ in range(args.rounds))
+    db_us = statistics.median(bench_calls(_timed(metrics.observe_db, "primary", "select"), args.requests) for _ in range(args.rounds))
+    lookup_us = statistics.median(
+        bench_calls(lambda: metrics.record_cache_lookup("link", True), args.requests) for _ in range(args.rounds)
+    )
+
+    overhead = {
+        "local_hit": middleware_us,
+        "redis_hit": middleware_us + redis_us + lookup_us,
+        "db_miss": middleware_us + 2 * redis_us + lookup_us + db_us,
+    }
+    report = {
+        "multiprocess": metrics.MULTIPROCESS,
+        "requests_per_round": args.requests,
+        "rounds": args.rounds,
+        "redirect_us": round(statistics.median(plain_us), 2),
+        "redirect_instrumented_us": round(statistics.median(instrumented_us), 2),
+        "middleware_us": round(middleware_us, 2),
+        "redis_observe_us": round(redis_us, 2),
+        "db_observe_us": round(db_us, 2),
+        "cache_lookup_us": round(lookup_us, 2),
+        "overhead_us": {name: round(value, 2) for name, value in overhead.items()},
+        "budget_us": args.budget_us,
+        "within_budget": all(value <= args.budget_us for value in overhead.values()),
+    }
+    print(json.dumps(report, indent=2))
+    if not report["within_budget"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
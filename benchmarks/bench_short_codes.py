@@ -0,0 +1,92 @@
+"""
+Сравнение пропускной способности генерации коротких кодов:
+старый режим hex (SHA-256 + проверка EXISTS в Redis и SELECT в PostgreSQL на каждый код)
+и выдача из зарезервированных блоков с base62-кодированием.
+
+Запуск из корня проекта (нужен тот же .env, что и приложению):
+
+    python -m benchmarks.bench_short_codes --count 20000 --rtt-ms 0.5
+    python -m benchmarks.bench_short_codes --count 20000 --live
+
+Без --live обращения к хранилищам имитируются задержкой --rtt-ms,
+с --live выполняются настоящие запросы к Redis и PostgreSQL.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from sqlalchemy import select
+
+from app.database import AsyncSessionLocal
+from app.link_store import short_code_cached
+from app.models import ShortLink
+from app.redis_cache import get_redis
+from app.short_codes import (
+    CodeAllocator,
+    generate_short_code,
+    reserve_from_redis,
+    reserve_from_sequence,
+)
+
+URL = "https://example.com/some/long/path?utm_source=bench"
+
+
+async def bench_hex(count: int, rtt: float, live: bool) -> float:
+    started = time.perf_counter()
+    if live:
+        async with get_redis() as redis, AsyncSessionLocal() as db:
+            for _ in range(count):
+                code = generate_short_code(URL)
+                await short_code_cached(redis, code)
+                await db.execute(select(ShortLink.id).where(ShortLink.short_code == code))
+    else:
+        for _ in range(count):
+            generate_short_code(URL)
+            await asyncio.sleep(2 * rtt)  # EXISTS + SELECT
+    return time.perf_counter() - started
+
+
+async def bench_blocks(count: int, block_size: int, rtt: float, live: bool, mode: str) -> float:
+    if live:
+        reserve = reserve_from_redis if mode == "redis" else reserve_from_sequence
+    else:
+        counter = 0
+
+        async def reserve(n):
+            nonlocal counter
+            await asyncio.sleep(rtt)
+            counter += n
+            return list(range(counter - n + 1, counter + 1))
+
+    allocator = CodeAllocator(mode=mode, block_size=block_size, reserve=reserve)
+    started = time.perf_counter()
+    for _ in range(count):
+        await allocator.next_code()
+    return time.perf_counter() - started
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=20000)
+    parser.add_argument("--block-size", type=int, default=1000)
+    parser.add_argument("--rtt-ms", type=float, default=0.5, help="имитация round-trip без --live")
+    parser.add_argument("--mode", choices=("sequence", "redis"), default="sequence")
+    parser.add_argument("--live", action="store_true")
+    args = parser.parse_args()
+
+    rtt = args.rtt_ms / 1000
+    hex_seconds = await bench_hex(args.count, rtt, args.live)
+    block_seconds = await bench_blocks(args.count, args.block_size, rtt, args.live, args.mode)
+
+    print(json.dumps({
+        "count": args.count,
+        "live": args.live,
+        "hex_codes_per_second": round(args.count / hex_seconds),
+        f"{args.mode}_codes_per_second": round(args.count / block_seconds),
+        "speedup": round(hex_seconds / block_seconds, 1),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,232 @@
+"""
+Размер и скорость запросов к визитам до и после перехода на секционированную
+таблицу со справочниками (миграция f4b2d8e07a19).
+
+В отдельной схеме bench_visit_storage создаются две таблицы с одинаковыми
+синтетическими визитами:
+
+  legacy  - прежний формат: одна таблица, URL, домены, тип устройства и IP строками;
+  compact - секции по месяцам, домен - номер из справочника, тип устройства - enum,
+            IP - inet, URL берётся из таблицы ссылок.
+
+Затем сравниваются размеры (с индексами и TOAST) и время типичных запросов
+статистики. Нужна база из .env; схема удаляется после прогона (--keep - оставить).
+
+    python -m benchmarks.bench_visit_storage --rows 2000000 --months 12
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from app.database import engine
+from app.partitions import add_months, month_start, months_between
+
+SCHEMA = "bench_visit_storage"
+
+
+def _setup_sql(rows: int, links: int, owners: int, domains: int, months: int, first_month) -> list:
+    last_month = add_months(first_month, months - 1)
+    statements = [
+        f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE",
+        f"CREATE SCHEMA {SCHEMA}",
+        f"""CREATE TABLE {SCHEMA}.short_links (
+                short_code VARCHAR PRIMARY KEY,
+                original_url VARCHAR NOT NULL
+            )""",
+        f"""INSERT INTO {SCHEMA}.short_links
+            SELECT 'c' || n, 'https://www.site' || (n % {domains}) || '.com/articles/' || n
+                   || '?utm_source=newsletter&utm_medium=email&utm_campaign=autumn'
+            FROM generate_series(1, {links}) AS n""",
+        # Прежний формат
+        f"""CREATE TABLE {SCHEMA}.visits_legacy (
+                id SERIAL PRIMARY KEY,
+                owner INTEGER,
+                timestamp TIMESTAMP,
+                short_code VARCHAR NOT NULL,
+                original_url VARCHAR NOT NULL,
+                domain_1st VARCHAR,
+                domain_2nd VARCHAR,
+                ip_address VARCHAR NOT NULL,
+                device_type VARCHAR NOT NULL,
+                country VARCHAR,
+                referer VARCHAR
+            )""",
+        f"""INSERT INTO {SCHEMA}.visits_legacy (owner, timestamp, short_code, original_url, domain_1st,
+                                                domain_2nd, ip_address, device_type, country, referer)
+            SELECT s.n % {owners}, s.ts, l.short_code, l.original_url, 'com',
+                   'site' || (s.code % {domains}) || '.com',
+                   (s.n % 223 + 1) || '.' || (s.n % 251) || '.' || (s.n % 241) || '.' || (s.n % 239 + 1),
+                   (ARRAY['desktop', 'mobile', 'tablet', 'bot'])[s.n % 4 + 1],
+                   (ARRAY['US', 'RU', 'DE', 'FR', 'GB', NULL])[s.n % 6 + 1],
+                   (ARRAY['https://google.com/', 'https://t.me/', NULL])[s.n % 3 + 1]
+            FROM (
+                SELECT n, n % {links} + 1 AS code,
+                       TIMESTAMP '{first_month.isoformat()}'
+                         + (n::float / {rows}) * (TIMESTAMP '{add_months(last_month, 1).isoformat()}'
+                                                  - TIMESTAMP '{first_month.isoformat()}') AS ts
+                FROM generate_series(1, {rows}) AS n
+            ) s
+            JOIN {SCHEMA}.short_links l ON l.short_code = 'c' || s.code""",
+        f"CREATE INDEX ON {SCHEMA}.visits_legacy (timestamp)",
+        f"CREATE INDEX ON {SCHEMA}.visits_legacy (short_code)",
+        f"CREATE INDEX ON {SCHEMA}.visits_legacy (owner, id)",
+        # Новый формат
+        f"CREATE TYPE {SCHEMA}.device_type AS ENUM ('bot', 'tablet', 'mobile', 'desktop', 'unknown')",
+        f"""CREATE TABLE {SCHEMA}.domains (
+                id SERIAL PRIMARY KEY,
+                name VARCHAR UNIQUE NOT NULL,
+                zone VARCHAR NOT NULL
+            )""",
+        f"""INSERT INTO {SCHEMA}.domains (name, zone)
+            SELECT DISTINCT domain_2nd, domain_1st FROM {SCHEMA}.visits_legacy""",
+        f"""CREATE TABLE {SCHEMA}.visits (
+                id BIGINT NOT NULL,
+                timestamp TIMESTAMP NOT NULL,
+                owner INTEGER,
+                short_code VARCHAR NOT NULL,
+                domain_id INTEGER,
+                ip_address INET,
+                device_type {SCHEMA}.device_type NOT NULL,
+                country VARCHAR(2),
+                referer VARCHAR,
+                PRIMARY KEY (id, timestamp)
+            ) PARTITION BY RANGE (timestamp)""",
+    ]
+    for month in months_between(first_month, last_month):
+        statements.append(
+            f"CREATE TABLE {SCHEMA}.visits_{month.year:04d}_{month.month:02d} PARTITION OF {SCHEMA}.visits "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+        )
+    statements += [
+        f"""INSERT INTO {SCHEMA}.visits
+            SELECT v.id, v.timestamp, v.owner, v.short_code, d.id, v.ip_address::inet,
+                   v.device_type::{SCHEMA}.device_type, v.country, v.referer
+            FROM {SCHEMA}.visits_legacy v
+            JOIN {SCHEMA}.domains d ON d.name = v.domain_2nd""",
+        f"CREATE INDEX ON {SCHEMA}.visits (timestamp)",
+        f"CREATE INDEX ON {SCHEMA}.visits (short_code)",
+        f"CREATE INDEX ON {SCHEMA}.visits (owner, id)",
+        f"VACUUM ANALYZE {SCHEMA}.visits_legacy",
+        f"VACUUM ANALYZE {SCHEMA}.visits",
+        f"VACUUM ANALYZE {SCHEMA}.domains",
+        f"VACUUM ANALYZE {SCHEMA}.short_links",
+    ]
+    return statements
+
+
+# Одни и те же запросы статистики к обеим таблицам
+QUERIES = {
+    "owner_page": {
+        "legacy": f"""SELECT id, short_code, original_url, timestamp, domain_1st, domain_2nd,
+                             ip_address, device_type, country, referer
+                      FROM {SCHEMA}.visits_legacy WHERE owner = :owner ORDER BY id LIMIT 1000""",
+        "compact": f"""SELECT v.id, v.short_code, l.original_url, v.timestamp, d.zone, d.name,
+                              host(v.ip_address), v.device_type::text, v.country, v.referer
+                       FROM {SCHEMA}.visits v
+                       JOIN {SCHEMA}.short_links l ON l.short_code = v.short_code
+                       LEFT JOIN {SCHEMA}.domains d ON d.id = v.domain_id
+                       WHERE v.owner = :owner ORDER BY v.id LIMIT 1000""",
+    },
+    "link_last_30_days": {
+        "legacy": f"""SELECT count(*) FROM {SCHEMA}.visits_legacy
+                      WHERE short_code = :code AND timestamp >= :since""",
+        "compact": f"""SELECT count(*) FROM {SCHEMA}.visits
+                       WHERE short_code = :code AND timestamp >= :since""",
+    },
+    "month_devices": {
+        "legacy": f"""SELECT device_type, count(*) FROM {SCHEMA}.visits_legacy
+                      WHERE timestamp >= :month AND timestamp < :next_month GROUP BY 1""",
+        "compact": f"""SELECT device_type, count(*) FROM {SCHEMA}.visits
+                       WHERE timestamp >= :month AND timestamp < :next_month GROUP BY 1""",
+    },
+}
+
+
+async def _sizes(conn) -> dict:
+    legacy = (await conn.execute(text(
+        f"SELECT pg_total_relation_size('{SCHEMA}.visits_legacy')"
+    ))).scalar()
+    compact = (await conn.execute(text(
+        f"SELECT sum(pg_total_relation_size(relid)) FROM pg_partition_tree('{SCHEMA}.visits')"
+    ))).scalar()
+    domains = (await conn.execute(text(f"SELECT pg_total_relation_size('{SCHEMA}.domains')"))).scalar()
+    return {"legacy_bytes": legacy, "compact_bytes": int(compact) + domains}
+
+
+async def _latency(conn, sql: str, params_factory, repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await conn.execute(text(sql), params_factory())
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        "p50_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(timings[int(len(timings) * 0.95) - 1], 3),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--links", type=int, default=10000)
+    parser.add_argument("--owners", type=int, default=500)
+    parser.add_argument("--domains", type=int, default=2000)
+    parser.add_argument("--months", type=int, default=12)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--keep", action="store_true", help="не удалять схему после прогона")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    first_month = add_months(month_start(datetime.now()), -(args.months - 1))
+    last_month = add_months(first_month, args.months - 1)
+    since = datetime.now() - timedelta(days=30)
+
+    def params():
+        month = add_months(first_month, rng.randrange(args.months))
+        return {
+            "owner": rng.randrange(args.owners),
+            "code": f"c{rng.randint(1, args.links)}",
+            "since": since,
+            "month": datetime.combine(month, datetime.min.time()),
+            "next_month": datetime.combine(add_months(month, 1), datetime.min.time()),
+        }
+
+    # VACUUM не выполняется внутри транзакции
+    conn = await engine.connect()
+    await conn.execution_options(isolation_level="AUTOCOMMIT")
+    try:
+        started = time.perf_counter()
+        for sql in _setup_sql(args.rows, args.links, args.owners, args.domains, args.months, first_month):
+            await conn.execute(text(sql))
+        setup_seconds = time.perf_counter() - started
+
+        report = {"rows": args.rows, "months": f"{first_month}..{last_month}", "setup_seconds": round(setup_seconds, 1)}
+        sizes = await _sizes(conn)
+        report.update(sizes)
+        report["legacy_bytes_per_row"] = round(sizes["legacy_bytes"] / args.rows, 1)
+        report["compact_bytes_per_row"] = round(sizes["compact_bytes"] / args.rows, 1)
+        report["size_ratio"] = round(sizes["compact_bytes"] / sizes["legacy_bytes"], 3)
+
+        for name, variants in QUERIES.items():
+            report[name] = {
+                variant: await _latency(conn, sql, params, args.repeat)
+                for variant, sql in variants.items()
+            }
+        print(json.dumps(report, indent=2))
+    finally:
+        if not args.keep:
+            await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        await conn.close()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
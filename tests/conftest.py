@@ -0,0 +1,6 @@
+import os
+
+# app.config читает обязательные настройки при импорте; базы и Redis тестам не нужны
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
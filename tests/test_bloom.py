@@ -0,0 +1,57 @@
+import pytest
+
+from app.bloom import BloomFilter, ShortCodeFilter
+
+
+def test_no_false_negatives():
+    bloom = BloomFilter(capacity=5000, fp_rate=0.01)
+    codes = [f"code{number}" for number in range(5000)]
+    for code in codes:
+        bloom.add(code)
+    assert all(code in bloom for code in codes)
+    assert bloom.count == 5000
+
+
+def test_false_positive_rate_at_capacity():
+    capacity, fp_rate = 20000, 0.01
+    bloom = BloomFilter(capacity=capacity, fp_rate=fp_rate)
+    for number in range(capacity):
+        bloom.add(f"in{number}")
+    # Расчётная доля при заполнении до capacity совпадает с заданной
+    assert bloom.expected_fp_rate() == pytest.approx(fp_rate, rel=0.2)
+    probes = 50000
+    false_positives = sum(f"out{number}" in bloom for number in range(probes))
+    assert false_positives / probes < 2 * fp_rate
+
+
+def test_rejects_bad_fp_rate():
+    with pytest.raises(ValueError):
+        BloomFilter(capacity=10, fp_rate=0)
+    with pytest.raises(ValueError):
+        BloomFilter(capacity=10, fp_rate=1)
+
+
+def test_short_code_filter_answers_maybe_until_built():
+    short_codes = ShortCodeFilter(fp_rate=0.01)
+    assert short_codes.might_contain("missing")
+    assert short_codes.checks == 0
+
+    short_codes._filter = BloomFilter(capacity=2, fp_rate=0.01)
+    short_codes._on_link_event("abc")
+    assert short_codes.might_contain("abc")
+    assert not short_codes.might_contain("zzz-missing")
+    assert (short_codes.checks, short_codes.negatives) == (2, 1)
+
+
+def test_short_code_filter_requests_rebuild():
+    short_codes = ShortCodeFilter(fp_rate=0.01)
+    short_codes._filter = BloomFilter(capacity=2, fp_rate=0.01)
+    for code in ("a", "b"):
+        short_codes.add(code)
+    assert not short_codes._rebuild.is_set()
+    # Переполнение фильтра и переподключение к каналу запускают пересборку
+    short_codes.add("c")
+    assert short_codes._rebuild.is_set()
+    short_codes._rebuild.clear()
+    short_codes._on_link_event("*")
+    assert short_codes._rebuild.is_set()
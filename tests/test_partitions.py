@@ -0,0 +1,80 @@
+import asyncio
+from datetime import date, datetime
+
+from app import backfill_visits
+from app.partitions import add_months, month_start, months_between, partition_ddl, partition_name
+
+
+def test_add_months_crosses_year():
+    assert add_months(date(2026, 11, 1), 1) == date(2026, 12, 1)
+    assert add_months(date(2026, 12, 1), 1) == date(2027, 1, 1)
+    assert add_months(date(2026, 1, 1), -1) == date(2025, 12, 1)
+    assert add_months(date(2026, 10, 1), 27) == date(2029, 1, 1)
+
+
+def test_month_start_accepts_datetime():
+    assert month_start(datetime(2026, 10, 18, 23, 59)) == date(2026, 10, 1)
+    assert type(month_start(datetime(2026, 10, 18))) is date
+
+
+def test_months_between_dates():
+    assert months_between(date(2026, 11, 15), date(2027, 2, 1)) == [
+        date(2026, 11, 1), date(2026, 12, 1), date(2027, 1, 1), date(2027, 2, 1),
+    ]
+    assert months_between(date(2026, 10, 1), date(2026, 10, 31)) == [date(2026, 10, 1)]
+
+
+def test_months_between_datetimes():
+    # min/max(timestamp) из visits_legacy - datetime: сравнение с date падало TypeError
+    first = datetime(2025, 12, 31, 23, 0)
+    last = datetime(2026, 2, 3, 4, 5)
+    assert months_between(first, last) == [date(2025, 12, 1), date(2026, 1, 1), date(2026, 2, 1)]
+
+
+def test_partition_ddl_bounds():
+    assert partition_name(date(2026, 3, 1)) == "visits_2026_03"
+    assert partition_ddl(date(2026, 12, 1)) == (
+        "CREATE TABLE IF NOT EXISTS visits_2026_12 PARTITION OF visits "
+        "FOR VALUES FROM ('2026-12-01') TO ('2027-01-01')"
+    )
+
+
+class _Result:
+    def __init__(self, row):
+        self.row = row
+
+    def one(self):
+        return self.row
+
+
+class _FakeSession:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.statements = []
+        self.commits = 0
+
+    async def execute(self, statement, params=None):
+        sql = str(statement)
+        self.statements.append(sql)
+        if sql.startswith("SELECT min(timestamp)"):
+            return _Result(self.bounds)
+        return _Result(None)
+
+    async def commit(self):
+        self.commits += 1
+
+
+def test_backfill_creates_partitions_for_legacy_timestamps():
+    db = _FakeSession((datetime(2026, 8, 20, 12, 30), datetime(2026, 10, 2, 8, 0)))
+    asyncio.run(backfill_visits._ensure_partitions(db))
+
+    created = [sql for sql in db.statements if "FOR VALUES FROM" in sql]
+    assert created == [partition_ddl(date(2026, month, 1)) for month in (8, 9, 10)]
+    assert any("visits_default PARTITION OF visits DEFAULT" in sql for sql in db.statements)
+    assert db.commits == 1
+
+
+def test_backfill_empty_legacy_table():
+    db = _FakeSession((None, None))
+    asyncio.run(backfill_visits._ensure_partitions(db))
+    assert not [sql for sql in db.statements if "FOR VALUES FROM" in sql]
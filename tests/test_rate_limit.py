@@ -0,0 +1,98 @@
+import asyncio
+import math
+
+import pytest
+
+from app.rate_limit import Limit, RateLimiter, identity, parse_limits
+
+
+class _FakeRedis:
+    """register_script с корзиной на Python по тем же правилам, что и Lua-скрипт; время задаётся тестом."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.buckets = {}
+        self.calls = 0
+        self.fail = False
+
+    def register_script(self, source):
+        async def script(keys, args, client):
+            self.calls += 1
+            if self.fail:
+                raise ConnectionError("redis недоступен")
+            rate, burst, want = args
+            tokens, ts = self.buckets.get(keys[0], (burst, self.now))
+            tokens = min(burst, tokens + max(0.0, self.now - ts) * rate)
+            granted = min(want, math.floor(tokens))
+            tokens -= granted
+            self.buckets[keys[0]] = (tokens, self.now)
+            retry = (1 - tokens) / rate if granted == 0 else 0
+            return [granted, str(retry)]
+
+        return script
+
+
+def test_parse_limits():
+    assert parse_limits("redirect=ip:100/1:200, shorten=user:20/60") == {
+        "redirect": Limit("ip", 100.0, 200),
+        "shorten": Limit("user", 20 / 60, 20),
+    }
+    assert parse_limits("") == {}
+    with pytest.raises(ValueError):
+        parse_limits("redirect=cookie:10/1")
+
+
+def test_identity_falls_back_to_ip():
+    scope = {"client": ("10.0.0.1", 5000)}
+    assert identity(Limit("user", 1, 1), scope, user_id=7) == "u7"
+    assert identity(Limit("user", 1, 1), scope) == "ip10.0.0.1"
+    assert identity(Limit("token", 1, 1), scope, authorization="Bearer x").startswith("t")
+    assert identity(Limit("token", 1, 1), scope) == "ip10.0.0.1"
+    assert identity(Limit("ip", 1, 1), {}) == "ipunknown"
+
+
+def test_lease_spends_tokens_locally_then_denies():
+    redis = _FakeRedis()
+    limiter = RateLimiter({"redirect": Limit("ip", 1.0, 5)}, lease=3, lease_ttl=60, local_capacity=100)
+
+    async def run():
+        return [await limiter.acquire(redis, "redirect", "ip1") for _ in range(7)]
+
+    results = asyncio.run(run())
+    # 5 жетонов запаса: 3 одним вызовом скрипта, затем оставшиеся 2, затем отказ
+    assert results[:5] == [None] * 5
+    assert results[5] == pytest.approx(1.0)
+    # Повтор до Retry-After отклоняется без Redis
+    assert 0 < results[6] <= 1.0
+    assert redis.calls == 3
+    assert limiter.stats() == {
+        "allowed_local": 3, "allowed_redis": 2, "denied_local": 1, "denied_redis": 1, "errors": 0,
+        "local_keys": 1,
+    }
+
+
+def test_bucket_refills_at_rate():
+    redis = _FakeRedis()
+    limiter = RateLimiter({"shorten": Limit("user", 2.0, 2)}, lease=1, lease_ttl=60, local_capacity=100)
+
+    async def take(count):
+        return [await limiter.acquire(redis, "shorten", "u1") for _ in range(count)]
+
+    assert asyncio.run(take(2)) == [None, None]
+    denied = asyncio.run(take(1))[0]
+    assert denied == pytest.approx(0.5)
+    limiter._local.delete("ratelimit:shorten:u1")
+    redis.now += 1.0
+    # За секунду при 2 жетонах в секунду корзина снова полна, но не больше запаса
+    assert asyncio.run(take(2)) == [None, None]
+    assert asyncio.run(take(1))[0] == pytest.approx(0.5)
+
+
+def test_unknown_route_and_redis_errors_pass():
+    redis = _FakeRedis()
+    redis.fail = True
+    limiter = RateLimiter({"redirect": Limit("ip", 1.0, 1)}, lease=1, lease_ttl=60, local_capacity=100)
+    assert asyncio.run(limiter.acquire(redis, "other", "ip1")) is None
+    assert redis.calls == 0
+    assert asyncio.run(limiter.acquire(redis, "redirect", "ip1")) is None
+    assert limiter.errors == 1
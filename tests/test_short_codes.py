@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+from app.short_codes import BASE62, CodeAllocator, CodeEncoder
+
+
+def test_encoder_is_bijective_on_small_length():
+    # При длине 2 всё пространство из 62^2 номеров должно отобразиться в разные коды
+    encoder = CodeEncoder(min_length=2, salt="test")
+    codes = {encoder.encode(number) for number in range(62 ** 2)}
+    assert len(codes) == 62 ** 2
+    assert all(len(code) == 2 and set(code) <= set(BASE62) for code in codes)
+
+
+def test_encoder_grows_length_without_repeats():
+    encoder = CodeEncoder(min_length=2, salt="test")
+    assert len(encoder.encode(62 ** 2 - 1)) == 2
+    assert len(encoder.encode(62 ** 2)) == 3
+    # Коды разной длины не пересекаются, поэтому на границе длины повторов нет
+    codes = [encoder.encode(number) for number in range(62 ** 2 - 500, 62 ** 2 + 500)]
+    assert len(set(codes)) == len(codes)
+
+
+def test_encoder_depends_on_salt_and_is_stable():
+    first = CodeEncoder(min_length=6, salt="a")
+    assert first.encode(12345) == CodeEncoder(min_length=6, salt="a").encode(12345)
+    assert first.encode(12345) != CodeEncoder(min_length=6, salt="b").encode(12345)
+
+
+def test_allocator_reserves_whole_blocks():
+    reserved = []
+    counter = 0
+
+    async def reserve(count):
+        nonlocal counter
+        reserved.append(count)
+        block = list(range(counter, counter + count))
+        counter += count
+        return block
+
+    encoder = CodeEncoder(min_length=4, salt="test")
+    allocator = CodeAllocator(mode="sequence", block_size=10, encoder=encoder, reserve=reserve)
+
+    async def run():
+        codes = await allocator.allocate(3)
+        codes += await allocator.allocate(25)
+        codes.append(await allocator.next_code())
+        return codes
+
+    codes = asyncio.run(run())
+    assert codes == [encoder.encode(number) for number in range(29)]
+    # Остаток первого блока, затем недостающие 18 номеров одним запросом, затем новый блок
+    assert reserved == [10, 18, 10]
+    assert allocator.blocks_reserved == 3
+
+
+def test_allocator_rejects_unknown_mode():
+    with pytest.raises(ValueError):
+        CodeAllocator(mode="uuid")
+    assert CodeAllocator(mode="hex", reserve=lambda count: None).collision_free is False
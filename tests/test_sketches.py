@@ -0,0 +1,76 @@
+import random
+from collections import Counter
+
+import pytest
+
+from app.sketches import HyperLogLog, SpaceSaving
+
+
+def _stream(seed: int, size: int):
+    """Поток значений с тяжёлыми значениями heavy0..heavy4 и длинным хвостом редких."""
+    rng = random.Random(seed)
+    values = []
+    for _ in range(size):
+        if rng.random() < 0.5:
+            values.append(f"heavy{rng.randrange(5)}")
+        else:
+            values.append(f"tail{rng.randrange(5000)}")
+    return values
+
+
+@pytest.mark.parametrize("distinct", [100, 10000, 100000])
+def test_hll_estimate_within_error(distinct):
+    hll = HyperLogLog(precision=12)
+    for number in range(distinct):
+        hll.add(f"10.0.{number}")
+        # Повторы не меняют оценку
+        hll.add(f"10.0.{number}")
+    # Три стандартные ошибки (1.6% при m = 4096)
+    assert abs(hll.count() - distinct) <= 3 * hll.relative_error * distinct + 1
+
+
+def test_hll_merge_and_roundtrip():
+    first, second = HyperLogLog(precision=12), HyperLogLog(precision=12)
+    for number in range(30000):
+        first.add(f"ip{number}")
+    for number in range(20000, 50000):
+        second.add(f"ip{number}")
+    first.merge(HyperLogLog.from_bytes(second.to_bytes()))
+    assert abs(first.count() - 50000) <= 3 * first.relative_error * 50000
+
+    with pytest.raises(ValueError):
+        first.merge(HyperLogLog(precision=10))
+
+
+def _check_guarantees(sketch: SpaceSaving, truth: Counter):
+    total = sum(truth.values())
+    assert sketch.total == total
+    for value, (count, error) in sketch.counters.items():
+        # Счётчик не занижен и завышен не больше чем на погрешность
+        assert count - error <= truth[value] <= count
+    for value, count in truth.items():
+        if count > total / sketch.k:
+            assert value in sketch.counters
+
+
+def test_space_saving_keeps_heavy_hitters():
+    values = _stream(seed=1, size=20000)
+    sketch = SpaceSaving(k=50)
+    for value in values:
+        sketch.add(value)
+    assert len(sketch.counters) <= 50
+    _check_guarantees(sketch, Counter(values))
+    assert {item["value"] for item in sketch.top(5)} == {f"heavy{n}" for n in range(5)}
+
+
+def test_space_saving_merge_and_roundtrip():
+    first_values, second_values = _stream(seed=2, size=10000), _stream(seed=3, size=10000)
+    first, second = SpaceSaving(k=50), SpaceSaving(k=50)
+    for value in first_values:
+        first.add(value)
+    for value in second_values:
+        second.add(value)
+    first.merge(SpaceSaving.from_bytes(second.to_bytes()))
+    assert len(first.counters) <= 50
+    _check_guarantees(first, Counter(first_values + second_values))
+    assert {item["value"] for item in first.top(5)} == {f"heavy{n}" for n in range(5)}
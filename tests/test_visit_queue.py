@@ -0,0 +1,105 @@
+import asyncio
+
+import pytest
+
+from app.visit_queue import VisitQueue
+
+
+class _RecordingQueue(VisitQueue):
+    """Очередь, которая вместо записи в базу запоминает пакеты; delay - длительность сброса."""
+
+    def __init__(self, delay: float = 0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.delay = delay
+        self.written = []
+
+    async def flush(self, batch: list):
+        if not batch:
+            return
+        await asyncio.sleep(self.delay)
+        self.written.append([visit["n"] for visit in batch])
+
+
+def _visits(count: int):
+    return [{"n": n} for n in range(count)]
+
+
+def test_batches_by_size_and_drains_on_stop():
+    queue = _RecordingQueue(maxsize=100, batch_size=2, flush_interval=0.01, policy="drop_new")
+
+    async def run():
+        queue.start()
+        for visit in _visits(5):
+            await queue.put(visit)
+        await asyncio.sleep(0.1)
+        await queue.stop(timeout=1)
+
+    asyncio.run(run())
+    assert queue.written == [[0, 1], [2, 3], [4]]
+
+
+def test_stop_flushes_partial_batch_and_queue():
+    # Пакет не добран ни по размеру, ни по времени: задача отменяется посреди сбора
+    queue = _RecordingQueue(maxsize=100, batch_size=3, flush_interval=60, policy="drop_new")
+
+    async def run():
+        queue.start()
+        await queue.put({"n": 0})
+        await asyncio.sleep(0.01)
+        await queue.put({"n": 1})
+        await asyncio.sleep(0.01)
+        await queue.stop(timeout=1)
+
+    asyncio.run(run())
+    assert queue.written == [[0, 1]]
+
+
+def test_stop_waits_for_inflight_flush():
+    queue = _RecordingQueue(delay=0.1, maxsize=100, batch_size=2, flush_interval=60, policy="drop_new")
+
+    async def run():
+        queue.start()
+        for visit in _visits(5):
+            await queue.put(visit)
+        # Фоновая задача уже пишет первый пакет, остальное лежит в очереди
+        await asyncio.sleep(0.02)
+        assert queue._flushing is not None
+        await queue.stop(timeout=1)
+
+    asyncio.run(run())
+    assert sorted(n for batch in queue.written for n in batch) == list(range(5))
+    assert queue.written[0] == [0, 1]
+
+
+def test_stop_gives_up_after_timeout():
+    queue = _RecordingQueue(delay=10, maxsize=100, batch_size=10, flush_interval=60, policy="drop_new")
+
+    async def run():
+        await queue.put({"n": 0})
+        await queue.stop(timeout=0.05)
+
+    asyncio.run(run())
+    assert queue.written == []
+
+
+@pytest.mark.parametrize("policy, kept, dropped", [
+    ("drop_new", [0, 1], 1),
+    ("drop_oldest", [1, 2], 1),
+    ("block", [0, 1], 1),
+])
+def test_full_queue_policies(policy, kept, dropped):
+    queue = _RecordingQueue(maxsize=2, batch_size=10, flush_interval=60, policy=policy, enqueue_timeout=0.01)
+
+    async def run():
+        return [await queue.put(visit) for visit in _visits(3)]
+
+    accepted = asyncio.run(run())
+    assert accepted[:2] == [True, True]
+    assert accepted[2] is (policy == "drop_oldest")
+    assert [queue.queue.get_nowait()["n"] for _ in range(2)] == kept
+    assert queue.dropped == dropped
+
+
+def test_rejects_unknown_policy():
+    with pytest.raises(ValueError):
+        VisitQueue(policy="spill")